@@ -0,0 +1,128 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import pathlib
+
+import configuration
+from applogic import aptrepo, offlinerepo, peercache
+from applogic.packagelogic import MainLogic
+from applogic.callbacks import UnifiedProgressReporter
+from i18n import _
+
+log = logging.getLogger("lomanager2_logger")
+
+
+def _console_callbacks() -> dict:
+    # Step descriptions are printed, fine grained progress is not
+    return {
+        "overall_progress_description": print,
+        "overall_progress_percentage": lambda step: None,
+        "progress_description": print,
+        "progress_percentage": lambda percentage: None,
+    }
+
+
+def _console_progress_reporter(total_steps: int) -> UnifiedProgressReporter:
+    return UnifiedProgressReporter(
+        total_steps=total_steps, callbacks=_console_callbacks()
+    )
+
+
+def _print_warnings(app_logic: MainLogic) -> bool:
+    # Prints messages of MainLogic, returns False if any reports a failure
+    is_ok = True
+    for isOK, msg, explanation in app_logic.get_warnings():
+        print(msg + explanation)
+        is_ok = is_ok and isOK
+    return is_ok
+
+
+def export_repository(
+    export_dir: str, saved_packages_dir: str | None, version: str
+) -> int:
+    """Exports saved packages as apt repository, returns exit code"""
+    if saved_packages_dir is None:
+        saved_packages_dir = configuration.offline_copy_dir
+    saved_packages_dir = pathlib.Path(saved_packages_dir)
+    if offlinerepo.is_repository(saved_packages_dir):
+        saved_packages_dir = offlinerepo.version_dir(saved_packages_dir, version)
+        if saved_packages_dir is None:
+            print(_("Requested version of saved packages not found"))
+            return 1
+
+    progress_reporter = _console_progress_reporter(total_steps=1)
+    progress_reporter.step_start(_("Exporting saved packages as apt repository"))
+    is_exported, msg = aptrepo.export_repository(
+        saved_packages_dir, pathlib.Path(export_dir), progress_reporter
+    )
+    if not is_exported:
+        print(msg)
+        return 1
+    progress_reporter.step_end()
+    print(_("Repository ready. Use it with the following sources.list line:"))
+    print(msg)
+    print(_("or install from it with: lomanager2 --install-from-repo {}").format(
+        export_dir
+    ))
+    return 0
+
+
+def install_from_repository(location: str, skip_update_check: bool) -> int:
+    """Installs packages from exported apt repository, returns exit code"""
+    app_logic = MainLogic(skip_update_check=skip_update_check)
+    # Same checks (running package managers, Office) as before any install,
+    # what they block is refused by MainLogic
+    app_logic.check_system_state(**_console_callbacks())
+    _print_warnings(app_logic)
+    app_logic.install_from_repository(
+        repository_location=location, **_console_callbacks()
+    )
+    if not _print_warnings(app_logic):
+        return 1
+    return 0
+
+
+def serve_cache(port: int | None) -> int:
+    """Serves saved packages to peers until interrupted, returns exit code"""
+    try:
+        peercache.serve(port)
+    except KeyboardInterrupt:
+        pass
+    except OSError as error:
+        print(_("Could not start the server: {}").format(error))
+        return 1
+    return 0
+
+
+def prefetch_recommended(rate_limit: int | None) -> int:
+    """Pre-stages recommended LibreOffice (eg. from a timer), returns exit code"""
+    if rate_limit is None:
+        rate_limit = configuration.prefetch_rate_limit
+    # Meant to run in the background, let anything else go first
+    os.nice(19)
+    progress_reporter = _console_progress_reporter(total_steps=1)
+    progress_reporter.step_start(_("Pre-staging recommended LibreOffice"))
+    is_ready, msg = MainLogic(skip_update_check=True).prestage_recommended_office(
+        progress_reporter, rate_limit=rate_limit
+    )
+    print(msg)
+    if not is_ready:
+        return 1
+    progress_reporter.step_end()
+    return 0
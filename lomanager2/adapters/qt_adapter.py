@@ -103,6 +103,16 @@ class Adapter(QObject):
             self._install_from_local_copy
         )
 
+        # Make changes prepared earlier
+        self._app_main_view.actionInstallPrepared.triggered.connect(
+            self._install_prepared
+        )
+
+        # Reinstall LibreOffice kept when it was removed
+        self._app_main_view.actionRestorePrevious.triggered.connect(
+            self._restore_previous
+        )
+
         # Option available to the user: Open help window
         self._app_main_view.actionHelp.triggered.connect(self._show_docs)
 
@@ -217,6 +227,9 @@ class Adapter(QObject):
         self._apply_changes_view.checkbox_force_java_download.setCheckState(
             Qt.CheckState.Unchecked
         )
+        self._apply_changes_view.checkbox_prepare_only.setCheckState(
+            Qt.CheckState.Unchecked
+        )
 
         install_list, removal_list = self._app_logic.get_planned_changes()
 
@@ -254,6 +267,9 @@ class Adapter(QObject):
             is_force_java_download_checked = (
                 self._apply_changes_view.checkbox_force_java_download.isChecked()
             )
+            is_prepare_only_checked = (
+                self._apply_changes_view.checkbox_prepare_only.isChecked()
+            )
             summary = summary.replace("\n", " ")
             summary += (
                 _("Following components will be downloaded: - Java  ")
@@ -265,13 +281,23 @@ class Adapter(QObject):
                 if is_keep_packages_checked
                 else _("Packages will not be kept for later use")
             )
+            summary += (
+                _(" Changes will only be prepared") if is_prepare_only_checked else ""
+            )
             log.info(summary)
 
+            if is_prepare_only_checked:
+                procedure = self._app_logic.prepare_changes
+                proc_steps = self._app_logic.prepare_procedure_step_count
+            else:
+                procedure = self._app_logic.apply_changes
+                proc_steps = self._app_logic.normal_procedure_step_count
+
             # Create a separate thread worker that will run
             # selected procedure from the applogic,
             # pass any variables required by this procedure as well.
             self.procedure_thread = ProcedureWorker(
-                function_to_run=self._app_logic.apply_changes,
+                function_to_run=procedure,
                 keep_packages=is_keep_packages_checked,
                 force_java_download=is_force_java_download_checked,
                 progress_description=self.progress_description_signal.emit,
@@ -280,7 +306,6 @@ class Adapter(QObject):
                 overall_progress_percentage=self.overall_progress_signal.emit,
             )
             # Number of steps differs depending on procedure
-            proc_steps = self._app_logic.normal_procedure_step_count
             self._progress_view.overall_progress_bar.setRange(0, proc_steps)
             # Window title differes depending on procedure
             self._progress_view.setWindowTitle(_("Applying changes"))
@@ -291,6 +316,58 @@ class Adapter(QObject):
         else:
             log.debug(_("Cancel clicked: User decided not to apply changes."))
 
+    def _install_prepared(self):
+        text = _(
+            "Changes prepared earlier will be made now.\n"
+            "This will not work if any packages were installed "
+            "or removed since the changes were prepared."
+        )
+        answer = QMessageBox.question(
+            self._app_main_view, _("Install prepared changes"), text
+        )
+        if answer == QMessageBox.StandardButton.Yes:
+            log.debug(_("Yes clicked: Making prepared changes..."))
+            self.procedure_thread = ProcedureWorker(
+                function_to_run=self._app_logic.commit_prepared_changes,
+                progress_description=self.progress_description_signal.emit,
+                progress_percentage=self.progress_signal.emit,
+                overall_progress_description=self.overall_progress_description_signal.emit,
+                overall_progress_percentage=self.overall_progress_signal.emit,
+            )
+            proc_steps = self._app_logic.commit_procedure_step_count
+            self._progress_view.overall_progress_bar.setRange(0, proc_steps)
+            self._progress_view.setWindowTitle(_("Applying changes"))
+            self._progress_view.progress_bar.setVisible(True)
+            self.thread_worker_ready_signal.emit()
+        else:
+            log.debug(_("No clicked: User decided not to make prepared changes"))
+
+    def _restore_previous(self):
+        text = _(
+            "Installed Office will be removed and the previously installed "
+            "LibreOffice will be restored.\n"
+            "No files will be downloaded."
+        )
+        answer = QMessageBox.question(
+            self._app_main_view, _("Restore previous LibreOffice"), text
+        )
+        if answer == QMessageBox.StandardButton.Yes:
+            log.debug(_("Yes clicked: Restoring previous LibreOffice..."))
+            self.procedure_thread = ProcedureWorker(
+                function_to_run=self._app_logic.rollback_office,
+                progress_description=self.progress_description_signal.emit,
+                progress_percentage=self.progress_signal.emit,
+                overall_progress_description=self.overall_progress_description_signal.emit,
+                overall_progress_percentage=self.overall_progress_signal.emit,
+            )
+            proc_steps = self._app_logic.rollback_procedure_step_count
+            self._progress_view.overall_progress_bar.setRange(0, proc_steps)
+            self._progress_view.setWindowTitle(_("Applying changes"))
+            self._progress_view.progress_bar.setVisible(True)
+            self.thread_worker_ready_signal.emit()
+        else:
+            log.debug(_("No clicked: User decided not to restore LibreOffice"))
+
     def _thread_start(self):
         """Make changes to the GUI and start a prepared worker in a new thread
 
@@ -298,6 +375,9 @@ class Adapter(QObject):
         _check_system_state
         _apply_changes
         _install_from_local_copy
+        _install_prepared
+        _restore_previous
+        _offer_resume
         """
 
         # Block some GUI elements while the procedure is running
@@ -357,6 +437,44 @@ class Adapter(QObject):
         log.debug(_("Emitting GUI locks signal to unlock GUI elements"))
         self.is_GUI_locked_signal.emit(False)
 
+        # Changes interrupted (eg. by power loss) can be continued
+        # (unless making changes is blocked now, they are offered later)
+        flags = self._app_logic.global_flags
+        if (
+            flags.ready_to_apply_changes
+            and not (flags.block_normal_install or flags.block_removal)
+            and self._app_logic.has_interrupted_changes()
+        ):
+            self._offer_resume()
+
+    def _offer_resume(self):
+        text = _(
+            "Previous changes were interrupted before they were completed.\n"
+            "Do you want to resume them now? Files already downloaded "
+            "will not be downloaded again.\n"
+            "If you choose No, the interrupted changes will be forgotten."
+        )
+        answer = QMessageBox.question(
+            self._app_main_view, _("Resume interrupted changes"), text
+        )
+        if answer == QMessageBox.StandardButton.Yes:
+            log.debug(_("Yes clicked: Resuming interrupted changes..."))
+            self.procedure_thread = ProcedureWorker(
+                function_to_run=self._app_logic.resume_changes,
+                progress_description=self.progress_description_signal.emit,
+                progress_percentage=self.progress_signal.emit,
+                overall_progress_description=self.overall_progress_description_signal.emit,
+                overall_progress_percentage=self.overall_progress_signal.emit,
+            )
+            proc_steps = self._app_logic.normal_procedure_step_count
+            self._progress_view.overall_progress_bar.setRange(0, proc_steps)
+            self._progress_view.setWindowTitle(_("Applying changes"))
+            self._progress_view.progress_bar.setVisible(True)
+            self.thread_worker_ready_signal.emit()
+        else:
+            log.debug(_("No clicked: Interrupted changes discarded"))
+            self._app_logic.discard_interrupted_changes()
+
     def _warnings_show(self, warnings):
         error_icon = QMessageBox.Icon.Critical
         good_icon = QMessageBox.Icon.Information
@@ -393,6 +511,15 @@ class Adapter(QObject):
             self._app_main_view.actionInstallFromLocalCopy.setEnabled(
                 not self._app_logic.global_flags.block_local_copy_install
             )
+            flags = self._app_logic.global_flags
+            self._app_main_view.actionInstallPrepared.setEnabled(
+                self._app_logic.has_prepared_changes()
+                and not (flags.block_normal_install or flags.block_removal)
+            )
+            self._app_main_view.actionRestorePrevious.setEnabled(
+                self._app_logic.has_rollback()
+                and not (flags.block_normal_install or flags.block_removal)
+            )
 
     def _check_system_state(self):
         log.debug(_("check system state signal emitted"))
@@ -15,11 +15,14 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
 """
+import functools
+import hashlib
 import logging
 import os
 import pathlib
 import pwd
 import re
+import shlex
 import shutil
 import subprocess
 import tarfile
@@ -29,12 +32,18 @@ import configuration
 
 from i18n import _
 
+from . import transfer
+
 log = logging.getLogger("lomanager2_logger")
 
 # Force English for all executed shell commands
 english_env = os.environ.copy()
 english_env["LANGUAGE"] = "en_US.UTF-8:en_US:en"
 
+# What a name of an rpm package may look like (names coming from outside,
+# eg. a list of packages in a repository, are put in shell commands)
+package_name_regex = re.compile(r"[A-Za-z0-9][A-Za-z0-9._+-]*")
+
 
 def run_shell_command(
     cmd: str, shell="bash", timeout=20, fail_on_error=False
@@ -130,38 +139,114 @@ class HumanUser:
         self.gid = gid
 
 
-def get_system_users() -> list[HumanUser]:
-    """Looks for regular (not services) system users.
-
-    The criteria are that the user has a login shell that is one
-    of the shells listed in /etc/shells and has a home directory in /home.
-    Additionally root user is included.
-    """
+def _read_system_shells() -> list[str]:
     system_shells = []
     with open("/etc/shells", "r") as f:
         for line in f:
             line = line.strip()
             if line and line.startswith("/"):
                 system_shells.append(line)
+    return system_shells
+
+
+@functools.lru_cache(maxsize=None)
+def _getpwuid(uid: int):
+    # Every lookup may be a network query (LDAP etc.), ask once
+    try:
+        return pwd.getpwuid(uid)
+    except KeyError:
+        return None
+
+
+def _users_from_home(home_root: pathlib.Path) -> list:
+    # Owners of directories in /home, only if that is their home directory
+    entries = []
+    try:
+        with os.scandir(home_root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    entries.append(entry)
+    except OSError as error:
+        log.error(_("Can't list {}: {}").format(home_root, error))
+        return []
+    users = []
+    for entry in sorted(entries, key=lambda entry: entry.name):
+        user = _getpwuid(entry.stat(follow_symlinks=False).st_uid)
+        if user is None:
+            continue
+        if os.path.realpath(user.pw_dir) == os.path.realpath(entry.path):
+            users.append(user)
+    return users
+
+
+def _users_from_passwd_file(passwd_file: pathlib.Path) -> list:
+    # Local accounts only, without asking NSS
+    users = []
+    with open(passwd_file, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split(":")
+            if len(fields) != 7 or line.startswith(("#", "+", "-")):
+                continue
+            name, passwd, uid, gid, gecos, home_dir, shell = fields
+            try:
+                users.append(
+                    pwd.struct_passwd(
+                        (name, passwd, int(uid), int(gid), gecos, home_dir, shell)
+                    )
+                )
+            except ValueError:
+                continue
+    return users
+
+
+_system_users = None
+
+
+def get_system_users(refresh: bool = False) -> list[HumanUser]:
+    """Looks for regular (not services) system users.
+
+    The criteria are that the user has a login shell that is one
+    of the shells listed in /etc/shells and has a home directory in /home.
+    Additionally root user is included.
+    Candidates come from configuration.users_source:
+    "home"   - owners of directories in /home (no enumeration of
+               accounts, works with large LDAP etc. directories)
+    "passwd" - local accounts from /etc/passwd only
+    "nss"    - all accounts known to the system
+    The result is cached for the run (unless refresh is True).
+    """
+    global _system_users
+    if _system_users is not None and not refresh:
+        return list(_system_users)
+
+    system_shells = _read_system_shells()
+    if configuration.users_source == "passwd":
+        candidates = _users_from_passwd_file(pathlib.Path("/etc/passwd"))
+    elif configuration.users_source == "nss":
+        candidates = pwd.getpwall()
+    else:
+        candidates = _users_from_home(pathlib.Path("/home"))
 
     human_users = []
-    for user in pwd.getpwall():
-        user.pw_uid
+    for user in candidates:
         if (user.pw_shell in system_shells) and ("home" in user.pw_dir):
             human_users.append(
                 HumanUser(user.pw_name, user.pw_dir, user.pw_uid, user.pw_gid)
             )
-    try:
-        root_user = pwd.getpwuid(0)  # assuming root has uid 0
-    except Exception as error:
-        log.error(_("No root user found ") + str(error))
+    root_user = _getpwuid(0)  # assuming root has uid 0
+    if root_user is None:
+        log.error(_("No root user found "))
     else:
         human_users.append(
             HumanUser(
                 root_user.pw_name, root_user.pw_dir, root_user.pw_uid, root_user.pw_gid
             )
         )
-    return human_users
+    log.debug(
+        _("Found {} users ({})").format(len(human_users), configuration.users_source)
+    )
+    _system_users = human_users
+    return list(_system_users)
 
 
 def is_live_session_active() -> bool:
@@ -449,6 +534,8 @@ def detect_installed_clipart() -> tuple[bool, str]:
 def remove_file(path: pathlib.Path) -> bool:
     allowed_dirs = [
         pathlib.Path("/tmp"),
+        # staging directory is not necessarily in /tmp
+        configuration.temporary_dir,
         pathlib.Path("/opt").glob("openoffice*"),
         pathlib.Path("/opt").glob("libreoffice*"),
         pathlib.Path("/etc/skel"),
@@ -485,14 +572,11 @@ def remove_file(path: pathlib.Path) -> bool:
     return is_removed
 
 
-def move_file(from_path: pathlib.Path, to_path: pathlib.Path) -> bool:
-    try:
-        shutil.move(src=from_path, dst=to_path)
-        is_moved = True
-    except Exception as error:
-        msg = _("Error when moving {} to {}: ").format(from_path, to_path)
-        log.error(msg + str(error))
-        is_moved = False
+def move_file(
+    from_path: pathlib.Path, to_path: pathlib.Path, progress_reporter=None
+) -> bool:
+    # Renames when possible, copies (reporting progress) only across filesystems
+    is_moved, msg = transfer.transfer_file(from_path, to_path, progress_reporter)
     return is_moved
 
 
@@ -501,18 +585,18 @@ def create_dir(dir_path: pathlib.Path):
     os.makedirs(dir_path, exist_ok=True)
 
 
-def move_dir(from_path: pathlib.Path, to_path: pathlib.Path) -> tuple[bool, str]:
+def move_dir(
+    from_path: pathlib.Path, to_path: pathlib.Path, progress_reporter=None
+) -> tuple[bool, str]:
     try:
         if from_path.exists():
             force_rm_directory(to_path)
-        shutil.move(src=from_path, dst=to_path)
-        is_moved = True
-        msg = ""
+            create_dir(to_path.parent)
     except Exception as error:
         msg = _("Error when moving {} to {}: ").format(from_path, to_path)
         log.error(msg + str(error))
-        is_moved = False
-    return (is_moved, msg)
+        return (False, msg)
+    return transfer.transfer_dir(from_path, to_path, progress_reporter)
 
 
 def run_shell_command_with_progress(
@@ -566,6 +650,7 @@ def run_shell_command_with_progress(
 def install_using_apt_get(
     package_nameS: list,
     progress_reporter: Callable,
+    sources_list: pathlib.Path | None = None,
 ):
     """Install rpm packages using apt-get command provided by the OS
 
@@ -587,17 +672,52 @@ def install_using_apt_get(
     progress_reporter : Callable
     callback function for installation progress reporting
 
+    sources_list : pathlib.Path | None
+    if given, packages are installed only from repositories listed
+    in this file (instead of the system configured ones). Package lists
+    are then kept in a "lists" directory next to the file.
+
     Returns
     -------
     tuple[bool, str]
     T/F indication installation status, string with reason of failure,
     empty string if success
     """
-    package_nameS_string = " ".join(package_nameS)
+    invalid_names = [
+        name for name in package_nameS if not package_name_regex.fullmatch(name)
+    ]
+    if invalid_names:
+        msg = _("Invalid package name(s): {}").format(invalid_names)
+        log.error(msg)
+        return (False, msg)
+    package_nameS_string = " ".join(shlex.quote(name) for name in package_nameS)
+
+    apt_options = ""
+    if sources_list is not None:
+        lists_dir = sources_list.parent.joinpath("lists")
+        create_dir(lists_dir.joinpath("partial"))
+        apt_options = " ".join(
+            "-o " + shlex.quote(option)
+            for option in [
+                f"Dir::Etc::sourcelist={sources_list}",
+                f"Dir::Etc::sourceparts={lists_dir}/none",
+                f"Dir::State::lists={lists_dir}/",
+                f"Dir::Cache::pkgcache={lists_dir}/pkgcache.bin",
+                f"Dir::Cache::srcpkgcache={lists_dir}/srcpkgcache.bin",
+            ]
+        )
+        progress_reporter.progress_msg(_("Reading package lists..."))
+        status, output = run_shell_command(
+            f"apt-get {apt_options} update", timeout=300
+        )
+        if not status or "E: " in output:
+            msg = _("Failed to read package lists: {}").format(output)
+            log.error(msg)
+            return (False, msg)
 
     progress_reporter.progress_msg(_("Checking if packages can be installed..."))
     status, output = run_shell_command(
-        f"apt-get install --reinstall --simulate  {package_nameS_string} -y"
+        f"apt-get {apt_options} install --reinstall --simulate  {package_nameS_string} -y"
     )
     if status:
         regex_install = re.compile(
@@ -674,7 +794,7 @@ def install_using_apt_get(
         return ("no match", 0)
 
     status, output = run_shell_command_with_progress(
-        f"apt-get install --reinstall {package_nameS_string} -y",
+        f"apt-get {apt_options} install --reinstall {package_nameS_string} -y",
         progress_reporter=progress_reporter,
         parser=progress_parser,
     )
@@ -776,6 +896,64 @@ def extract_tgz(archive_path: pathlib.Path) -> list[pathlib.Path]:
     return rpm_files
 
 
+def dry_run_rpm_install(
+    rpm_fileS: list, ignore_file_conflicts: bool = False
+) -> tuple[bool, str]:
+    """Checks if rpm packages can be installed ('rpm -Uvh --test')
+
+    Parameters
+    ----------
+    rpm_fileS : list
+    list of absolute paths to rpm files
+
+    ignore_file_conflicts : bool
+    don't fail on files owned by installed packages (use when packages
+    owning them are going to be removed before the install)
+
+    Returns
+    -------
+    tuple[bool, str]
+    T/F packages can be installed, string with reason of failure
+    """
+    files_to_install = " ".join([str(rpm_path) for rpm_path in rpm_fileS])
+    options = "--replacepkgs --test"
+    if ignore_file_conflicts:
+        options += " --replacefiles"
+    status, output = run_shell_command(f"rpm -Uvh {options} {files_to_install}")
+    if not status:
+        msg = _("Failed to execute command: ") + output
+        log.error(msg)
+        return (False, msg)
+    if "needs" in output:
+        msg = _(
+            "Dry-run install failed - insufficient disk space. Packages where not installed "
+        )
+        log.error(msg + output)
+        return (False, msg)
+    if any(map(lambda e: e in output, ["error", "Error"])):
+        msg = _("Dry-run install failed. Packages where not installed ")
+        log.error(msg + output)
+        return (False, msg)
+    return (True, _("Dry-run install successful"))
+
+
+def get_rpmdb_generation() -> str:
+    """Returns a fingerprint of installed packages ("" if unknown)
+
+    The fingerprint changes whenever any package is installed,
+    removed or reinstalled.
+    """
+    status, output = run_shell_command(
+        "rpm -qa --qf '%{NAME}-%{VERSION}-%{RELEASE}.%{ARCH} %{INSTALLTIME}\\n'",
+        timeout=60,
+        fail_on_error=True,
+    )
+    if not status:
+        return ""
+    packages = sorted(output.splitlines())
+    return hashlib.sha256("\n".join(packages).encode("utf-8")).hexdigest()
+
+
 def install_using_rpm(
     rpm_fileS: list,
     progress_reporter: Callable,
@@ -805,100 +983,83 @@ def install_using_rpm(
     files_to_install = " ".join([str(rpm_path) for rpm_path in rpm_fileS])
 
     progress_reporter.progress_msg(_("Checking if packages can be installed..."))
-    status, output = run_shell_command(
-        "rpm -Uvh --replacepkgs --test " + files_to_install
-    )
-    if status:
-        if "needs" in output:
-            msg = _(
-                "Dry-run install failed - insufficient disk space. Packages where not installed "
+    is_installable, msg = dry_run_rpm_install(rpm_fileS)
+    if not is_installable:
+        return (False, msg)
+    log.info(_("Dry-run install successful. Proceeding with actual install..."))
+
+    # It seems rpm is manipulating TTY directly :(
+    # Although TTY can be captured the method below relies
+    # on '#' symbols being written to stdout when rpm is making
+    # progress installing rpm. Counting them to calculate percentage.
+    def progress_parser(input: bytes) -> tuple[str, int]:
+        # regex for stdout output
+        regex_verifying = re.compile(r"Verifying[\.]+\s*(?P<p_progress>[\#]+)")
+        regex_preparing = re.compile(r"Preparing[\.]+\s*(?P<p_progress>[\#]+)")
+        regex_updinst = re.compile(r"Updating\s/\sinstalling[\.]+")
+        regex_name_and_progress = re.compile(
+            r"^[\s0-9]+\:[\s]+(?P<p_name>[\w\.\-]+)\s*(?P<p_progress>[\#]+)"
+        )
+        last_string = input.decode("utf-8", "ignore").split("\n")[-1]
+        # Unfortunately rpm outputs backspace control chars
+        # to do its progress reporting which
+        # means some long rpm names can get trimmed.
+        # To try to deal with that we save the name the first time
+        # regex match is successful and we retain it (and return it)
+        # until we gather max no of '#' symbols (should be 40 but is 33)
+        # then we reset for next package name.
+        hashes4done = 33
+        first = True
+        p_name = ""
+        p_progress = 0
+        match_verifying = regex_verifying.search(last_string)
+        match_preparing = regex_preparing.search(last_string)
+        match_updinst = regex_updinst.search(last_string)
+        match_n_p = regex_name_and_progress.search(last_string)
+        if match_verifying:
+            verifying_msg = "Verifying..."
+            p_progress = int(
+                100 * len(match_verifying.group("p_progress")) / hashes4done
             )
-            log.error(msg + output)
-            return (False, msg)
-        if any(map(lambda e: e in output, ["error", "Error"])):
-            msg = _("Dry-run install failed. Packages where not installed ")
-            log.error(msg + output)
-            return (False, msg)
-        else:
-            msg = _("Dry-run install successful. Proceeding with actual install...")
-            log.info(msg)
-
-            # It seems rpm is manipulating TTY directly :(
-            # Although TTY can be captured the method below relies
-            # on '#' symbols being written to stdout when rpm is making
-            # progress installing rpm. Counting them to calculate percentage.
-            def progress_parser(input: bytes) -> tuple[str, int]:
-                # regex for stdout output
-                regex_verifying = re.compile(r"Verifying[\.]+\s*(?P<p_progress>[\#]+)")
-                regex_preparing = re.compile(r"Preparing[\.]+\s*(?P<p_progress>[\#]+)")
-                regex_updinst = re.compile(r"Updating\s/\sinstalling[\.]+")
-                regex_name_and_progress = re.compile(
-                    r"^[\s0-9]+\:[\s]+(?P<p_name>[\w\.\-]+)\s*(?P<p_progress>[\#]+)"
-                )
-                last_string = input.decode("utf-8", "ignore").split("\n")[-1]
-                # Unfortunately rpm outputs backspace control chars
-                # to do its progress reporting which
-                # means some long rpm names can get trimmed.
-                # To try to deal with that we save the name the first time
-                # regex match is successful and we retain it (and return it)
-                # until we gather max no of '#' symbols (should be 40 but is 33)
-                # then we reset for next package name.
-                hashes4done = 33
-                first = True
-                p_name = ""
-                p_progress = 0
-                match_verifying = regex_verifying.search(last_string)
-                match_preparing = regex_preparing.search(last_string)
-                match_updinst = regex_updinst.search(last_string)
-                match_n_p = regex_name_and_progress.search(last_string)
-                if match_verifying:
-                    verifying_msg = "Verifying..."
-                    p_progress = int(
-                        100 * len(match_verifying.group("p_progress")) / hashes4done
-                    )
-                    return (verifying_msg, p_progress)
-                elif match_preparing:
-                    preparing_msg = "Preparing..."
-                    p_progress = int(
-                        100 * len(match_preparing.group("p_progress")) / hashes4done
-                    )
-                    return (preparing_msg, p_progress)
-                elif match_updinst:
-                    installing_msg = "Installing..."
-                    p_progress = 0
-                    return (installing_msg, p_progress)
-                elif match_n_p:
-                    if first:
-                        p_name = match_n_p.group("p_name")
-                        p_progress = int(
-                            100 * len(match_n_p.group("p_progress")) / hashes4done
-                        )
-                        first = False
-                    else:
-                        p_progress = int(
-                            100 * len(match_n_p.group("p_progress")) / hashes4done
-                        )
-                        if len(match_n_p.group("p_progress")) == hashes4done:
-                            first = True
-                    return (p_name, p_progress)
-                else:
-                    return ("no match", 0)
-
-            status, msg = run_shell_command_with_progress(
-                f"rpm -Uvh --replacepkgs {files_to_install}",
-                progress_reporter=progress_reporter,
-                parser=progress_parser,
-                byte_output=True,
+            return (verifying_msg, p_progress)
+        elif match_preparing:
+            preparing_msg = "Preparing..."
+            p_progress = int(
+                100 * len(match_preparing.group("p_progress")) / hashes4done
             )
-            log.debug(_("final msg is: {}").format(msg))
-            if "error" in msg:
-                return (False, _("Failed to install packages"))
+            return (preparing_msg, p_progress)
+        elif match_updinst:
+            installing_msg = "Installing..."
+            p_progress = 0
+            return (installing_msg, p_progress)
+        elif match_n_p:
+            if first:
+                p_name = match_n_p.group("p_name")
+                p_progress = int(
+                    100 * len(match_n_p.group("p_progress")) / hashes4done
+                )
+                first = False
             else:
-                return (True, _("All packages successfully installed"))
+                p_progress = int(
+                    100 * len(match_n_p.group("p_progress")) / hashes4done
+                )
+                if len(match_n_p.group("p_progress")) == hashes4done:
+                    first = True
+            return (p_name, p_progress)
+        else:
+            return ("no match", 0)
+
+    status, msg = run_shell_command_with_progress(
+        f"rpm -Uvh --replacepkgs {files_to_install}",
+        progress_reporter=progress_reporter,
+        parser=progress_parser,
+        byte_output=True,
+    )
+    log.debug(_("final msg is: {}").format(msg))
+    if "error" in msg:
+        return (False, _("Failed to install packages"))
     else:
-        msg = _("Failed to execute command: ") + output
-        log.error(msg)
-        return (False, msg)
+        return (True, _("All packages successfully installed"))
 
 
 def uninstall_using_apt_get(
@@ -1003,14 +1164,6 @@ def force_rm_directory(path: pathlib.Path):
         return True
 
 
-def update_menus():
-    """Updates KDE/GNOME/LXDE etc. menus"""
-    log.info(_("updating menus"))
-    run_shell_command("xdg-desktop-menu forceupdate --mode system")
-    run_shell_command("update-menus -n")
-    run_shell_command("update-menus -v")
-
-
 def make_dir_tree(target_dir: pathlib.Path):
     """Recursively create directories needed to contain the leaf directory"""
     os.makedirs(target_dir, exist_ok=True)
@@ -0,0 +1,279 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import pathlib
+import shutil
+import tarfile
+
+import configuration
+
+from i18n import _
+
+from . import PCLOS, integrity, rpmheader, transfer
+
+log = logging.getLogger("lomanager2_logger")
+
+# apt-rpm repository layout (as expected by genbasedir):
+#   <top dir>/<dist>/RPMS.<component>/*.rpm
+#   <top dir>/<dist>/base/pkglist.<component>, release, ...
+# Additionally lomanager2 puts in the top dir:
+#   sources.list - line to use on machines installing from this repository
+#   packages.txt - names of all packages in the repository
+sources_list_name = "sources.list"
+packages_list_name = "packages.txt"
+# Generating package lists of LibreOffice rpms takes a while
+genbasedir_timeout = 600
+
+
+def sources_list_line(location: str) -> str:
+    """Makes sources.list line for a repository exported by lomanager2
+
+    Parameters
+    ----------
+    location : str
+      repository's top directory (absolute path) or its http(s) URL
+    """
+    if not location.startswith(("http://", "https://", "ftp://", "file:")):
+        location = "file:" + str(pathlib.Path(location).resolve())
+    return " ".join(
+        ["rpm", location, configuration.apt_repo_dist, configuration.apt_repo_component]
+    )
+
+
+def _extract_rpms(archive_path: pathlib.Path, target_dir: pathlib.Path) -> list:
+    # Only rpm files are taken from the archive (directory structure
+    # of the archive is not preserved)
+    extracted = []
+    with tarfile.open(archive_path, mode="r|gz") as targz:
+        for member in targz:
+            if member.isfile() and member.name.endswith(".rpm"):
+                target = target_dir.joinpath(pathlib.PurePath(member.name).name)
+                with open(target, "wb") as f:
+                    shutil.copyfileobj(targz.extractfile(member), f)
+                extracted.append(target)
+    return extracted
+
+
+def export_repository(
+    saved_packages_dir: pathlib.Path,
+    export_dir: pathlib.Path,
+    progress_reporter=None,
+) -> tuple[bool, str]:
+    """Turns saved packages into an apt-rpm repository
+
+    Java and Clipart rpms are hardlinked (or copied) and rpms contained
+    in LibreOffice archives are extracted into a single RPMS directory
+    for which package lists are generated with genbasedir.
+    The resulting directory can be used directly (file:) or served
+    by any HTTP server.
+
+    Parameters
+    ----------
+    saved_packages_dir : pathlib.Path
+      directory with saved packages of a single version
+      (Java_rpms, LibreOffice-core_tgzs, ... subdirectories)
+
+    export_dir : pathlib.Path
+      top directory of the repository (created or emptied)
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F - success/failure, sources.list line or error description
+    """
+    saved_packages_dir = pathlib.Path(saved_packages_dir)
+    export_dir = pathlib.Path(export_dir)
+    dist_dir = export_dir.joinpath(configuration.apt_repo_dist)
+    rpms_dir = dist_dir.joinpath("RPMS." + configuration.apt_repo_component)
+
+    is_cleaned, msg = PCLOS.clean_dir(dist_dir)
+    if not is_cleaned:
+        return (False, msg)
+    PCLOS.create_dir(rpms_dir)
+    PCLOS.create_dir(dist_dir.joinpath("base"))
+
+    rpm_files = []
+    try:
+        for subdir in ("Java_rpms", "Clipart_rpms"):
+            for rpm in sorted(saved_packages_dir.joinpath(subdir).glob("*.rpm")):
+                is_linked, msg = transfer.transfer_file(
+                    rpm, rpms_dir.joinpath(rpm.name), keep_source=True
+                )
+                if not is_linked:
+                    return (False, msg)
+                rpm_files.append(rpms_dir.joinpath(rpm.name))
+        for subdir in ("LibreOffice-core_tgzs", "LibreOffice-langs_tgzs"):
+            for archive in sorted(saved_packages_dir.joinpath(subdir).glob("*.tar.gz")):
+                if progress_reporter is not None:
+                    progress_reporter.progress_msg(
+                        _("Extracting: {}").format(archive.name)
+                    )
+                rpm_files += _extract_rpms(archive, rpms_dir)
+    except (OSError, tarfile.TarError) as error:
+        msg = _("Failed to export saved packages: {}").format(error)
+        log.error(msg)
+        return (False, msg)
+    if not rpm_files:
+        msg = _("No packages found in {}").format(saved_packages_dir)
+        log.error(msg)
+        return (False, msg)
+
+    if progress_reporter is not None:
+        progress_reporter.progress_msg(_("Generating package lists"))
+    is_generated, output = PCLOS.run_shell_command(
+        "genbasedir --topdir={} {} {}".format(
+            export_dir, configuration.apt_repo_dist, configuration.apt_repo_component
+        ),
+        timeout=genbasedir_timeout,
+        fail_on_error=True,
+    )
+    if not is_generated:
+        msg = _("Failed to generate package lists: {}").format(output)
+        log.error(msg)
+        return (False, msg)
+
+    package_names = sorted(
+        {h.name for h in rpmheader.read_rpm_headers(rpm_files).values()}
+    )
+    line = sources_list_line(str(export_dir))
+    with open(export_dir.joinpath(packages_list_name), "w") as f:
+        f.write("\n".join(package_names) + "\n")
+    with open(export_dir.joinpath(sources_list_name), "w") as f:
+        f.write(line + "\n")
+    log.info(
+        _("Exported {} packages to {} ({})").format(len(package_names), export_dir, line)
+    )
+    return (True, line)
+
+
+def _local_top_dir(location: str) -> pathlib.Path | None:
+    # Top directory of a repository given as a path or file: URL,
+    # None for remote repositories
+    if "://" in location.removeprefix("file://"):
+        return None
+    return pathlib.Path(location.removeprefix("file://").removeprefix("file:"))
+
+
+def check_repository(location: str) -> tuple[bool, str]:
+    """Checks if packages can be installed from an exported repository
+
+    Packages are installed by root without any signatures to check,
+    so only a local repository which no one but root can modify
+    is accepted (a remote one can be mounted, eg. over NFS).
+
+    Parameters
+    ----------
+    location : str
+      repository's top directory
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F - repository can be used, error description
+    """
+    top_dir = _local_top_dir(location)
+    if top_dir is None:
+        msg = _("Only local repositories are supported: {}").format(location)
+        log.error(msg)
+        return (False, msg)
+    top_dir = pathlib.Path(os.path.abspath(top_dir))
+    if any(char.isspace() for char in str(top_dir)):
+        msg = _("Path of the repository can't contain spaces: {}").format(top_dir)
+        log.error(msg)
+        return (False, msg)
+    dist_dir = top_dir.joinpath(configuration.apt_repo_dist)
+    for path in [
+        top_dir,
+        top_dir.joinpath(packages_list_name),
+        dist_dir,
+        dist_dir.joinpath("RPMS." + configuration.apt_repo_component),
+        dist_dir.joinpath("base"),
+    ]:
+        if not integrity.is_root_only(path, top_dir):
+            msg = _(
+                "{} does not exist or can be modified by users other than root"
+            ).format(path)
+            log.error(msg)
+            return (False, msg)
+    return (True, "")
+
+
+def read_package_names(location: str) -> tuple[bool, list[str]]:
+    """Reads names of packages offered by exported repository
+
+    Parameters
+    ----------
+    location : str
+      repository's top directory (see check_repository)
+    """
+    top_dir = _local_top_dir(location)
+    if top_dir is None:
+        log.error(_("Only local repositories are supported: {}").format(location))
+        return (False, [])
+    try:
+        content = top_dir.joinpath(packages_list_name).read_text()
+    except (OSError, UnicodeDecodeError) as error:
+        log.error(_("Could not read list of packages: {}").format(error))
+        return (False, [])
+    package_names = [n.strip() for n in content.splitlines() if n.strip()]
+    invalid_names = [
+        name for name in package_names if not PCLOS.package_name_regex.fullmatch(name)
+    ]
+    if invalid_names:
+        log.error(_("Invalid package name(s): {}").format(invalid_names))
+        return (False, [])
+    return (True, package_names)
+
+
+def install_from_repository(
+    location: str, package_names: list[str], progress_reporter
+) -> tuple[bool, str]:
+    """Installs packages of an exported repository in one transaction
+
+    Only does the apt-get part, use MainLogic.install_from_repository
+    to have installed Office replaced and set up.
+
+    Parameters
+    ----------
+    location : str
+      repository's top directory (see check_repository)
+
+    package_names : list[str]
+      packages to install (see read_package_names)
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F - success/failure, description
+    """
+    top_dir = _local_top_dir(location)
+    if top_dir is None:
+        msg = _("Only local repositories are supported: {}").format(location)
+        log.error(msg)
+        return (False, msg)
+    # Repository is described in a sources.list of its own so that
+    # system's apt configuration and package lists are left untouched
+    apt_dir = configuration.temporary_dir.joinpath("apt_repository")
+    PCLOS.create_dir(apt_dir)
+    sources_list = apt_dir.joinpath(sources_list_name)
+    with open(sources_list, "w") as f:
+        f.write(sources_list_line(str(top_dir)) + "\n")
+    return PCLOS.install_using_apt_get(
+        package_names, progress_reporter, sources_list=sources_list
+    )
@@ -0,0 +1,156 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import errno
+import logging
+import os
+import pathlib
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+import configuration
+
+from i18n import _
+
+log = logging.getLogger("lomanager2_logger")
+
+# Removal of leftover files and directories (eg. Office profiles in
+# users' home directories). Paths are removed relative to descriptors of
+# their parent directories and symbolic links are never followed inside
+# directories other users can modify - a user can't make us remove
+# anything outside of their home directory by planting a link.
+_dir_flags = os.O_RDONLY | os.O_DIRECTORY
+
+
+def _is_trusted(fd: int) -> bool:
+    # Only root can change entries of this directory
+    st = os.fstat(fd)
+    return st.st_uid == 0 and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _open_parent(path: pathlib.Path) -> int:
+    fd = os.open("/", _dir_flags)
+    try:
+        for name in path.parent.parts[1:]:
+            flags = _dir_flags if _is_trusted(fd) else _dir_flags | os.O_NOFOLLOW
+            parent_fd = fd
+            fd = os.open(name, flags, dir_fd=parent_fd)
+            os.close(parent_fd)
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
+
+
+def _remove_at(parent_fd: int, name: str):
+    # Removes file, link or whole directory tree 'name' in parent_fd
+    # (FileNotFoundError is raised only if 'name' itself doesn't exist,
+    #  entries inside the tree that disappear meanwhile are skipped)
+    try:
+        fd = os.open(name, _dir_flags | os.O_NOFOLLOW, dir_fd=parent_fd)
+    except OSError as error:
+        if error.errno in (errno.ENOTDIR, errno.ELOOP):
+            os.unlink(name, dir_fd=parent_fd)
+            return
+        raise
+    try:
+        with os.scandir(fd) as entries:
+            for entry in list(entries):
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        _remove_at(fd, entry.name)
+                    else:
+                        os.unlink(entry.name, dir_fd=fd)
+                except FileNotFoundError:
+                    pass
+    finally:
+        os.close(fd)
+    os.rmdir(name, dir_fd=parent_fd)
+
+
+def remove_path(path: pathlib.Path) -> tuple[bool, str]:
+    """Removes a file or a directory tree (not following symbolic links)
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F path doesn't exist anymore, description of what was done
+    """
+    if not path.is_absolute() or path.parent == path:
+        return (False, _("Refusing to remove {}").format(path))
+    try:
+        parent_fd = _open_parent(path)
+    except FileNotFoundError:
+        return (True, _("Not present"))
+    except OSError as error:
+        return (False, str(error))
+    try:
+        _remove_at(parent_fd, path.name)
+    except FileNotFoundError:
+        return (True, _("Not present"))
+    except OSError as error:
+        return (False, str(error))
+    finally:
+        os.close(parent_fd)
+    return (True, _("Removed"))
+
+
+def remove_paths(
+    paths: list[pathlib.Path], max_workers: int | None = None
+) -> list[tuple[pathlib.Path, bool, str]]:
+    """Removes files and directory trees at the same time
+
+    Parameters
+    ----------
+    paths : list[pathlib.Path]
+      absolute paths to remove (duplicates are removed once, paths
+      inside other listed paths are removed with them)
+
+    max_workers : int | None
+      number of paths removed at the same time
+      (configuration.cleanup_workers if None)
+
+    Returns
+    -------
+    list[tuple[pathlib.Path, bool, str]]
+      path, T/F removed (or not present), description for every path
+      that was not inside another listed path
+    """
+    if max_workers is None:
+        max_workers = configuration.cleanup_workers
+    paths = list(dict.fromkeys(paths))
+    # Workers must not remove the same tree at the same time
+    listed = set(paths)
+    paths = [path for path in paths if listed.isdisjoint(path.parents)]
+    if not paths:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        outcomes = list(executor.map(remove_path, paths))
+    results = [(path, *outcome) for path, outcome in zip(paths, outcomes)]
+    n_failed = 0
+    for path, is_removed, msg in results:
+        if is_removed:
+            log.debug(_("Cleanup {}: {}").format(path, msg))
+        else:
+            n_failed += 1
+            log.warning(_("Could not remove {}: {}").format(path, msg))
+    log.info(
+        _("Cleanup finished, {} of {} paths could not be removed").format(
+            n_failed, len(results)
+        )
+    )
+    return results
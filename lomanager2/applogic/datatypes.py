@@ -130,6 +130,7 @@ class VirtualPackage(Node):
                 "name": "",
                 "base_url": "",
                 "estimated_download_size": 0,  # size in bytes
+                "download_size": 0,  # exact size in bytes, 0 if not known
                 "checksum": "",
             }
         ]
@@ -0,0 +1,283 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pathlib
+import re
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import configuration
+
+from i18n import _
+
+from . import net
+
+log = logging.getLogger("lomanager2_logger")
+
+# zsync-like delta transfer:
+# A block map describes the new file as a sequence of fixed size blocks,
+# each with a weak (rolling, rsync style) and a strong (md5) checksum.
+# An older version of the file present on this machine (the seed) is
+# scanned with the rolling checksum at every byte offset, blocks found
+# in it are copied locally and only the remaining byte ranges are
+# downloaded with HTTP Range requests.
+block_map_format = 1
+block_map_suffix = ".blockmap.json"
+default_block_size = 16 * 1024
+# Missing blocks closer to each other than this are fetched in one request
+range_merge_gap = 64 * 1024
+# Don't bother with delta transfer for small files
+min_delta_file_size = 4 * 1024**2
+_MOD = 1 << 16
+
+
+def _weak_checksum(block: bytes) -> tuple[int, int]:
+    a = sum(block) % _MOD
+    n = len(block)
+    b = sum((n - i) * x for i, x in enumerate(block)) % _MOD
+    return (a, b)
+
+
+def generate_block_map(file_path: pathlib.Path, block_size: int = default_block_size) -> dict:
+    """Describes a file with weak and strong checksums of its blocks"""
+    blocks = []
+    whole_hash = hashlib.sha256()
+    # (a symbolic link is not followed)
+    with os.fdopen(os.open(file_path, os.O_RDONLY | os.O_NOFOLLOW), "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        while block := f.read(block_size):
+            whole_hash.update(block)
+            a, b = _weak_checksum(block)
+            blocks.append([a | (b << 16), hashlib.md5(block).hexdigest()])
+    return {
+        "format": block_map_format,
+        "size": size,
+        "block_size": block_size,
+        "sha256": whole_hash.hexdigest(),
+        "blocks": blocks,
+    }
+
+
+def fetch_block_map(file_url: str) -> dict | None:
+    """Gets block map of a file from a peer
+
+    (upstream servers don't publish block maps, peers generate them
+     for files they serve)
+    """
+    file_name = file_url.split("/")[-1]
+    urls = [
+        peer.rstrip("/") + "/" + urllib.parse.quote(file_name) + block_map_suffix
+        for peer in configuration.cache_peers
+    ]
+    for url in urls:
+        try:
+            with urllib.request.urlopen(url, timeout=net.connections_timeout) as resp:
+                block_map = json.loads(resp.read())
+            if block_map.get("format") == block_map_format:
+                log.debug(_("Got block map {}").format(url))
+                return block_map
+        except (urllib.error.URLError, OSError, ValueError) as error:
+            log.debug(_("No block map at {}: {}").format(url, error))
+    return None
+
+
+def _version_agnostic(file_name: str) -> str:
+    # LibreOffice_7.6.2_Linux_x86-64_rpm.tar.gz -> LibreOffice_*_Linux_x86-64_rpm.tar.gz
+    return re.sub(r"[0-9]+(\.[0-9]+)+", "*", file_name)
+
+
+def find_seed(file_name: str) -> pathlib.Path | None:
+    """Finds the biggest local file that is another version of file_name"""
+    pattern = _version_agnostic(file_name)
+    candidates = []
+    for directory in (configuration.download_cache_dir, configuration.offline_copy_dir):
+        if not directory.is_dir():
+            continue
+        for dir_path, _dir_names, file_names in os.walk(directory):
+            for name in file_names:
+                if name != file_name and _version_agnostic(name) == pattern:
+                    candidates.append(pathlib.Path(dir_path, name))
+    if not candidates:
+        return None
+    return max(candidates, key=lambda p: p.stat().st_size)
+
+
+def match_blocks(seed_path: pathlib.Path, block_map: dict) -> dict:
+    """Finds blocks of the new file in the seed file
+
+    Returns
+    -------
+    dict
+      block index -> offset of identical data in the seed file
+    """
+    block_size = block_map["block_size"]
+    n_blocks = len(block_map["blocks"])
+    # Last block is shorter (usually) and is always downloaded
+    weak_table = {}
+    for index, (weak, strong) in enumerate(block_map["blocks"]):
+        if index == n_blocks - 1 and block_map["size"] % block_size:
+            break
+        weak_table.setdefault(weak, []).append((index, strong))
+
+    found = {}
+    with open(seed_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < block_size:
+            return found
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as seed:
+            seed_size = len(seed)
+            a, b = _weak_checksum(seed[:block_size])
+            offset = 0
+            last_offset = seed_size - block_size
+            md5 = hashlib.md5
+            while True:
+                candidates = weak_table.get(a | (b << 16))
+                if candidates:
+                    window = seed[offset : offset + block_size]
+                    strong = md5(window).hexdigest()
+                    hits = [i for i, s in candidates if s == strong and i not in found]
+                    if hits:
+                        for index in hits:
+                            found[index] = offset
+                        # Continue right after the matched block
+                        offset += block_size
+                        if offset > last_offset:
+                            break
+                        a, b = _weak_checksum(seed[offset : offset + block_size])
+                        continue
+                if offset >= last_offset:
+                    break
+                # Roll the checksum by one byte
+                out_byte = seed[offset]
+                in_byte = seed[offset + block_size]
+                a = (a - out_byte + in_byte) % _MOD
+                b = (b - block_size * out_byte + a) % _MOD
+                offset += 1
+    return found
+
+
+def _missing_ranges(block_map: dict, found: dict) -> list[tuple[int, int]]:
+    # (first byte, last byte) ranges of blocks not found in the seed
+    block_size = block_map["block_size"]
+    size = block_map["size"]
+    ranges = []
+    for index in range(len(block_map["blocks"])):
+        if index in found:
+            continue
+        first = index * block_size
+        last = min(first + block_size, size) - 1
+        if ranges and first - ranges[-1][1] - 1 <= range_merge_gap:
+            ranges[-1] = (ranges[-1][0], last)
+        else:
+            ranges.append((first, last))
+    return ranges
+
+
+def _fetch_range(url: str, first: int, last: int, out) -> None:
+    request = urllib.request.Request(url, headers={"Range": f"bytes={first}-{last}"})
+    with urllib.request.urlopen(request, timeout=net.connections_timeout) as resp:
+        if resp.status != 206:
+            raise OSError(_("server does not support range requests"))
+        out.seek(first)
+        remaining = last - first + 1
+        while remaining > 0 and (chunk := resp.read(min(remaining, 1024**2))):
+            out.write(chunk)
+            remaining -= len(chunk)
+        if remaining:
+            raise OSError(_("range {}-{} truncated").format(first, last))
+
+
+def delta_download(
+    file_url: str,
+    dest_path: pathlib.Path,
+    progress_reporter,
+    data_url: str = "",
+) -> tuple[bool, str]:
+    """Builds a new version of a file from a local older version and ranges
+
+    Parameters
+    ----------
+    file_url : str
+      upstream URL of the file (block map is looked for on peers)
+
+    dest_path : pathlib.Path
+
+    progress_reporter : Callable
+
+    data_url : str
+      URL to fetch missing ranges from (file_url if empty)
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F - file was assembled and matches the block map, description
+    """
+    file_name = file_url.split("/")[-1]
+    if (seed := find_seed(file_name)) is None:
+        return (False, _("no older version of {} available").format(file_name))
+    if (block_map := fetch_block_map(file_url)) is None:
+        return (False, _("no block map for {}").format(file_name))
+    if block_map["size"] < min_delta_file_size:
+        return (False, _("{} is too small for delta transfer").format(file_name))
+
+    progress_reporter.progress_msg(
+        _("Looking for reusable data: {} in {}").format(file_name, seed.name)
+    )
+    found = match_blocks(seed, block_map)
+    ranges = _missing_ranges(block_map, found)
+    to_fetch = sum(last - first + 1 for first, last in ranges)
+    log.info(
+        _("Delta for {}: {} of {} blocks reused, {} bytes to download").format(
+            file_name, len(found), len(block_map["blocks"]), to_fetch
+        )
+    )
+
+    block_size = block_map["block_size"]
+    partial_path = dest_path.with_name(dest_path.name + ".part")
+    try:
+        with open(seed, "rb") as fseed, open(partial_path, "wb") as out:
+            out.truncate(block_map["size"])
+            for index, seed_offset in found.items():
+                fseed.seek(seed_offset)
+                out.seek(index * block_size)
+                out.write(fseed.read(block_size))
+            progress_reporter.progress_msg(_("Downloading: {}").format(file_name))
+            fetched = 0
+            for first, last in ranges:
+                _fetch_range(data_url or file_url, first, last, out)
+                fetched += last - first + 1
+                progress_reporter.progress(int(100 * fetched / max(to_fetch, 1)))
+
+        whole_hash = hashlib.sha256()
+        with open(partial_path, "rb") as f:
+            while chunk := f.read(8 * 1024**2):
+                whole_hash.update(chunk)
+        if whole_hash.hexdigest() != block_map["sha256"]:
+            raise OSError(_("assembled file does not match block map"))
+        os.replace(partial_path, dest_path)
+    except (OSError, urllib.error.URLError) as error:
+        if partial_path.exists():
+            os.remove(partial_path)
+        msg = _("Delta transfer of {} failed: {}").format(file_name, error)
+        log.warning(msg)
+        return (False, msg)
+    return (True, "")
@@ -0,0 +1,135 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from i18n import _
+
+from . import PCLOS
+
+log = logging.getLogger("lomanager2_logger")
+
+# Refreshes of the desktop environment needed after packages change.
+# Steps only request them, each requested one is run once when all
+# changes are made.
+#   commands - run one after another
+#   requires - executable that has to exist for the hook to make sense
+#   after    - hooks that have to be run first
+MENUS = "menus"
+DESKTOP_DATABASE = "desktop_database"
+LXPANEL = "lxpanel"
+refresh_hooks = {
+    MENUS: {
+        "commands": [
+            "xdg-desktop-menu forceupdate --mode system",
+            "update-menus -n",
+            "update-menus -v",
+        ],
+        "requires": "",
+        "after": [],
+    },
+    DESKTOP_DATABASE: {
+        "commands": ["update-desktop-database -q /usr/share/applications"],
+        "requires": "/usr/bin/update-desktop-database",
+        "after": [],
+    },
+    # Panel rereads menus when restarted
+    LXPANEL: {
+        "commands": ["/usr/bin/lxpanelctl restart"],
+        "requires": "/usr/bin/lxpanelctl",
+        "after": [MENUS],
+    },
+}
+
+
+class PostTransactionHooks:
+    """Collects actions to be done after packages were changed
+
+    Requests are deduplicated. Symbolic links are created in-process
+    (no subprocess per link), refresh hooks run once each, the ones
+    not depending on each other at the same time.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._refreshes = []
+        self._symlinks = {}  # link path -> target
+
+    def request(self, hook: str):
+        if hook not in refresh_hooks:
+            raise ValueError(f"Unknown hook {hook}")
+        with self._lock:
+            if hook not in self._refreshes:
+                self._refreshes.append(hook)
+
+    def request_symlink(self, target: pathlib.Path, link: pathlib.Path):
+        """Equivalent of 'ln -fs target link' done when hooks run"""
+        with self._lock:
+            self._symlinks[link] = target
+
+    def _make_symlinks(self, symlinks: dict):
+        for link, target in symlinks.items():
+            temp_link = link.with_name(link.name + ".lomanager2-tmp")
+            try:
+                if temp_link.is_symlink():
+                    os.remove(temp_link)
+                os.symlink(target, temp_link)
+                os.replace(temp_link, link)
+            except OSError as error:
+                log.warning(
+                    _("Could not link {} to {}: {}").format(link, target, error)
+                )
+
+    def _run_refresh(self, hook: str):
+        for command in refresh_hooks[hook]["commands"]:
+            PCLOS.run_shell_command(command)
+
+    def run(self, progress_reporter=None):
+        """Does all requested actions and forgets them"""
+        with self._lock:
+            refreshes, self._refreshes = (self._refreshes, [])
+            symlinks, self._symlinks = (self._symlinks, {})
+        if not refreshes and not symlinks:
+            return
+        if progress_reporter is not None:
+            progress_reporter.progress_msg(_("Refreshing desktop environment..."))
+        self._make_symlinks(symlinks)
+
+        refreshes = [
+            hook
+            for hook in refreshes
+            if not refresh_hooks[hook]["requires"]
+            or pathlib.Path(refresh_hooks[hook]["requires"]).exists()
+        ]
+        log.info(_("Running post-transaction hooks: {}").format(refreshes))
+        # Hooks are run in waves, every wave only has hooks whose
+        # predecessors (if requested at all) were run in earlier waves
+        done = set()
+        while refreshes:
+            wave = [
+                hook
+                for hook in refreshes
+                if not set(refresh_hooks[hook]["after"]) & set(refreshes) - {hook}
+            ]
+            with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+                list(executor.map(self._run_refresh, wave))
+            done.update(wave)
+            refreshes = [hook for hook in refreshes if hook not in done]
@@ -0,0 +1,247 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import stat
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import configuration
+
+from i18n import _
+
+log = logging.getLogger("lomanager2_logger")
+
+# Large reads make hashing files from slow (USB) media faster
+# (hashlib releases GIL while hashing big blocks so threads run in parallel)
+hash_read_size = 8 * 1024**2
+# Limit of the number of entries in the sidecar cache file
+sidecar_max_entries = 5000
+
+
+def is_root_only(path: pathlib.Path, top_dir: pathlib.Path) -> bool:
+    """Tells if only root can modify path and directories from top_dir down to it
+
+    Symbolic links are not accepted anywhere in the path. Directories
+    above top_dir may be writable by others if they are sticky (eg. /tmp).
+    """
+    path = pathlib.Path(os.path.normpath(path))
+    is_inside = True
+    try:
+        for p in [path, *path.parents]:
+            st = os.lstat(p)
+            if stat.S_ISLNK(st.st_mode) or st.st_uid != 0:
+                return False
+            if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH) and (
+                is_inside or not st.st_mode & stat.S_ISVTX
+            ):
+                return False
+            if p == top_dir:
+                is_inside = False
+    except OSError:
+        return False
+    return not is_inside
+
+
+def _cache_key(st: os.stat_result) -> str:
+    # A file is assumed not to have changed if none of these did
+    # (unlike mtime, ctime can't be set by the owner of the file)
+    return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_ctime_ns}"
+
+
+def _is_cacheable(file_path: pathlib.Path) -> bool:
+    # Anyone else who can modify the file could make it match
+    # the cached checksum again, only root-only files are cached
+    return is_root_only(file_path, file_path.parent)
+
+
+class HashCache:
+    """Remembers checksums of files that were already hashed
+
+    Checksums are kept in a JSON file (writable by root only) keyed by
+    device, inode, size and change time of the file. Only files owned
+    by root in directories only root can modify are cached, others are
+    hashed every time. (Checksums are not kept in extended attributes
+    of files: the owner can write them and setting one changes ctime.)
+    """
+
+    def __init__(self, sidecar_file: pathlib.Path | None = None) -> None:
+        if sidecar_file is None:
+            sidecar_file = configuration.file_hashes_cache_file
+        self.sidecar_file = sidecar_file
+        self._lock = threading.Lock()
+        self._is_modified = False
+        self._sidecar = {}
+        if is_root_only(self.sidecar_file, self.sidecar_file.parent):
+            try:
+                with open(self.sidecar_file, "r") as f:
+                    self._sidecar = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def get(self, file_path: pathlib.Path, st: os.stat_result) -> str:
+        """Returns cached checksum or an empty string if there is none"""
+        if not _is_cacheable(file_path):
+            return ""
+        with self._lock:
+            return self._sidecar.get(_cache_key(st), "")
+
+    def put(self, file_path: pathlib.Path, st: os.stat_result, digest: str):
+        if not _is_cacheable(file_path):
+            return
+        with self._lock:
+            self._sidecar[_cache_key(st)] = digest
+            # Drop the oldest entries
+            while len(self._sidecar) > sidecar_max_entries:
+                del self._sidecar[next(iter(self._sidecar))]
+            self._is_modified = True
+
+    def save(self):
+        if not self._is_modified:
+            return
+        try:
+            self.sidecar_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = self.sidecar_file.with_name(self.sidecar_file.name + ".part")
+            with open(temp_file, "w") as f:
+                json.dump(self._sidecar, f)
+            os.replace(temp_file, self.sidecar_file)
+            self._is_modified = False
+        except OSError as error:
+            log.warning(_("Could not save checksums cache: {}").format(error))
+
+
+def hash_files(
+    file_paths: list[pathlib.Path],
+    progress_reporter=None,
+    max_workers: int | None = None,
+) -> dict:
+    """Calculates SHA256 of files in parallel reusing cached results
+
+    Progress (if progress_reporter is given) is reported for all files
+    together, weighted by their size. It is reported from the calling
+    thread only.
+
+    Parameters
+    ----------
+    file_paths : list[pathlib.Path]
+
+    progress_reporter : Callable | None
+
+    max_workers : int | None
+      number of files hashed at the same time
+      (configuration.verification_workers if None)
+
+    Returns
+    -------
+    dict
+      file path -> SHA256 hex digest
+
+    Raises
+    ------
+    OSError
+      if any of the files can't be read
+    """
+    if max_workers is None:
+        max_workers = configuration.verification_workers
+    cache = HashCache()
+    digests = {}
+    to_hash = []
+    for file_path in file_paths:
+        st = os.stat(file_path)
+        if digest := cache.get(file_path, st):
+            digests[file_path] = digest
+        else:
+            to_hash.append((file_path, st))
+    log.debug(
+        _("Checksums cached for {} of {} files").format(len(digests), len(file_paths))
+    )
+    if not to_hash:
+        return digests
+
+    total_bytes = max(sum(st.st_size for _path, st in to_hash), 1)
+    done_bytes = [0]
+    lock = threading.Lock()
+
+    def hash_one(file_path: pathlib.Path, st: os.stat_result) -> str:
+        file_hash = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            while chunk := f.read(hash_read_size):
+                file_hash.update(chunk)
+                with lock:
+                    done_bytes[0] += len(chunk)
+        digest = file_hash.hexdigest()
+        cache.put(file_path, st, digest)
+        return digest
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(hash_one, file_path, st): file_path
+                for file_path, st in to_hash
+            }
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(pending, timeout=0.5, return_when=FIRST_EXCEPTION)
+                for future in finished:
+                    # re-raises exception from the worker (if any)
+                    digests[futures[future]] = future.result()
+                if progress_reporter is not None:
+                    with lock:
+                        progress_reporter.progress(int(100 * done_bytes[0] / total_bytes))
+    finally:
+        cache.save()
+    return digests
+
+
+def verify_files(expected_hashes: dict, progress_reporter=None) -> tuple[bool, str]:
+    """Compares SHA256 of files with expected values
+
+    Parameters
+    ----------
+    expected_hashes : dict
+      file path -> expected SHA256 hex digest
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F - all files are intact, description of the first mismatch
+    """
+    if not expected_hashes:
+        return (True, "")
+    if progress_reporter is not None:
+        progress_reporter.progress_msg(
+            _("Verifying {} file(s)").format(len(expected_hashes))
+        )
+    try:
+        digests = hash_files(list(expected_hashes.keys()), progress_reporter)
+    except OSError as error:
+        msg = _("Could not read file: {}").format(error)
+        log.error(msg)
+        return (False, msg)
+    for file_path, expected in expected_hashes.items():
+        if digests[file_path] != expected:
+            msg = _("File {} is damaged (checksum mismatch)").format(file_path)
+            log.error(msg)
+            return (False, msg)
+    log.info(_("{} file(s) verified").format(len(expected_hashes)))
+    if progress_reporter is not None:
+        progress_reporter.progress_msg(_("hash OK"))
+    return (True, "")
@@ -0,0 +1,143 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import logging
+import os
+import secrets
+import time
+
+import configuration
+
+from i18n import _
+
+log = logging.getLogger("lomanager2_logger")
+
+# Journal of changes being made: a JSON record per line, every record
+# is flushed to disk before the program continues. The journal exists
+# only while changes are being made, if it is found at startup the
+# previous run was interrupted and can be resumed.
+# Records ("op" key):
+#   begin   - procedure, package marks, keep_packages, temporary_dir,
+#             run (identifies the process that made the changes)
+#   file    - a collected file: path, label, sha256, manifest entry
+#   changes - all files to install: files_to_install, manifest, packages_dir
+#   step    - step of making changes completed: step
+journal_format = 1
+# Journal started by this process is not interrupted while it runs
+_run_id = secrets.token_hex(8)
+
+
+def _fsync_dir(dir_path):
+    fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def begin(procedure: str, marks: list[dict], keep_packages: bool):
+    """Starts a new journal (replacing any previous one)"""
+    journal_file = configuration.journal_file
+    temp_file = journal_file.with_name(journal_file.name + ".tmp")
+    record = {
+        "op": "begin",
+        "format": journal_format,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "procedure": procedure,
+        "marks": marks,
+        "keep_packages": keep_packages,
+        "temporary_dir": str(configuration.temporary_dir),
+        "run": _run_id,
+    }
+    try:
+        os.makedirs(journal_file.parent, exist_ok=True)
+        with open(temp_file, "w") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, journal_file)
+        _fsync_dir(journal_file.parent)
+    except OSError as error:
+        log.warning(_("Could not start changes journal: {}").format(error))
+
+
+def append(record: dict):
+    """Adds a record to the journal and waits until it is on disk"""
+    if not configuration.journal_file.exists():
+        return
+    try:
+        with open(configuration.journal_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    except OSError as error:
+        log.warning(_("Could not write to changes journal: {}").format(error))
+
+
+def step_done(step: str):
+    log.debug(_("Journal checkpoint: {}").format(step))
+    append({"op": "step", "step": step})
+
+
+def finish():
+    """Removes the journal, changes are complete"""
+    try:
+        os.remove(configuration.journal_file)
+        _fsync_dir(configuration.journal_file.parent)
+    except FileNotFoundError:
+        pass
+    except OSError as error:
+        log.warning(_("Could not remove changes journal: {}").format(error))
+
+
+def is_active() -> bool:
+    return configuration.journal_file.exists()
+
+
+def load() -> list[dict] | None:
+    """Reads records of an interrupted run (None if there is no journal)"""
+    try:
+        with open(configuration.journal_file, "r") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return None
+    except OSError as error:
+        log.warning(_("Could not read changes journal: {}").format(error))
+        return None
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            # Record being written when the program was interrupted
+            log.debug(_("Ignoring incomplete journal record"))
+            break
+    if not records or records[0].get("op") != "begin":
+        return None
+    if records[0].get("format") != journal_format:
+        return None
+    return records
+
+
+def is_interrupted(records: list[dict]) -> bool:
+    """Tells if the journal was left by another (interrupted) process"""
+    return records[0].get("run") != _run_id
+
+
+def completed_steps(records: list[dict]) -> set:
+    return {r["step"] for r in records if r["op"] == "step"}
@@ -16,14 +16,18 @@ You should have received a copy of the GNU General Public License
 along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
 """
 import hashlib
+import json
 import logging
 import pathlib
 import socket
 import time
 import urllib.error
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable
 
+import configuration
+
 from i18n import _
 
 log = logging.getLogger("lomanager2_logger")
@@ -48,25 +52,142 @@ def check_url_available(url: str) -> tuple[bool, str]:
         return (False, msg)
 
 
+def get_remote_file_size(url: str) -> tuple[bool, int]:
+    """Asks the server for the size of a file without downloading it
+
+    Returns
+    -------
+    tuple[bool, int]
+      T/F - size could be determined, size in bytes (0 if unknown)
+    """
+    request = urllib.request.Request(url, method="HEAD")
+    try:
+        with urllib.request.urlopen(request, timeout=connections_timeout) as resp:
+            content_length = resp.headers.get("Content-Length", "")
+    except (urllib.error.URLError, ValueError, OSError) as error:
+        log.warning(_("Could not get size of {}: {}").format(url, error))
+        return (False, 0)
+    if not content_length.isdigit():
+        log.warning(_("Server did not report size of {}").format(url))
+        return (False, 0)
+    return (True, int(content_length))
+
+
+def resolve_file_sizes(urls: list[str], max_workers: int = 8) -> dict[str, int]:
+    """Finds exact sizes of remote files
+
+    Sizes already known are taken from the cache file
+    (file names include versions so once learned a size never changes),
+    the rest is queried concurrently with HEAD requests and added
+    to the cache.
+
+    Returns
+    -------
+    dict[str, int]
+      url -> size in bytes, urls for which size is unknown are omitted
+    """
+    cache_file = configuration.download_sizes_cache_file
+    try:
+        with open(cache_file, "r") as f:
+            cached_sizes = json.load(f)
+    except (OSError, ValueError):
+        cached_sizes = {}
+
+    sizes = {url: cached_sizes[url] for url in urls if url in cached_sizes}
+    missing = [url for url in urls if url not in sizes]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for url, (is_known, size) in zip(
+                missing, executor.map(get_remote_file_size, missing)
+            ):
+                if is_known:
+                    sizes[url] = size
+        cached_sizes.update(sizes)
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_file, "w") as f:
+                json.dump(cached_sizes, f, indent=1)
+        except OSError as error:
+            log.warning(_("Could not save download sizes cache: {}").format(error))
+    log.debug(
+        _("Exact sizes known for {} of {} files").format(len(sizes), len(urls))
+    )
+    return sizes
+
+
+class DownloadBatchProgress:
+    """Tracks progress of downloading a set of files of known total size
+
+    Progress of every file is weighted by its size so that the
+    progress bar moves evenly for the whole batch. Estimated time
+    to finish the batch is appended to the progress description.
+    """
+
+    def __init__(self, total_bytes: int, progress_reporter: Callable) -> None:
+        self.total_bytes = max(total_bytes, 1)
+        self.completed_bytes = 0
+        self.progress_reporter = progress_reporter
+        self._start_time = time.monotonic()
+        self._current_label = ""
+        self._last_msg_time = 0.0
+
+    def eta_string(self, done_bytes: int) -> str:
+        elapsed = time.monotonic() - self._start_time
+        if done_bytes <= 0 or elapsed < 1:
+            return ""
+        remaining_sec = (self.total_bytes - done_bytes) * elapsed / done_bytes
+        if remaining_sec < 60:
+            return _("less than a minute left")
+        return _("about {} min left").format(round(remaining_sec / 60))
+
+    def start_file(self, label: str):
+        self._current_label = label
+        self.progress_reporter.progress_msg(label)
+
+    def update(self, file_got_bytes: int):
+        done_bytes = min(self.completed_bytes + file_got_bytes, self.total_bytes)
+        self.progress_reporter.progress(int(100 * done_bytes / self.total_bytes))
+        # Don't flood the log, refresh ETA every few seconds only
+        now = time.monotonic()
+        if now - self._last_msg_time > 5 and (eta := self.eta_string(done_bytes)):
+            self._last_msg_time = now
+            self.progress_reporter.progress_msg(f"{self._current_label} ({eta})")
+
+    def file_done(self, file_size: int):
+        self.completed_bytes += file_size
+
+    def file_discarded(self, file_size: int):
+        # Downloaded file turned out to be unusable and will be fetched again
+        self.completed_bytes -= file_size
+
+
 def download_file(
     src_url: str,
     dest_path: pathlib.Path,
     progress_reporter: Callable,
     max_retries: int = 3,
     retry_delay_sec: int = 5,
+    batch_progress: DownloadBatchProgress | None = None,
 ) -> tuple[bool, str]:
     info = ""
 
     def progress_reporthook(n_blocks_transferred, block_size, file_tot_size):
         already_got_bytes = n_blocks_transferred * block_size
-        if file_tot_size == -1:
+        if batch_progress is not None:
+            if file_tot_size != -1:
+                already_got_bytes = min(already_got_bytes, file_tot_size)
+            batch_progress.update(already_got_bytes)
+        elif file_tot_size == -1:
             pass
         else:
             percent_p = int(100 * (already_got_bytes / file_tot_size))
             progress_reporter.progress(percent_p)
 
     filename = src_url.split("/")[-1]
-    progress_reporter.progress_msg(_("Downloading: {}").format(filename))
+    if batch_progress is not None:
+        batch_progress.start_file(_("Downloading: {}").format(filename))
+    else:
+        progress_reporter.progress_msg(_("Downloading: {}").format(filename))
 
     for attempt in range(1, max_retries + 1):
         try:
@@ -75,6 +196,8 @@ def download_file(
                 filename=dest_path,
                 reporthook=progress_reporthook,
             )
+            if batch_progress is not None:
+                batch_progress.file_done(pathlib.Path(dest_path).stat().st_size)
             progress_reporter.progress_msg(_("Downloaded:      {}").format(filename))
             return (True, "")
         except Exception as error:
@@ -86,6 +209,68 @@ def download_file(
     return (False, info)
 
 
+def download_resumable(
+    src_url: str,
+    dest_path: pathlib.Path,
+    cancel_event=None,
+    rate_limit: int = 0,
+) -> tuple[bool, str]:
+    """Downloads a file in the background, continuing a partial download
+
+    Data is written to dest_path + ".part" which is renamed to dest_path
+    when complete. If the part file already exists only the remaining
+    bytes are requested (HTTP Range). Download stops, leaving the part
+    file for later, as soon as cancel_event (threading.Event) is set.
+
+    Parameters
+    ----------
+    src_url : str
+
+    dest_path : pathlib.Path
+
+    cancel_event : threading.Event | None
+
+    rate_limit : int
+      maximum average speed in bytes per second, 0 - unlimited
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F - file complete, error description (or "cancelled")
+    """
+    part_path = pathlib.Path(dest_path).with_name(pathlib.Path(dest_path).name + ".part")
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    request = urllib.request.Request(src_url, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=connections_timeout) as resp:
+            if resp.status != 206:
+                # Server sends the whole file
+                offset = 0
+            with open(part_path, "ab" if offset else "wb") as f:
+                start_time = time.monotonic()
+                got_bytes = 0
+                while chunk := resp.read(256 * 1024):
+                    f.write(chunk)
+                    got_bytes += len(chunk)
+                    if cancel_event is not None and cancel_event.is_set():
+                        return (False, _("cancelled"))
+                    if rate_limit:
+                        ahead = got_bytes / rate_limit - (time.monotonic() - start_time)
+                        if ahead > 0:
+                            time.sleep(ahead)
+    except urllib.error.HTTPError as error:
+        if error.code == 416:
+            # Part file is already complete
+            pass
+        else:
+            return (False, _("HTTP error {}: {}").format(error.code, error.reason))
+    except (urllib.error.URLError, OSError) as error:
+        return (False, str(error))
+    part_path.replace(dest_path)
+    return (True, "")
+
+
 def verify_checksum(
     file: pathlib.Path,
     checksum_file: pathlib.Path,
@@ -0,0 +1,157 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import logging
+import os
+import pathlib
+
+from i18n import _
+
+from . import integrity
+
+log = logging.getLogger("lomanager2_logger")
+
+# Index of the saved packages is kept next to them in this file
+manifest_file_name = "lomanager2-manifest.json"
+# Increased whenever the layout of the manifest changes incompatibly
+manifest_format = 1
+
+
+def manifest_entry(
+    component: str,
+    version: str,
+    language: str,
+    rel_path: pathlib.Path,
+    size: int,
+    url: str,
+) -> dict:
+    """Describes one saved file
+
+    Parameters
+    ----------
+    component : str
+      Java, LibreOffice-core, LibreOffice-langs or Clipart
+
+    version : str
+      version of the package the file belongs to
+
+    language : str
+      language code for LibreOffice lang/help packs, empty otherwise
+
+    rel_path : pathlib.Path
+      path of the file relative to the saved packages directory
+
+    size : int
+      file size in bytes
+
+    url : str
+      address the file was downloaded from
+
+    Returns
+    -------
+    dict
+      manifest entry (sha256 is filled in when manifest is written)
+    """
+    return {
+        "component": component,
+        "version": version,
+        "language": language,
+        "path": str(rel_path),
+        "size": size,
+        "sha256": "",
+        "url": url,
+    }
+
+
+def write_manifest(
+    copy_dir: pathlib.Path, entries: list[dict], progress_reporter=None
+) -> tuple[bool, str]:
+    """Hashes saved files and writes their manifest to copy_dir
+
+    Manifest is first written to a temporary file and then renamed
+    so an interrupted write never leaves a truncated manifest behind.
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F - success/failure, error description (empty on success)
+    """
+    try:
+        file_paths = [pathlib.Path(copy_dir).joinpath(e["path"]) for e in entries]
+        if progress_reporter is not None:
+            progress_reporter.progress_msg(_("Indexing saved packages"))
+        digests = integrity.hash_files(file_paths, progress_reporter)
+        for entry, file_path in zip(entries, file_paths):
+            entry["size"] = os.path.getsize(file_path)
+            entry["sha256"] = digests[file_path]
+
+        manifest_path = pathlib.Path(copy_dir).joinpath(manifest_file_name)
+        temp_path = manifest_path.with_name(manifest_path.name + ".part")
+        with open(temp_path, "w") as f:
+            json.dump({"format": manifest_format, "files": entries}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, manifest_path)
+    except (OSError, KeyError) as error:
+        msg = _("Failed to write manifest of saved packages: {}").format(error)
+        log.error(msg)
+        return (False, msg)
+    log.info(_("Manifest of saved packages written to {}").format(manifest_path))
+    return (True, "")
+
+
+def load_manifest(copy_dir: pathlib.Path) -> list[dict] | None:
+    """Reads manifest of saved packages directory
+
+    Returns
+    -------
+    list[dict] | None
+      manifest entries or None if the directory has no (usable) manifest
+    """
+    manifest_path = pathlib.Path(copy_dir).joinpath(manifest_file_name)
+    if not manifest_path.is_file():
+        log.debug(_("No manifest in {}").format(copy_dir))
+        return None
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != manifest_format:
+            log.warning(
+                _("Unsupported manifest format in {}").format(manifest_path)
+            )
+            return None
+        entries = manifest["files"]
+        for entry in entries:
+            for key in ("component", "version", "language", "path", "size", "sha256"):
+                if key not in entry:
+                    raise KeyError(key)
+    except (OSError, ValueError, KeyError, AttributeError, TypeError) as error:
+        log.warning(_("Ignoring unreadable manifest {}: {}").format(manifest_path, error))
+        return None
+    log.debug(_("Loaded manifest {} ({} files)").format(manifest_path, len(entries)))
+    return entries
+
+
+def is_entry_present(copy_dir: pathlib.Path, entry: dict) -> bool:
+    # Cheap check (no reading of file content): file exists and has the
+    # size recorded in the manifest
+    file_path = pathlib.Path(copy_dir).joinpath(entry["path"])
+    try:
+        return os.path.getsize(file_path) == entry["size"]
+    except OSError:
+        return False
@@ -0,0 +1,239 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import functools
+import logging
+import os
+import pathlib
+import shutil
+
+import configuration
+
+from i18n import _
+
+from . import integrity, offlinecopy, transfer
+from .datatypes import compare_versions
+
+log = logging.getLogger("lomanager2_logger")
+
+# Saved packages repository holds every distinct file only once:
+#   blobs/sha256/<2 first hex digits>/<sha256>
+#   versions/<LibreOffice version>/Java_rpms/...
+#                                 /LibreOffice-core_tgzs/...
+#                                 /LibreOffice-langs_tgzs/...
+#                                 /Clipart_rpms/...
+#                                 /lomanager2-manifest.json
+# Files in versions/ are hardlinks to blobs, so that every version
+# directory looks exactly like a (legacy) saved packages directory
+# and can be copied elsewhere or used for installation directly.
+blobs_dir_name = "blobs"
+versions_dir_name = "versions"
+# Name of the view for saved packages that do not include LibreOffice
+no_office_version = "other"
+
+
+def is_repository(directory: pathlib.Path) -> bool:
+    return pathlib.Path(directory).joinpath(versions_dir_name).is_dir()
+
+
+def _blob_path(repo_dir: pathlib.Path, digest: str) -> pathlib.Path:
+    return repo_dir.joinpath(blobs_dir_name, "sha256", digest[:2], digest)
+
+
+def _is_version(name: str) -> bool:
+    return all(part.isdigit() for part in name.split("."))
+
+
+def list_versions(repo_dir: pathlib.Path) -> list[str]:
+    """Returns versions saved in the repository, newest first
+
+    no_office_version (if saved) comes last.
+    """
+    versions_dir = pathlib.Path(repo_dir).joinpath(versions_dir_name)
+    if not versions_dir.is_dir():
+        return []
+    names = [d.name for d in versions_dir.iterdir() if d.is_dir()]
+    versions = sorted(
+        [name for name in names if _is_version(name)],
+        key=functools.cmp_to_key(compare_versions),
+    )
+    if no_office_version in names:
+        versions.append(no_office_version)
+    return versions
+
+
+def version_dir(repo_dir: pathlib.Path, version: str = "") -> pathlib.Path | None:
+    """Returns directory with packages of a version saved in the repository
+
+    Parameters
+    ----------
+    repo_dir : pathlib.Path
+
+    version : str
+      requested version, empty string means the newest one
+      (no_office_version if only packages without LibreOffice were saved)
+
+    Returns
+    -------
+    pathlib.Path | None
+      version directory or None if the version is not in the repository
+    """
+    versions = list_versions(repo_dir)
+    if not version:
+        if not versions:
+            return None
+        version = versions[0]
+    if version not in versions:
+        log.error(_("Version {} not found in {}").format(version, repo_dir))
+        return None
+    log.info(_("Using saved packages of version {}").format(version))
+    return pathlib.Path(repo_dir).joinpath(versions_dir_name, version)
+
+
+def add_version(
+    repo_dir: pathlib.Path,
+    source_dir: pathlib.Path,
+    entries: list[dict],
+    progress_reporter=None,
+) -> tuple[bool, str, pathlib.Path | None]:
+    """Moves saved files into the repository
+
+    Every file is stored as a blob (files already present in the
+    repository are not stored again) and linked into the directory of
+    the LibreOffice version it belongs to. Files saved earlier for
+    the same version that are not replaced remain available.
+
+    Parameters
+    ----------
+    repo_dir : pathlib.Path
+
+    source_dir : pathlib.Path
+      directory from which entries[...]["path"] are relative
+
+    entries : list[dict]
+      manifest entries of the files to save (see offlinecopy.manifest_entry)
+
+    Returns
+    -------
+    tuple[bool, str, pathlib.Path | None]
+      T/F - success/failure, error description, version directory
+    """
+    repo_dir = pathlib.Path(repo_dir)
+    core_versions = [e["version"] for e in entries if e["component"] == "LibreOffice-core"]
+    version = core_versions[0] if core_versions else no_office_version
+    view_dir = repo_dir.joinpath(versions_dir_name, version)
+
+    try:
+        # Before this layout was introduced packages were saved directly
+        # in repo_dir and every save replaced the previous one
+        if repo_dir.exists() and not is_repository(repo_dir):
+            log.info(_("Replacing old style saved packages in {}").format(repo_dir))
+            shutil.rmtree(repo_dir)
+        os.makedirs(repo_dir.joinpath(versions_dir_name), exist_ok=True)
+
+        file_paths = [source_dir.joinpath(e["path"]) for e in entries]
+        if progress_reporter is not None:
+            progress_reporter.progress_msg(_("Indexing saved packages"))
+        digests = integrity.hash_files(file_paths, progress_reporter)
+
+        # Entries saved earlier for this version (unless replaced now)
+        old_entries = offlinecopy.load_manifest(view_dir) or []
+        new_paths = {e["path"] for e in entries}
+        kept_entries = [e for e in old_entries if e["path"] not in new_paths]
+
+        for entry, file_path in zip(entries, file_paths):
+            entry["size"] = os.path.getsize(file_path)
+            entry["sha256"] = digests[file_path]
+            blob = _blob_path(repo_dir, entry["sha256"])
+            if blob.exists():
+                log.debug(_("Already saved: {}").format(file_path.name))
+                os.remove(file_path)
+            else:
+                os.makedirs(blob.parent, exist_ok=True)
+                is_moved, msg = transfer.transfer_file(
+                    file_path, blob, progress_reporter
+                )
+                if not is_moved:
+                    return (False, msg, None)
+            link = view_dir.joinpath(entry["path"])
+            os.makedirs(link.parent, exist_ok=True)
+            if link.exists():
+                os.remove(link)
+            os.link(blob, link)
+    except OSError as error:
+        msg = _("Failed to save packages in {}: {}").format(repo_dir, error)
+        log.error(msg)
+        return (False, msg, None)
+
+    is_written, msg = offlinecopy.write_manifest(view_dir, kept_entries + entries)
+    if not is_written:
+        return (False, msg, None)
+    log.info(_("Packages of version {} saved in {}").format(version, view_dir))
+    try:
+        prune_versions(repo_dir, configuration.offline_repo_max_versions)
+    except Exception as error:
+        # Packages are saved, old versions just stay for now
+        log.warning(_("Failed to remove old saved packages: {}").format(error))
+    return (True, "", view_dir)
+
+
+def remove_version(repo_dir: pathlib.Path, version: str) -> bool:
+    view_dir = pathlib.Path(repo_dir).joinpath(versions_dir_name, version)
+    try:
+        shutil.rmtree(view_dir)
+    except OSError as error:
+        log.error(_("Failed to remove {}: {}").format(view_dir, error))
+        return False
+    log.info(_("Removed saved packages of version {}").format(version))
+    return True
+
+
+def prune_versions(repo_dir: pathlib.Path, max_versions: int):
+    """Keeps only max_versions newest versions and removes unused blobs"""
+    office_versions = [
+        v for v in list_versions(repo_dir) if v != no_office_version
+    ]
+    for version in office_versions[max_versions:]:
+        remove_version(repo_dir, version)
+    collect_garbage(repo_dir)
+
+
+def collect_garbage(repo_dir: pathlib.Path) -> tuple[int, int]:
+    """Removes blobs not linked from any version directory
+
+    A blob that is used by no version has link count of 1.
+
+    Returns
+    -------
+    tuple[int, int]
+      number of removed blobs, number of bytes freed
+    """
+    removed, freed = 0, 0
+    blobs_dir = pathlib.Path(repo_dir).joinpath(blobs_dir_name)
+    if not blobs_dir.is_dir():
+        return (removed, freed)
+    for blob in blobs_dir.glob("sha256/*/*"):
+        try:
+            st = blob.stat()
+            if st.st_nlink == 1:
+                os.remove(blob)
+                removed += 1
+                freed += st.st_size
+        except OSError as error:
+            log.warning(_("Could not remove {}: {}").format(blob, error))
+    log.debug(_("Removed {} unused blob(s), {} bytes freed").format(removed, freed))
+    return (removed, freed)
@@ -16,19 +16,43 @@ You should have received a copy of the GNU General Public License
 along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
 """
 import copy
+import functools
 import logging
 import os
 import pathlib
 import re
+import tarfile
 import time
-import xml.etree.ElementTree as ET
 from typing import Callable
 
 import configuration
 
 from i18n import _
 
-from . import PCLOS, net
+from . import (
+    PCLOS,
+    aptrepo,
+    cleanup,
+    hooks,
+    integrity,
+    journal,
+    net,
+    offlinecopy,
+    offlinerepo,
+    peruser,
+    prefetch,
+    preparedplan,
+    prestage,
+    resolver,
+    rollback,
+    rpmheader,
+    scheduler,
+    spaceplanner,
+    staging,
+    transfer,
+    txplanner,
+    xcuedit,
+)
 from .callbacks import UnifiedProgressReporter
 from .datatypes import SignalFlags, VirtualPackage, compare_versions
 from .manualselection import ManualSelectionLogic
@@ -40,9 +64,13 @@ class MainLogic(object):
     def __init__(self, skip_update_check: bool) -> None:
         self.skip_update_check = skip_update_check
 
-        make_changes_count = 7
+        make_changes_count = 9
         self.normal_procedure_step_count = 3 + make_changes_count
         self.local_copy_procedure_step_count = 3 + make_changes_count
+        self.prepare_procedure_step_count = 3 + 2
+        self.commit_procedure_step_count = 1 + make_changes_count
+        self.rollback_procedure_step_count = 2
+        self.repository_procedure_step_count = 4
         self.rebuild_tree_procedure_step_count = 4
         self.check_system_procedure_step_count = (
             4 + self.rebuild_tree_procedure_step_count
@@ -56,13 +84,22 @@ class MainLogic(object):
         self._package_menu = ManualSelectionLogic(
             self.package_tree_root, "", "", "", "", "", ""
         )
+        self._prefetch_manager = prefetch.PrefetchManager()
+        # Menu refreshes etc. requested while making changes
+        self._post_hooks = hooks.PostTransactionHooks()
+        # file path -> SHA256 of files collected by an interrupted run
+        self._collected_before = {}
 
     # -- Public interface for MainLogic
     def change_removal_mark(self, package: VirtualPackage, mark: bool) -> bool:
-        return self._package_menu.apply_removal_logic(package, mark)
+        is_changed = self._package_menu.apply_removal_logic(package, mark)
+        self._update_prefetch()
+        return is_changed
 
     def change_install_mark(self, package: VirtualPackage, mark: bool) -> bool:
-        return self._package_menu.apply_install_logic(package, mark)
+        is_changed = self._package_menu.apply_install_logic(package, mark)
+        self._update_prefetch()
+        return is_changed
 
     def get_warnings(self):
         warnings = copy.deepcopy(self.warnings)
@@ -94,142 +131,402 @@ class MainLogic(object):
         and calls file download procedure if any files have to be collected.
         When done it calls _make_changes to do modify system state.
         """
-        if self.global_flags.ready_to_apply_changes is False:
-            msg = _("Not ready to apply changes")
-            self.inform_user(msg, "", isOK=False)
+        collected = self._collect_changes(self.normal_procedure_step_count, kwargs)
+        if collected is None:
             return
+        progress_reporter, keep_packages, virtual_packages, collected_files = collected
 
-        if "keep_packages" in kwargs.keys():
-            keep_packages = kwargs["keep_packages"]
-        else:
-            msg = _("keep_packages argument is obligatory")
-            self.inform_user(msg, "", isOK=False)
+        # Uninstall/Install packages
+        self._make_changes(
+            virtual_packages,
+            rpms_and_tgzs_to_use=collected_files,
+            create_offline_copy=keep_packages,
+            progress_reporter=progress_reporter,
+        )
+
+    def prepare_changes(self, *args, **kwargs):
+        """Does everything apply_changes does short of modifying the system
+
+        Files are collected, verified, extracted and test-installed
+        (rpm --test), then stored with a sealed plan of the changes
+        in configuration.prepared_dir. The changes are made later
+        by commit_prepared_changes.
+        """
+        collected = self._collect_changes(
+            self.prepare_procedure_step_count, kwargs, use_journal=False
+        )
+        if collected is None:
             return
+        progress_reporter, keep_packages, virtual_packages, collected_files = collected
 
-        if "force_java_download" in kwargs.keys():
-            force_java_download = kwargs["force_java_download"]
-        else:
-            msg = _("force_java_download argument is obligatory")
+        # STEP
+        progress_reporter.step_start(_("Checking if packages can be installed"))
+        preparedplan.discard()
+        is_moved, msg = PCLOS.move_dir(
+            configuration.verified_dir, configuration.prepared_dir, progress_reporter
+        )
+        if is_moved is False:
+            self.inform_user(_("Failed to store prepared packages: "), msg, isOK=False)
+            return
+        files_to_install = {
+            label: [
+                str(path.relative_to(configuration.verified_dir)) for path in paths
+            ]
+            for label, paths in collected_files["files_to_install"].items()
+        }
+        is_installable, msg = self._test_install_prepared(
+            files_to_install, virtual_packages, progress_reporter
+        )
+        if is_installable is False:
+            preparedplan.discard()
+            self.inform_user(_("Prepared packages can't be installed: "), msg, isOK=False)
+            return
+        progress_reporter.step_end()
+
+        # STEP
+        progress_reporter.step_start(_("Saving the plan of changes"))
+        rel_paths = [rel for paths in files_to_install.values() for rel in paths]
+        try:
+            digests = integrity.hash_files(
+                [preparedplan.absolute_path(rel) for rel in rel_paths],
+                progress_reporter,
+            )
+        except OSError as error:
+            preparedplan.discard()
+            self.inform_user(_("Failed to save the plan: "), str(error), isOK=False)
+            return
+        plan = preparedplan.new_plan(
+            rpmdb_generation=PCLOS.get_rpmdb_generation(),
+            marks=self._package_marks(virtual_packages),
+            files_to_install=files_to_install,
+            file_hashes={
+                rel: digests[preparedplan.absolute_path(rel)] for rel in rel_paths
+            },
+            manifest=collected_files["manifest"],
+            keep_packages=keep_packages,
+        )
+        is_saved, msg = preparedplan.save_plan(plan)
+        if is_saved is False:
+            preparedplan.discard()
+            self.inform_user(_("Failed to save the plan: "), msg, isOK=False)
+            return
+        progress_reporter.step_end()
+        msg = _(
+            "Changes prepared. Use \"Install prepared changes\" to make them, "
+            "no download will be needed."
+        )
+        self.inform_user(msg, "", isOK=True)
+
+    def commit_prepared_changes(self, *args, **kwargs):
+        """Makes changes prepared earlier by prepare_changes
+
+        Changes are made only if the plan is intact, the prepared files
+        match it and the installed packages have not changed since
+        the preparation (the plan is discarded otherwise).
+        """
+        if self.global_flags.ready_to_apply_changes is False:
+            msg = _("Not ready to apply changes")
             self.inform_user(msg, "", isOK=False)
             return
 
-        # We are good to go
         progress_reporter = UnifiedProgressReporter(
-            total_steps=self.normal_procedure_step_count, callbacks=kwargs
+            total_steps=self.commit_procedure_step_count, callbacks=kwargs
         )
 
-        # Mark Java for download if the user requested that
-        java_package = [
-            c for c in self.package_tree_root.children if "Java" in c.family
-        ][0]
-        if force_java_download is True:
-            java_package.is_marked_for_download = True
-            # TODO: If force_java_download is set by the user it most likely
-            #       means Java is already installed and only
-            #       download is wanted. In that case java package definition
-            #       from _get_available_software will not be used
-            #       and real_files list will be empty. This causes crash
-            #       in download in _collect_packages.
-            #       Adding missing information here fixes the problem
-            #       but this is hacky.
-            java_package.real_files = [
-                {
-                    "name": "task-java-2019-1pclos2019.noarch.rpm",
-                    "base_url": configuration.PCLOS_repo_base_url
-                    + configuration.PCLOS_repo_path,
-                    "estimated_download_size": 1592,  # size in bytes
-                    "checksum": "",
-                },
-                {
-                    "name": "java-sun-16-2pclos2021.x86_64.rpm",
-                    "base_url": configuration.PCLOS_repo_base_url
-                    + configuration.PCLOS_repo_path,
-                    "estimated_download_size": 119920500,  # size in bytes
-                    "checksum": "",
-                },
-            ]
-
         # Block any other calls of this function and proceed
         self.global_flags.ready_to_apply_changes = False
+        self._prefetch_manager.stop()
 
-        log.info(_("*** Applying selected changes ***"))
+        log.info(_("*** Making prepared changes ***"))
 
+        # STEP
+        progress_reporter.step_start(_("Validating prepared changes"))
+        plan, msg = preparedplan.load_plan()
+        if plan is None:
+            preparedplan.discard()
+            self.inform_user(_("Prepared changes can't be made: "), msg, isOK=False)
+            return
+        if self._is_blocked(
+            is_installing=any(mark["install"] for mark in plan["marks"]),
+            is_removing=any(mark["remove"] for mark in plan["marks"]),
+        ):
+            return
+        rpmdb_generation = PCLOS.get_rpmdb_generation()
+        if not rpmdb_generation or plan["rpmdb_generation"] != rpmdb_generation:
+            preparedplan.discard()
+            msg = _("Installed packages changed since the changes were prepared")
+            self.inform_user(_("Prepared changes can't be made: "), msg, isOK=False)
+            return
+        is_intact, msg = integrity.verify_files(
+            {
+                preparedplan.absolute_path(rel): digest
+                for rel, digest in plan["file_hashes"].items()
+            },
+            progress_reporter,
+        )
+        if is_intact is False:
+            preparedplan.discard()
+            self.inform_user(_("Prepared changes can't be made: "), msg, isOK=False)
+            return
         virtual_packages = []
         self.package_tree_root.get_subtree(virtual_packages)
         virtual_packages.remove(self.package_tree_root)
-
-        collected_files = {
+        is_restored, msg = self._restore_marks(plan["marks"], virtual_packages)
+        if is_restored is False:
+            preparedplan.discard()
+            self.inform_user(_("Prepared changes can't be made: "), msg, isOK=False)
+            return
+        rpms_and_tgzs_to_use = {
             "files_to_install": {
-                "Java": [],
-                "LibreOffice-core": [],
-                "LibreOffice-langs": [],
-                "Clipart": [],
+                label: [preparedplan.absolute_path(rel) for rel in rel_paths]
+                for label, rel_paths in plan["files_to_install"].items()
             },
+            "manifest": plan["manifest"],
         }
+        journal.begin("commit_prepared_changes", plan["marks"], plan["keep_packages"])
+        progress_reporter.step_end()
 
-        # STEP
-        progress_reporter.step_start(_("Cleaning temporary directories"))
-        is_cleaned_w, msg_w = PCLOS.clean_dir(configuration.working_dir)
-        if is_cleaned_w is False:
-            msg = _("Failed to (re)create working directory: ")
-            self.inform_user(msg, msg_w, isOK=False)
+        # Uninstall/Install packages
+        self._make_changes(
+            virtual_packages,
+            rpms_and_tgzs_to_use=rpms_and_tgzs_to_use,
+            create_offline_copy=plan["keep_packages"],
+            progress_reporter=progress_reporter,
+            packages_dir=configuration.prepared_dir,
+        )
+        # Whatever the result, installed packages are not the same anymore
+        preparedplan.discard()
+
+    def has_prepared_changes(self) -> bool:
+        return preparedplan.is_prepared()
+
+    def has_rollback(self) -> bool:
+        return rollback.latest() is not None
+
+    def rollback_office(self, *args, **kwargs):
+        """Reinstalls LibreOffice kept when it was last removed
+
+        Kept packages are verified, any Office installed now is removed,
+        then the kept packages are installed in one rpm transaction.
+        No files are downloaded.
+        """
+        if self.global_flags.ready_to_apply_changes is False:
+            msg = _("Not ready to apply changes")
+            self.inform_user(msg, "", isOK=False)
             return
-        is_cleaned_v, msg_v = PCLOS.clean_dir(configuration.verified_dir)
-        if is_cleaned_v is False:
-            msg = _("Failed to (re)create verified directory: ")
-            self.inform_user(msg, msg_v, isOK=False)
+
+        if (saved := rollback.latest()) is None:
+            msg = _("No previous LibreOffice version was kept")
+            self.inform_user(msg, "", isOK=False)
             return
-        else:
-            directories = [
-                configuration.working_dir,
-                configuration.verified_dir.joinpath("Java_rpms"),
-                configuration.verified_dir.joinpath("LibreOffice-core_tgzs"),
-                configuration.verified_dir.joinpath("LibreOffice-langs_tgzs"),
-                configuration.verified_dir.joinpath("Clipart_rpms"),
-            ]
-            for dir in directories:
-                PCLOS.create_dir(dir)
-        progress_reporter.step_end()
 
-        packages_to_download = [p for p in virtual_packages if p.is_marked_for_download]
-        if packages_to_download:
-            # Some packages need to be downloaded
-            # STEP
-            progress_reporter.step_start(_("Checking free disk space for download"))
-            is_enough, needed, available = self._space_for_download(
-                packages_to_download
+        virtual_packages = []
+        self.package_tree_root.get_subtree(virtual_packages)
+        installed_office = [
+            p
+            for p in virtual_packages
+            if p.family in ["OpenOffice", "LibreOffice"] and p.is_installed
+        ]
+        if self._is_blocked(is_installing=True, is_removing=bool(installed_office)):
+            return
+
+        progress_reporter = UnifiedProgressReporter(
+            total_steps=self.rollback_procedure_step_count, callbacks=kwargs
+        )
+
+        # Block any other calls of this function and proceed
+        self.global_flags.ready_to_apply_changes = False
+        self._prefetch_manager.stop()
+
+        log.info(_("*** Restoring LibreOffice {} ***").format(saved["version"]))
+
+        # STEP
+        # (kept files are checked first - nothing is removed if they
+        #  can't be installed)
+        is_intact, expl = rollback.verify(saved, progress_reporter)
+        if is_intact is False:
+            msg = _("Kept LibreOffice packages can't be used: ")
+            self.inform_user(msg, expl, isOK=False)
+            return
+        if installed_office:
+            progress_reporter.step_start(_("Removing installed Office components"))
+            for package in installed_office:
+                package.is_marked_for_removal = True
+            is_removed, expl = self._uninstall_office_components(
+                installed_office, progress_reporter
             )
-            if is_enough is False:
-                msg = _(
-                    "Insufficient disk space to download selected "
-                    "packages. Needed: {}. Available: {}"
-                ).format(needed, available)
-                self.inform_user(msg, "", isOK=False)
+            if is_removed is False:
+                self._post_hooks.run(progress_reporter)
+                msg = _("Failed to remove Office components: ")
+                self.inform_user(msg, expl, isOK=False)
                 return
             progress_reporter.step_end()
+        else:
+            progress_reporter.step_skip(_("No Office components need to be removed"))
 
-            # STEP
-            progress_reporter.step_start(_("Collecting files"))
-            is_every_pkg_collected, expl, collected_files = self._collect_packages(
+        # STEP
+        progress_reporter.step_start(
+            _("Installing LibreOffice {}").format(saved["version"])
+        )
+        core_tgzs, lang_tgzs, rpms = rollback.files(saved)
+        is_installed, expl = self._install_office_components(
+            core_tgzs, lang_tgzs, progress_reporter, prebuilt_rpms=rpms
+        )
+        self._post_hooks.run(progress_reporter)
+        if is_installed is False:
+            msg = _("Failed to restore LibreOffice: ")
+            self.inform_user(msg, expl, isOK=False)
+            return
+        progress_reporter.step_end()
+        msg = _("LibreOffice {} restored").format(saved["version"])
+        self.inform_user(msg, "", isOK=True)
+
+    def has_interrupted_changes(self) -> bool:
+        # (changes being made by this very process are not interrupted)
+        records = journal.load()
+        return records is not None and journal.is_interrupted(records)
+
+    def discard_interrupted_changes(self):
+        journal.finish()
+
+    def resume_changes(self, *args, **kwargs):
+        """Continues changes interrupted by a crash or power loss
+
+        Package marks, collected files and completed steps are read
+        from the journal. Files collected before the interruption are
+        reused if they are still intact, steps that were completed
+        are skipped.
+        """
+        if self.global_flags.ready_to_apply_changes is False:
+            msg = _("Not ready to apply changes")
+            self.inform_user(msg, "", isOK=False)
+            return
+
+        records = journal.load()
+        if records is None:
+            msg = _("There are no interrupted changes to resume")
+            self.inform_user(msg, "", isOK=False)
+            return
+
+        begin = records[0]
+        if self._is_blocked(
+            is_installing=any(mark["install"] for mark in begin["marks"]),
+            is_removing=any(mark["remove"] for mark in begin["marks"]),
+        ):
+            return
+
+        progress_reporter = UnifiedProgressReporter(
+            total_steps=self.normal_procedure_step_count, callbacks=kwargs
+        )
+
+        # Block any other calls of this function and proceed
+        self.global_flags.ready_to_apply_changes = False
+        self._prefetch_manager.stop()
+
+        log.info(
+            _("*** Resuming changes interrupted on {} ***").format(begin["time"])
+        )
+
+        # STEP
+        progress_reporter.step_start(_("Checking files collected before"))
+        virtual_packages = []
+        self.package_tree_root.get_subtree(virtual_packages)
+        virtual_packages.remove(self.package_tree_root)
+        is_restored, msg = self._restore_marks(
+            begin["marks"], virtual_packages, is_resuming=True
+        )
+        if is_restored is False:
+            journal.finish()
+            msg_t = _("Interrupted changes can't be resumed: ")
+            self.inform_user(msg_t, msg, isOK=False)
+            return
+        configuration.set_temporary_dir(pathlib.Path(begin["temporary_dir"]))
+        self._create_staging_dirs()
+        self._collected_before = {
+            pathlib.Path(r["path"]): r["sha256"] for r in records if r["op"] == "file"
+        }
+        rpms_and_tgzs_to_use = None
+        packages_dir = configuration.verified_dir
+        keep_packages = begin["keep_packages"]
+        if changes := [r for r in records if r["op"] == "changes"]:
+            # (checksums of files not collected by the procedure itself,
+            #  eg. saved packages, are recorded when changes begin)
+            self._collected_before.update(
+                {
+                    pathlib.Path(path): digest
+                    for path, digest in changes[-1].get("file_hashes", {}).items()
+                }
+            )
+            files_to_install = {
+                label: [pathlib.Path(path) for path in paths]
+                for label, paths in changes[-1]["files_to_install"].items()
+            }
+            if all(
+                self._is_collected_before(path)
+                for paths in files_to_install.values()
+                for path in paths
+            ):
+                rpms_and_tgzs_to_use = {
+                    "files_to_install": files_to_install,
+                    "manifest": changes[-1]["manifest"],
+                }
+                packages_dir = pathlib.Path(changes[-1]["packages_dir"])
+                keep_packages = changes[-1]["create_offline_copy"]
+        progress_reporter.step_end()
+
+        # STEP
+        # (temporary directory may be on a different filesystem now
+        #  and the free space could have been used up in the meantime)
+        progress_reporter.step_start(_("Checking free disk space"))
+        if rpms_and_tgzs_to_use is None:
+            packages_to_download = [
+                p for p in virtual_packages if p.is_marked_for_download
+            ]
+            self._resolve_download_sizes(packages_to_download)
+            is_enough, shortages = self._plan_disk_space(
                 packages_to_download,
-                progress_reporter=progress_reporter,
+                {"files_to_install": {}, "manifest": []},
+                create_offline_copy=keep_packages,
+            )
+        else:
+            is_enough, shortages = self._plan_disk_space(
+                [], rpms_and_tgzs_to_use, create_offline_copy=False
             )
+        if is_enough is False:
+            journal.finish()
+            msg = _("Insufficient disk space to resume changes: ")
+            self.inform_user(msg, shortages, isOK=False)
+            return
+        progress_reporter.step_end()
 
+        # STEP
+        if rpms_and_tgzs_to_use is None:
+            progress_reporter.step_start(_("Collecting files"))
+            (
+                is_every_pkg_collected,
+                expl,
+                rpms_and_tgzs_to_use,
+            ) = self._collect_packages(
+                packages_to_download, progress_reporter=progress_reporter
+            )
             if is_every_pkg_collected is False:
+                journal.finish()
                 msg = _("Failed to download requested packages: ")
                 self.inform_user(msg, expl, isOK=False)
                 return
-            else:
-                progress_reporter.step_end()
+            progress_reporter.step_end()
         else:
-            progress_reporter.step_skip(_("Nothing to download"))
+            progress_reporter.step_skip(_("All files were collected before"))
+        self._collected_before = {}
 
         # Uninstall/Install packages
         self._make_changes(
             virtual_packages,
-            rpms_and_tgzs_to_use=collected_files,
+            rpms_and_tgzs_to_use=rpms_and_tgzs_to_use,
             create_offline_copy=keep_packages,
             progress_reporter=progress_reporter,
+            packages_dir=packages_dir,
+            completed_steps=journal.completed_steps(records),
         )
 
     def install_from_local_copy(self, *args, **kwargs):
@@ -255,6 +552,8 @@ class MainLogic(object):
             msg = _("local_copy_dir argument is obligatory")
             self.inform_user(msg, "", isOK=False)
             return
+        # Optional, used when local_copy_dir holds several saved versions
+        local_copy_version = kwargs.get("local_copy_version", "")
 
         # We are good to go
         progress_reporter = UnifiedProgressReporter(
@@ -263,6 +562,7 @@ class MainLogic(object):
 
         # Block any other calls of this function and proceed
         self.global_flags.ready_to_apply_changes = False
+        self._prefetch_manager.stop()
 
         log.info(_("*** Beginning local copy install procedure ***"))
 
@@ -274,10 +574,22 @@ class MainLogic(object):
                 "LibreOffice-langs": [],
                 "Clipart": [],
             },
+            "manifest": [],
         }
 
         # STEP
         progress_reporter.step_start(_("Cleaning temporary directories"))
+        # Only extracted rpms are staged, they take about as much
+        # space as the saved files
+        self._select_staging_dir(
+            sum(
+                f.stat().st_size
+                for f in self._local_copy_view(
+                    local_copy_directory, local_copy_version
+                ).glob("**/*")
+                if f.is_file()
+            )
+        )
         is_wd_cleaned, msg_w = PCLOS.clean_dir(configuration.working_dir)
         if is_wd_cleaned is False:
             msg = _("Failed to (re)create working directory: ")
@@ -289,15 +601,7 @@ class MainLogic(object):
             self.inform_user(msg, msg_v, isOK=False)
             return
         else:
-            directories = [
-                configuration.working_dir,
-                configuration.verified_dir.joinpath("Java_rpms"),
-                configuration.verified_dir.joinpath("LibreOffice-core_tgzs"),
-                configuration.verified_dir.joinpath("LibreOffice-langs_tgzs"),
-                configuration.verified_dir.joinpath("Clipart_rpms"),
-            ]
-            for dir in directories:
-                PCLOS.create_dir(dir)
+            self._create_staging_dirs()
         progress_reporter.step_end()
 
         # Take current state of package tree and create packages list
@@ -318,7 +622,7 @@ class MainLogic(object):
             LibreOffice_core_local_copy,
             LibreOffice_langs_local_copy,
             Clipart_local_copy,
-        ) = self._verify_local_copy(local_copy_directory)
+        ) = self._verify_local_copy(local_copy_directory, local_copy_version)
         progress_reporter.step_end()
 
         # STEP
@@ -421,12 +725,47 @@ class MainLogic(object):
                 )
             )
             is_modification_needed = is_modification_needed or False
+
+        # Verify content of the files that are going to be used
+        # (possible only for directories with a manifest)
+        expected_hashes = {}
+        for local_copy in (
+            Java_local_copy,
+            LibreOffice_core_local_copy,
+            LibreOffice_langs_local_copy,
+            Clipart_local_copy,
+        ):
+            expected_hashes.update(local_copy.get("checksums", {}))
+        files_to_use = [
+            path
+            for paths in rpms_and_tgzs_to_use["files_to_install"].values()
+            for path in paths
+        ]
+        is_intact, expl = integrity.verify_files(
+            {p: expected_hashes[p] for p in files_to_use if p in expected_hashes},
+            progress_reporter,
+        )
+        if is_intact is False:
+            msg = _("Saved packages are damaged: ")
+            self.inform_user(msg, expl, isOK=False)
+            return
+
+        is_enough, shortages = self._plan_disk_space(
+            [], rpms_and_tgzs_to_use, create_offline_copy=False
+        )
+        if is_enough is False:
+            msg = _("Insufficient disk space to install saved packages: ")
+            self.inform_user(msg, shortages, isOK=False)
+            return
         progress_reporter.step_end()
 
         if is_modification_needed is True:
             # Go ahead and make changes
             # (files provided by the user SHOULD NOT be removed
             #  - DO NOT overwrite them by creating an offline copy)
+            journal.begin(
+                "install_from_local_copy", self._package_marks(virtual_packages), False
+            )
             self._make_changes(
                 virtual_packages,
                 rpms_and_tgzs_to_use=rpms_and_tgzs_to_use,
@@ -437,6 +776,111 @@ class MainLogic(object):
             msg = _("Nothing to install. Check logs.")
             self.inform_user(msg, "", isOK=False)
 
+    def install_from_repository(self, *args, **kwargs):
+        """Installs packages of an apt repository exported by lomanager2
+
+        All packages of the repository are installed by a single
+        apt-get call. Any Office installed now is removed first
+        if the repository provides LibreOffice.
+        """
+        if self.global_flags.ready_to_apply_changes is False:
+            msg = _("Not ready to apply changes")
+            self.inform_user(msg, "", isOK=False)
+            return
+
+        if self.global_flags.block_local_copy_install is True:
+            msg = _("Local copy installation was blocked")
+            self.inform_user(msg, "", isOK=False)
+            return
+
+        if "repository_location" in kwargs.keys():
+            location = kwargs["repository_location"]
+        else:
+            msg = _("repository_location argument is obligatory")
+            self.inform_user(msg, "", isOK=False)
+            return
+
+        # We are good to go
+        progress_reporter = UnifiedProgressReporter(
+            total_steps=self.repository_procedure_step_count, callbacks=kwargs
+        )
+
+        # Block any other calls of this function and proceed
+        self.global_flags.ready_to_apply_changes = False
+        self._prefetch_manager.stop()
+
+        log.info(_("*** Installing packages from {} ***").format(location))
+
+        # STEP
+        progress_reporter.step_start(_("Reading list of packages in the repository"))
+        is_usable, msg = aptrepo.check_repository(location)
+        if not is_usable:
+            self.inform_user(_("Can't install from the repository: "), msg, isOK=False)
+            return
+        is_read, package_names = aptrepo.read_package_names(location)
+        if not is_read or not package_names:
+            msg = _("No packages to install found in {}").format(location)
+            self.inform_user(msg, "", isOK=False)
+            return
+        # (names of LibreOffice rpms start with eg. libreoffice7.6-)
+        is_office_provided = any(
+            name.removeprefix("libreoffice")[:1].isdigit() for name in package_names
+        )
+        progress_reporter.step_end()
+
+        # STEP
+        virtual_packages = []
+        self.package_tree_root.get_subtree(virtual_packages)
+        installed_office = [
+            p
+            for p in virtual_packages
+            if p.family in ["OpenOffice", "LibreOffice"] and p.is_installed
+        ]
+        if is_office_provided and installed_office:
+            if self.global_flags.block_removal is True:
+                msg = _("Removal of installed Office components was blocked")
+                self.inform_user(msg, "", isOK=False)
+                return
+            progress_reporter.step_start(_("Removing installed Office components"))
+            self._terminate_LO_quickstarter()
+            for package in installed_office:
+                package.is_marked_for_removal = True
+            self._keep_for_rollback(installed_office, progress_reporter)
+            is_removed, expl = self._uninstall_office_components(
+                installed_office, progress_reporter
+            )
+            if is_removed is False:
+                self._post_hooks.run(progress_reporter)
+                msg = _("Failed to remove Office components: ")
+                self.inform_user(msg, expl, isOK=False)
+                return
+            progress_reporter.step_end()
+        else:
+            progress_reporter.step_skip(_("No Office components need to be removed"))
+
+        # STEP
+        progress_reporter.step_start(_("Installing packages from {}").format(location))
+        is_installed, expl = aptrepo.install_from_repository(
+            location, package_names, progress_reporter
+        )
+        if is_installed is False:
+            self._post_hooks.run(progress_reporter)
+            msg = _("Failed to install packages from the repository: ")
+            self.inform_user(msg, expl, isOK=False)
+            return
+        progress_reporter.step_end()
+
+        # STEP
+        if is_office_provided:
+            progress_reporter.step_start(_("Adjusting installed Office"))
+            self._set_up_installed_office(progress_reporter)
+            progress_reporter.step_end()
+        else:
+            progress_reporter.step_skip(_("No Office components need to be adjusted"))
+        self._post_hooks.run(progress_reporter)
+        msg = _("All changes successful")
+        self.inform_user(msg, "", isOK=True)
+
     def check_system_state(self, *args, **kwargs):
         """Checks if installing/removing packages is allowed
 
@@ -636,8 +1080,53 @@ class MainLogic(object):
                 configuration.force_specific_LO_version
             )
             self.inform_user(msg, "", isOK=False)
+        if newest_LO_ver != recommended_LO_ver and prestage.is_ready_for(
+            recommended_LO_ver
+        ):
+            msg = _(
+                "LibreOffice {} has been downloaded in advance, "
+                "installing it will not require downloading."
+            ).format(recommended_LO_ver)
+            self.inform_user(msg, "", isOK=True)
+
+    def prestage_recommended_office(
+        self, progress_reporter: Callable, rate_limit: int = 0
+    ) -> tuple[bool, str]:
+        """Gets recommended LibreOffice ready to be installed later
+
+        Files of the recommended version (core and language packs of
+        languages currently installed) are downloaded, verified and
+        extracted into the cache, nothing is installed.
+        """
+        available_vps, _java, recommended_LO_ver, _clip = self._get_available_software()
+        installed_langs = set()
+        for family, version, langs in PCLOS.detect_installed_office_software():
+            installed_langs.update(langs)
+        office_vps = [
+            p
+            for p in available_vps
+            if p.family == "LibreOffice"
+            and (p.is_corepack() or p.kind in installed_langs)
+        ]
+        languages = [p.kind for p in office_vps if p.is_langpack()]
+        log.info(
+            _("Pre-staging LibreOffice {} (languages: {})").format(
+                recommended_LO_ver, ", ".join(languages) or "-"
+            )
+        )
+        return prestage.prestage(
+            version=recommended_LO_ver,
+            languages=languages,
+            files=[file for p in office_vps for file in p.real_files],
+            progress_reporter=progress_reporter,
+            rate_limit=rate_limit,
+        )
 
     def remove_temporary_dirs(self):
+        if journal.is_active():
+            # Collected files will be needed to resume changes
+            log.info(_("Temporary directory kept for interrupted changes"))
+            return True
         log.debug(_("Removing temporary directory"))
         if PCLOS.force_rm_directory(configuration.temporary_dir):
             log.info(_("Temporary directories successfully removed"))
@@ -649,9 +1138,322 @@ class MainLogic(object):
             self.inform_user(msg, "", isOK=False)
             return False
 
-    # -- end Public interface for MainLogic
+    # -- end Public interface for MainLogic
+
+    # -- Private methods of MainLogic
+    def _collect_changes(
+        self, step_count: int, kwargs: dict, use_journal: bool = True
+    ) -> tuple | None:
+        # Common part of apply_changes and prepare_changes: checks
+        # arguments and collects (verified) files of marked packages.
+        # Returns progress reporter, keep_packages, all virtual packages
+        # and collected files or None (the user is informed) on failure.
+        # Progress is journaled (use_journal) so that it can be resumed.
+        if self.global_flags.ready_to_apply_changes is False:
+            msg = _("Not ready to apply changes")
+            self.inform_user(msg, "", isOK=False)
+            return None
+
+        if "keep_packages" in kwargs.keys():
+            keep_packages = kwargs["keep_packages"]
+        else:
+            msg = _("keep_packages argument is obligatory")
+            self.inform_user(msg, "", isOK=False)
+            return None
+
+        if "force_java_download" in kwargs.keys():
+            force_java_download = kwargs["force_java_download"]
+        else:
+            msg = _("force_java_download argument is obligatory")
+            self.inform_user(msg, "", isOK=False)
+            return None
+
+        # We are good to go
+        progress_reporter = UnifiedProgressReporter(
+            total_steps=step_count, callbacks=kwargs
+        )
+
+        # Mark Java for download if the user requested that
+        java_package = [
+            c for c in self.package_tree_root.children if "Java" in c.family
+        ][0]
+        if force_java_download is True:
+            java_package.is_marked_for_download = True
+            # TODO: If force_java_download is set by the user it most likely
+            #       means Java is already installed and only
+            #       download is wanted. In that case java package definition
+            #       from _get_available_software will not be used
+            #       and real_files list will be empty. This causes crash
+            #       in download in _collect_packages.
+            #       Adding missing information here fixes the problem
+            #       but this is hacky.
+            java_package.real_files = [
+                {
+                    "name": "task-java-2019-1pclos2019.noarch.rpm",
+                    "base_url": configuration.PCLOS_repo_base_url
+                    + configuration.PCLOS_repo_path,
+                    "estimated_download_size": 1592,  # size in bytes
+                    "checksum": "",
+                },
+                {
+                    "name": "java-sun-16-2pclos2021.x86_64.rpm",
+                    "base_url": configuration.PCLOS_repo_base_url
+                    + configuration.PCLOS_repo_path,
+                    "estimated_download_size": 119920500,  # size in bytes
+                    "checksum": "",
+                },
+            ]
+
+        # Block any other calls of this function and proceed
+        self.global_flags.ready_to_apply_changes = False
+        # Files fetched in advance are already in the download cache,
+        # the rest is collected below
+        self._prefetch_manager.stop()
+        # Starting anew, changes interrupted earlier won't be resumed
+        journal.finish()
+
+        log.info(_("*** Applying selected changes ***"))
+
+        virtual_packages = []
+        self.package_tree_root.get_subtree(virtual_packages)
+        virtual_packages.remove(self.package_tree_root)
+
+        collected_files = {
+            "files_to_install": {
+                "Java": [],
+                "LibreOffice-core": [],
+                "LibreOffice-langs": [],
+                "Clipart": [],
+            },
+            "manifest": [],
+        }
+
+        packages_to_download = [p for p in virtual_packages if p.is_marked_for_download]
+
+        # STEP
+        progress_reporter.step_start(_("Cleaning temporary directories"))
+        # Downloaded archives and the rpms extracted from them
+        # take roughly twice the download size
+        self._select_staging_dir(
+            2
+            * sum(
+                self._expected_size(file)
+                for p in packages_to_download
+                for file in p.real_files
+            )
+        )
+        is_cleaned_w, msg_w = PCLOS.clean_dir(configuration.working_dir)
+        if is_cleaned_w is False:
+            msg = _("Failed to (re)create working directory: ")
+            self.inform_user(msg, msg_w, isOK=False)
+            return None
+        is_cleaned_v, msg_v = PCLOS.clean_dir(configuration.verified_dir)
+        if is_cleaned_v is False:
+            msg = _("Failed to (re)create verified directory: ")
+            self.inform_user(msg, msg_v, isOK=False)
+            return None
+        else:
+            self._create_staging_dirs()
+        progress_reporter.step_end()
+
+        if packages_to_download:
+            # Some packages need to be downloaded
+            # STEP
+            progress_reporter.step_start(_("Checking free disk space"))
+            self._resolve_download_sizes(packages_to_download)
+            is_enough, shortages = self._plan_disk_space(
+                packages_to_download,
+                collected_files,
+                create_offline_copy=keep_packages,
+            )
+            if is_enough is False:
+                msg = _(
+                    "Insufficient disk space to download and install "
+                    "selected packages: "
+                )
+                self.inform_user(msg, shortages, isOK=False)
+                return None
+            progress_reporter.step_end()
+
+            # STEP
+            progress_reporter.step_start(_("Collecting files"))
+            if use_journal:
+                journal.begin(
+                    "apply_changes",
+                    self._package_marks(virtual_packages),
+                    keep_packages,
+                )
+            is_every_pkg_collected, expl, collected_files = self._collect_packages(
+                packages_to_download,
+                progress_reporter=progress_reporter,
+            )
+
+            if is_every_pkg_collected is False:
+                # (nothing was changed, there is nothing to resume)
+                journal.finish()
+                msg = _("Failed to download requested packages: ")
+                self.inform_user(msg, expl, isOK=False)
+                return None
+            else:
+                progress_reporter.step_end()
+        else:
+            progress_reporter.step_skip(_("Nothing to download"))
+            if use_journal:
+                journal.begin(
+                    "apply_changes",
+                    self._package_marks(virtual_packages),
+                    keep_packages,
+                )
+
+        return (progress_reporter, keep_packages, virtual_packages, collected_files)
+
+    def _test_install_prepared(
+        self,
+        files_to_install: dict,
+        virtual_packages: list[VirtualPackage],
+        progress_reporter: Callable,
+    ) -> tuple[bool, str]:
+        # Extracts LibreOffice rpms (they are reused by the install)
+        # and runs rpm dry-run install of them and of Clipart rpms
+        rpms = []
+        for label in ["LibreOffice-core", "LibreOffice-langs"]:
+            for rel_path in files_to_install[label]:
+                tgz = preparedplan.absolute_path(rel_path)
+                progress_reporter.progress_msg(_("Extracting {}").format(tgz.name))
+                if (extracted := prestage.find_extracted(tgz)) is None:
+                    is_extracted, msg = prestage.pre_extract(tgz)
+                    if is_extracted is False:
+                        return (False, msg)
+                    extracted = prestage.find_extracted(tgz)
+                rpms += [r for r in extracted if "-kde-integration-" not in r.name]
+        for rel_path in files_to_install["Clipart"]:
+            rpms.append(preparedplan.absolute_path(rel_path))
+        if not rpms:
+            return (True, "")
+        # Office being replaced still owns files the new one will have
+        is_office_removed = any(
+            p.is_marked_for_removal and p.family in ["OpenOffice", "LibreOffice"]
+            for p in virtual_packages
+        )
+        progress_reporter.progress_msg(_("Checking if packages can be installed..."))
+        return PCLOS.dry_run_rpm_install(rpms, ignore_file_conflicts=is_office_removed)
+
+    def _is_blocked(self, is_installing: bool, is_removing: bool) -> bool:
+        # The same restrictions that apply to marking packages for
+        # install/removal (see _set_packages_initial_state),
+        # the user is informed if changes are blocked
+        if is_installing and self.global_flags.block_normal_install:
+            msg = _("Installation of packages was blocked")
+        elif is_removing and self.global_flags.block_removal:
+            msg = _("Removal of packages was blocked")
+        else:
+            return False
+        self.inform_user(msg, "", isOK=False)
+        return True
+
+    def _restore_marks(
+        self,
+        marks: list[dict],
+        virtual_packages: list[VirtualPackage],
+        is_resuming: bool = False,
+    ) -> tuple[bool, str]:
+        # Marks packages the way they were marked when changes were prepared
+        # (or interrupted - packages may have been removed already then)
+        for package in virtual_packages:
+            package.is_marked_for_install = False
+            package.is_marked_for_removal = False
+            package.is_marked_for_download = False
+        for mark in marks:
+            matching = [
+                p
+                for p in virtual_packages
+                if (p.family, p.kind, p.version)
+                == (mark["family"], mark["kind"], mark["version"])
+            ]
+            if not matching and is_resuming:
+                log.debug(_("Mark of missing package ignored: {}").format(mark))
+                continue
+            if not matching:
+                return (
+                    False,
+                    _("Package {} {} {} is not available").format(
+                        mark["family"], mark["version"], mark["kind"]
+                    ),
+                )
+            matching[0].is_marked_for_install = mark["install"]
+            matching[0].is_marked_for_removal = mark["remove"]
+            matching[0].is_marked_for_download = mark["download"]
+        return (True, "")
+
+    def _keep_for_rollback(
+        self, office_packages_to_remove: list, progress_reporter: Callable
+    ):
+        # Packages of LibreOffice being removed are kept so that it can
+        # be reinstalled if installing the new version fails
+        for core in office_packages_to_remove:
+            if core.family != "LibreOffice" or not core.is_corepack():
+                continue
+            languages = [
+                p.kind
+                for p in core.children
+                if p.is_installed and p.is_marked_for_removal
+            ]
+            is_kept, msg = rollback.save(core.version, languages, progress_reporter)
+            if not is_kept:
+                log.warning(
+                    _("LibreOffice {} can't be kept for rollback: {}").format(
+                        core.version, msg
+                    )
+                )
+
+    def _package_marks(self, virtual_packages: list[VirtualPackage]) -> list[dict]:
+        return [
+            {
+                "family": p.family,
+                "kind": p.kind,
+                "version": p.version,
+                "install": p.is_marked_for_install,
+                "remove": p.is_marked_for_removal,
+                "download": p.is_marked_for_download,
+            }
+            for p in virtual_packages
+            if p.is_marked_for_install
+            or p.is_marked_for_removal
+            or p.is_marked_for_download
+        ]
+
+    def _create_staging_dirs(self):
+        directories = [
+            configuration.working_dir,
+            configuration.verified_dir.joinpath("Java_rpms"),
+            configuration.verified_dir.joinpath("LibreOffice-core_tgzs"),
+            configuration.verified_dir.joinpath("LibreOffice-langs_tgzs"),
+            configuration.verified_dir.joinpath("Clipart_rpms"),
+        ]
+        for dir in directories:
+            PCLOS.create_dir(dir)
+
+    def _is_collected_before(self, file_path: pathlib.Path) -> bool:
+        # File was collected by an interrupted run and is still intact
+        digest = self._collected_before.get(file_path)
+        if digest is None or not file_path.is_file():
+            return False
+        is_intact, msg = integrity.verify_files({file_path: digest})
+        return is_intact
+
+    def _update_prefetch(self):
+        # Start fetching files of packages marked for install
+        # while the user is still making the selection
+        packages = []
+        self.package_tree_root.get_subtree(packages)
+        files = [
+            file
+            for package in packages
+            if package.is_marked_for_download
+            for file in package.real_files
+        ]
+        self._prefetch_manager.update(files)
 
-    # -- Private methods of MainLogic
     def _build_dependency_tree(self, packageS: list[VirtualPackage]):
         # Make master node forget its children
         # (this will should delete all descendent virtual package objects)
@@ -1051,156 +1853,307 @@ class MainLogic(object):
         rpms_and_tgzs_to_use,
         create_offline_copy,
         progress_reporter,
+        packages_dir: pathlib.Path | None = None,
+        completed_steps: set = frozenset(),
     ):
         # At this point normal changes procedure and local copy install
         # procedure converge and thus use the same function
-
-        # STEP
-        progress_reporter.step_start(_("Trying to stop LibreOffice quickstarter"))
-        self._terminate_LO_quickstarter()
-        progress_reporter.step_end()
-
-        # STEP
-        # Java needs to be installed?
+        # (packages_dir - where collected files are, verified_dir if None,
+        #  completed_steps - steps done by an interrupted run, see journal)
+        if packages_dir is None:
+            packages_dir = configuration.verified_dir
+        if journal.is_active():
+            # Files are verified against these if changes are resumed
+            try:
+                file_hashes = integrity.hash_files(
+                    [
+                        path
+                        for paths in rpms_and_tgzs_to_use["files_to_install"].values()
+                        for path in paths
+                    ]
+                )
+            except OSError as error:
+                log.warning(_("Could not record checksums: {}").format(error))
+                file_hashes = {}
+            journal.append(
+                {
+                    "op": "changes",
+                    "files_to_install": {
+                        label: [str(path) for path in paths]
+                        for label, paths in rpms_and_tgzs_to_use[
+                            "files_to_install"
+                        ].items()
+                    },
+                    "file_hashes": {
+                        str(path): digest for path, digest in file_hashes.items()
+                    },
+                    "manifest": rpms_and_tgzs_to_use["manifest"],
+                    "packages_dir": str(packages_dir),
+                    "create_offline_copy": create_offline_copy,
+                }
+            )
+        already_done = _("Done before the interruption")
+
+        # Operations are run by the scheduler: the ones not depending on
+        # each other and not sharing a resource run at the same time,
+        # eg. users' Office settings are modified while Clipart is installed.
+        # Steps of the same kind are done by a single package transaction
+        # where ordering allows (see txplanner), eg. Clipart rpm is installed
+        # by the same 'rpm -Uvh' as Office rpms. Merged steps are reported
+        # as done together with the step they joined.
+        files_to_install = rpms_and_tgzs_to_use["files_to_install"]
         # (Note that Java may have been downloaded as a result of
         #  force_java_download but not actually marked for install)
         java_package = [
             c for c in self.package_tree_root.children if "Java" in c.family
         ][0]
-        if (
-            java_package.is_marked_for_install
-            and rpms_and_tgzs_to_use["files_to_install"]["Java"]
-        ):
-            progress_reporter.step_start(_("Installing Java"))
-
-            is_installed, expl = self._install_Java(
-                rpms_and_tgzs_to_use["files_to_install"]["Java"],
-                progress_reporter,
-            )
-            if is_installed is False:
-                msg = _("Java installation failed: ")
-                self.inform_user(msg, expl, isOK=False)
-                return
-            progress_reporter.step_end()
-        else:
-            progress_reporter.step_skip(_("Java needs not to be installed"))
-
-        # At this point everything that is needed is downloaded and verified,
-        # also Java is installed (except in unlikely case in which the user
-        # only installs Clipart).
-        # We can remove old Office components (if there are any to remove)
-        # in preparation for the install step.
-
-        # STEP
-        # Any Office components need to be removed?
         office_packages_to_remove = [
             p
             for p in virtual_packages
             if p.is_marked_for_removal
             and (p.family == "OpenOffice" or p.family == "LibreOffice")
         ]
-        if office_packages_to_remove:
-            progress_reporter.step_start(_("Removing selected Office components"))
+        clipart_packages_to_remove = [
+            p
+            for p in virtual_packages
+            if p.family == "Clipart" and p.is_marked_for_removal
+        ]
+        needed_steps = {
+            "java_install": java_package.is_marked_for_install
+            and files_to_install["Java"],
+            "office_removal": office_packages_to_remove,
+            "users_cleanup": office_packages_to_remove,
+            "office_install": files_to_install["LibreOffice-core"]
+            or files_to_install["LibreOffice-langs"],
+            "clipart_removal": clipart_packages_to_remove,
+            "clipart_install": files_to_install["Clipart"],
+        }
+        transactions = txplanner.plan(
+            [
+                step
+                for step, is_needed in needed_steps.items()
+                if is_needed and step not in completed_steps
+            ]
+        )
+        merged_steps = {transaction[0]: transaction[1:] for transaction in transactions}
+        merged_with = {
+            step: transaction[0]
+            for transaction in transactions
+            for step in transaction[1:]
+        }
 
-            is_removed, expl = self._uninstall_office_components(
+        users_leftovers = []
+
+        def remove_office() -> tuple[bool, str]:
+            extra_rpms_to_rm = []
+            if "clipart_removal" in merged_steps["office_removal"]:
+                is_listed, extra_rpms_to_rm = self._installed_clipart_rpm_names()
+                if is_listed is False:
+                    return (False, _("Failed to run shell command"))
+            self._keep_for_rollback(office_packages_to_remove, progress_reporter)
+            return self._uninstall_office_components(
                 office_packages_to_remove,
                 progress_reporter,
+                extra_rpms_to_rm=extra_rpms_to_rm,
+                users_leftovers=users_leftovers,
             )
 
-            if is_removed is False:
-                msg = _("Failed to remove Office components: ")
-                self.inform_user(msg, expl, isOK=False)
-                return
-            progress_reporter.step_end()
-        else:
-            progress_reporter.step_skip(_("No Office components need to be removed"))
-
-        # STEP
-        # Any Office components need to be installed?
-        if (
-            rpms_and_tgzs_to_use["files_to_install"]["LibreOffice-core"]
-            or rpms_and_tgzs_to_use["files_to_install"]["LibreOffice-langs"]
-        ):
-            progress_reporter.step_start(_("Installing selected Office components"))
-
-            is_installed, expl = self._install_office_components(
-                rpms_and_tgzs_to_use["files_to_install"]["LibreOffice-core"],
-                rpms_and_tgzs_to_use["files_to_install"]["LibreOffice-langs"],
+        def remove_users_leftovers() -> tuple[bool, str]:
+            # Failing to remove a leftover is not a reason to stop
+            results = cleanup.remove_paths(users_leftovers)
+            failed = [str(path) for path, is_removed, _msg in results if not is_removed]
+            if failed:
+                msg = _("Some leftover files could not be removed: ")
+                self.inform_user(msg, "\n".join(failed), isOK=False)
+            return (True, "")
+
+        def install_office() -> tuple[bool, str]:
+            prebuilt_rpms = []
+            if "clipart_install" in merged_steps["office_install"]:
+                prebuilt_rpms = files_to_install["Clipart"]
+            return self._install_office_components(
+                files_to_install["LibreOffice-core"],
+                files_to_install["LibreOffice-langs"],
                 progress_reporter,
+                prebuilt_rpms=prebuilt_rpms,
+                post_install=False,
             )
-            if is_installed is False:
-                msg = _("Failed to install Office components: ")
-                self.inform_user(msg, expl, isOK=False)
-                return
 
-            progress_reporter.step_end()
-        else:
-            progress_reporter.step_skip(_("No Office components need to be installed"))
+        def stop_quickstarter() -> tuple[bool, str]:
+            self._terminate_LO_quickstarter()
+            return (True, "")
 
-        # STEP
-        # Clipart library is to be removed?
-        clipart_packages_to_remove = [
-            p
-            for p in virtual_packages
-            if p.family == "Clipart" and p.is_marked_for_removal
-        ]
-        if clipart_packages_to_remove:
-            progress_reporter.step_start(_("Removing Clipart library"))
+        def setup_office() -> tuple[bool, str]:
+            self._set_up_installed_office(progress_reporter)
+            return (True, "")
 
-            is_removed, expl = self._uninstall_clipart(
-                clipart_packages_to_remove,
+        saved_dir = None
+
+        def save_packages() -> tuple[bool, str]:
+            nonlocal saved_dir
+            # Files are added to the saved packages repository where
+            # packages of earlier saved versions are kept too
+            is_saved, expl, saved_dir = offlinerepo.add_version(
+                configuration.offline_copy_dir,
+                packages_dir,
+                rpms_and_tgzs_to_use["manifest"],
                 progress_reporter,
             )
+            return (is_saved, expl)
+
+        def operation(name, description, run, skip_msg, **kwargs):
+            # Operation that is skipped if it's not needed
+            # or was done before the interruption
+            if name in completed_steps:
+                run, skip_msg = (None, already_done)
+            elif name in merged_with:
+                run = None
+                kwargs["after"] = kwargs.get("after", []) + [merged_with[name]]
+            elif not needed_steps.get(name, True):
+                run = None
+            return scheduler.Operation(
+                name, description, run, skip_msg=skip_msg, **kwargs
+            )
 
-            if is_removed is False:
-                msg = _("Failed to remove Clipart library: ")
-                self.inform_user(msg, expl, isOK=False)
-                return
-            progress_reporter.step_end()
-        else:
-            progress_reporter.step_skip(_("Clipart needs not to be removed"))
+        def preceding(name: str) -> list[str]:
+            # Package transactions keep the order in which they were
+            # always done (Java first), see also txplanner.ordering
+            return list(
+                {"java_install"} | {a for a, b in txplanner.ordering if b == name}
+            )
 
-        # STEP
-        # Clipart library is to be installed?
-        if rpms_and_tgzs_to_use["files_to_install"]["Clipart"]:
-            progress_reporter.step_start("Installing Clipart library")
+        package_steps = list(txplanner.step_kinds)
+        operations = [
+            scheduler.Operation(
+                "quickstarter",
+                _("Trying to stop LibreOffice quickstarter"),
+                stop_quickstarter,
+            ),
+            operation(
+                "java_install",
+                _("Installing Java"),
+                lambda: self._install_Java(files_to_install["Java"], progress_reporter),
+                _("Java needs not to be installed"),
+                resources=[scheduler.RPMDB, scheduler.DISK],
+            ),
+            # Old Office components are removed only when everything else
+            # that could fail before (eg. Java install) is done
+            operation(
+                "office_removal",
+                _("Removing selected Office components"),
+                remove_office,
+                _("No Office components need to be removed"),
+                after=["quickstarter", "java_install"],
+                resources=[scheduler.RPMDB, scheduler.HOME],
+            ),
+            # Leftovers in home directories go away while new Office
+            # is being installed, before its settings are adjusted
+            operation(
+                "users_cleanup",
+                _("Removing leftovers of removed Office"),
+                remove_users_leftovers,
+                _("No leftovers to remove"),
+                after=["office_removal"],
+                resources=[scheduler.HOME],
+            ),
+            operation(
+                "office_install",
+                _("Installing selected Office components"),
+                install_office,
+                _("No Office components need to be installed"),
+                after=["quickstarter"] + preceding("office_install"),
+                resources=[scheduler.RPMDB],
+            ),
+            operation(
+                "office_setup",
+                _("Adjusting installed Office"),
+                setup_office if needed_steps["office_install"] else None,
+                _("No Office components need to be adjusted"),
+                after=["office_install", "users_cleanup"],
+                resources=[scheduler.HOME],
+            ),
+            operation(
+                "clipart_removal",
+                _("Removing Clipart library"),
+                lambda: self._uninstall_clipart(
+                    clipart_packages_to_remove, progress_reporter
+                ),
+                _("Removed together with Office components")
+                if "clipart_removal" in merged_with
+                else _("Clipart needs not to be removed"),
+                after=preceding("clipart_removal"),
+                resources=[scheduler.RPMDB],
+            ),
+            operation(
+                "clipart_install",
+                _("Installing Clipart library"),
+                lambda: self._install_clipart(
+                    files_to_install["Clipart"], progress_reporter
+                ),
+                _("Installed together with Office components")
+                if "clipart_install" in merged_with
+                else _("Clipart needs not to be installed"),
+                after=preceding("clipart_install"),
+                resources=[scheduler.RPMDB],
+            ),
+            # Saving moves files installs use, all of them have to be done
+            scheduler.Operation(
+                "save_packages",
+                _("Saving packages"),
+                save_packages if create_offline_copy else None,
+                after=package_steps,
+                resources=[scheduler.DISK],
+                skip_msg=_("Packages were not saved for later use"),
+            ),
+        ]
 
-            is_installed, expl = self._install_clipart(
-                rpms_and_tgzs_to_use["files_to_install"]["Clipart"],
-                progress_reporter,
-            )
-            if is_installed is False:
-                msg = _("Openclipart installation failed: ")
-                self.inform_user(msg, expl, isOK=False)
-                return
-            progress_reporter.step_end()
-        else:
-            progress_reporter.step_skip(_("Clipart needs not to be installed"))
+        def operation_done(name: str):
+            for done_step in [name] + merged_steps.get(name, []):
+                journal.step_done(done_step)
 
-        # STEP
-        # Should downloaded packages be kept ?
-        if create_offline_copy is True:
-            progress_reporter.step_start(_("Saving packages"))
+        is_done, failed_step, expl = scheduler.run_operations(
+            operations, progress_reporter, on_done=operation_done
+        )
+        # Menus etc. reflect whatever was changed, even if not everything
+        self._post_hooks.run(progress_reporter)
+        if is_done is False:
+            # The failure is reported, changes were not interrupted
+            # and are not offered to be resumed
+            journal.finish()
+            failure_msgs = {
+                "java_install": _("Java installation failed: "),
+                "office_removal": _("Failed to remove Office components: "),
+                "office_install": _("Failed to install Office components: "),
+                "office_setup": _("Failed to adjust installed Office: "),
+                "clipart_removal": _("Failed to remove Clipart library: "),
+                "clipart_install": _("Openclipart installation failed: "),
+                "save_packages": _("Failed to save packages: "),
+            }
+            msg = failure_msgs.get(failed_step, _("Failed to make changes: "))
+            if "clipart_removal" in merged_steps.get(failed_step, []):
+                msg = _("Failed to remove Office components and Clipart library: ")
+            if "clipart_install" in merged_steps.get(failed_step, []):
+                msg = _("Failed to install Office components and Clipart library: ")
+            if failed_step == "office_install":
+                if (saved := rollback.latest()) is not None:
+                    expl += _(
+                        "\nLibreOffice {} can be restored with "
+                        "Tools > Restore previous LibreOffice"
+                    ).format(saved["version"])
+            self.inform_user(msg, expl, isOK=False)
+            return
 
-            is_saved, expl = PCLOS.move_dir(
-                configuration.verified_dir, configuration.offline_copy_dir
-            )
-            if is_saved is False:
-                msg = _("Failed to save packages: ")
-                self.inform_user(msg, expl, isOK=False)
-                return
-            else:
-                msg = _(
-                    "All changes successful\nPackages saved to {}.\n"
-                    "This directory is getting wiped out on reboot, "
-                    "please move it to some other location."
-                ).format(configuration.offline_copy_dir)
-                self.inform_user(msg, expl, isOK=True)
-            progress_reporter.step_end()
+        if saved_dir is not None:
+            msg = _(
+                "All changes successful\nPackages saved to {}.\n"
+                "This directory is getting wiped out on reboot, "
+                "please move it to some other location."
+            ).format(saved_dir)
+            self.inform_user(msg, "", isOK=True)
         else:
             msg = _("All changes successful")
             self.inform_user(msg, "", isOK=True)
-            progress_reporter.step_skip(_("Packages were not saved for later use"))
+        journal.finish()
 
     def _collect_packages(
         self,
@@ -1245,6 +2198,7 @@ class MainLogic(object):
                 "LibreOffice-langs": [],
                 "Clipart": [],
             },
+            "manifest": [],
         }
 
         nice_list = " | ".join(
@@ -1264,69 +2218,126 @@ class MainLogic(object):
                 if not is_available:
                     return (False, msg, rpms_and_tgzs_to_use)
 
+        # Progress (and time left) is reported for all files together
+        batch_progress = net.DownloadBatchProgress(
+            total_bytes=sum(
+                self._expected_size(file)
+                for package in packages_to_download
+                for file in package.real_files
+            ),
+            progress_reporter=progress_reporter,
+        )
+
         for package in packages_to_download:
             for file in package.real_files:
                 f_url = file["base_url"] + file["name"]
                 f_dest = configuration.working_dir.joinpath(file["name"])
-
-                is_downloaded, error_msg = net.download_file(
-                    f_url,
-                    f_dest,
-                    progress_reporter,
-                )
-                if not is_downloaded:
-                    msg = _("Error while trying to download {}: ").format(f_url)
-                    msg = msg + error_msg
-                    return (False, msg, rpms_and_tgzs_to_use)
-
-                if file["checksum"] and not skip_verify:
-                    checksum_file = file["name"] + "." + file["checksum"]
-                    csf_url = file["base_url"] + checksum_file
-                    csf_dest = configuration.working_dir.joinpath(checksum_file)
-
-                    is_downloaded, error_msg = net.download_file(
-                        csf_url,
-                        csf_dest,
-                        progress_reporter,
-                    )
-                    if not is_downloaded:
-                        msg = _("Error while trying to download {}: ").format(csf_url)
-                        msg = msg + error_msg
-                        return (False, msg, rpms_and_tgzs_to_use)
-
-                    is_correct = net.verify_checksum(
-                        f_dest, csf_dest, progress_reporter
-                    )
-                    if not is_correct:
-                        msg = _("Verification of the {} failed").format(file["name"])
-                        return (False, msg, rpms_and_tgzs_to_use)
-
-                    if not PCLOS.remove_file(csf_dest):
-                        msg = _("Error removing file {}").format(csf_dest)
-                        return (False, msg, rpms_and_tgzs_to_use)
-
-                # Move file to verified files directory
+                label = self._storage_label(package)
                 if package.family == "LibreOffice":
-                    if package.is_langpack():
-                        ending = "-langs"
-                    else:
-                        ending = "-core"
-                    label = package.family + ending
                     dir_name = label + "_tgzs"
                 else:
-                    label = package.family
                     dir_name = label + "_rpms"
                 f_verified = configuration.verified_dir.joinpath(dir_name)
                 f_verified = f_verified.joinpath(file["name"])
-                if not PCLOS.move_file(from_path=f_dest, to_path=f_verified):
-                    msg = _("Error moving file {} to {}").format(f_dest, f_verified)
-                    return (False, msg, rpms_and_tgzs_to_use)
+
+                if self._is_collected_before(f_verified):
+                    # Collected and verified by the interrupted run
+                    batch_progress.file_done(f_verified.stat().st_size)
+                else:
+                    is_collected, msg = self._fetch_verified_file(
+                        file, f_dest, progress_reporter, batch_progress, skip_verify
+                    )
+                    if not is_collected:
+                        return (False, msg, rpms_and_tgzs_to_use)
+
+                    # Move file to verified files directory
+                    if not PCLOS.move_file(f_dest, f_verified, progress_reporter):
+                        msg = _("Error moving file {} to {}").format(f_dest, f_verified)
+                        return (False, msg, rpms_and_tgzs_to_use)
                 # Add absolute file path to verified files list
                 rpms_and_tgzs_to_use["files_to_install"][label].append(f_verified)
+                # and describe it in case the packages are going to be saved
+                manifest_entry = offlinecopy.manifest_entry(
+                    component=label,
+                    version=package.version,
+                    language=package.kind if package.is_langpack() else "",
+                    rel_path=f_verified.relative_to(configuration.verified_dir),
+                    size=f_verified.stat().st_size,
+                    url=f_url,
+                )
+                rpms_and_tgzs_to_use["manifest"].append(manifest_entry)
+                if journal.is_active():
+                    journal.append(
+                        {
+                            "op": "file",
+                            "path": str(f_verified),
+                            "sha256": integrity.hash_files([f_verified])[f_verified],
+                        }
+                    )
 
         log.debug(_("rpms_and_tgzs_to_use: {}").format(rpms_and_tgzs_to_use))
         return (True, "", rpms_and_tgzs_to_use)
 
+    def _fetch_verified_file(
+        self,
+        file: dict,
+        f_dest: pathlib.Path,
+        progress_reporter: Callable,
+        batch_progress: net.DownloadBatchProgress,
+        skip_verify: bool,
+    ) -> tuple[bool, str]:
+        """Gets a file from the cheapest source that has it and verifies it
+
+        Files already present on this machine (apt cache, saved packages,
+        download cache) or on peers (configuration.cache_peers) are always
+        verified, if none of them is usable the file is downloaded.
+        """
+        return resolver.resolve_file(
+            file,
+            f_dest,
+            progress_reporter,
+            batch_progress,
+            verify=self._verify_downloaded_file,
+            skip_verify=skip_verify,
+        )
+
+    def _verify_downloaded_file(
+        self,
+        file: dict,
+        f_dest: pathlib.Path,
+        progress_reporter: Callable,
+        from_upstream: bool = True,
+    ) -> tuple[bool, str]:
+        if file["checksum"]:
+            # Checksum file always comes from upstream server
+            checksum_file = file["name"] + "." + file["checksum"]
+            csf_url = file["base_url"] + checksum_file
+            csf_dest = configuration.working_dir.joinpath(checksum_file)
+
+            is_downloaded, error_msg = net.download_file(
+                csf_url,
+                csf_dest,
+                progress_reporter,
+            )
+            if not is_downloaded:
+                msg = _("Error while trying to download {}: ").format(csf_url)
+                return (False, msg + error_msg)
+
+            is_correct = net.verify_checksum(f_dest, csf_dest, progress_reporter)
+            if not PCLOS.remove_file(csf_dest):
+                return (False, _("Error removing file {}").format(csf_dest))
+            if not is_correct:
+                return (False, _("Verification of the {} failed").format(file["name"]))
+        elif not from_upstream:
+            # No checksum published, size reported by upstream server
+            # and digest stored in rpm itself have to do
+            if not (
+                file["name"].endswith(".rpm")
+                and rpmheader.verify_payload(f_dest, file.get("download_size", 0))
+            ):
+                return (False, _("Verification of the {} failed").format(file["name"]))
+        return (True, "")
+
     def _terminate_LO_quickstarter(self):
         LO_PIDs = PCLOS.get_PIDs_by_name(["libreoffice"]).get("libreoffice")
         OO_PIDs = PCLOS.get_PIDs_by_name(["OpenOffice"]).get("OpenOffice")
@@ -1368,16 +2379,21 @@ class MainLogic(object):
     ) -> tuple[bool, str]:
         # 1) Move files (task-java and java-sun) from
         #    verified copy directory to /var/cache/apt/archives
-        cache_dir = pathlib.Path("/var/cache/apt/archives/")
+        #    (staging directory is chosen on the same filesystem as the
+        #    apt cache whenever possible so that this is only a rename)
+        cache_dir = configuration.apt_cache_dir
         package_names = []
         for file in java_rpms:
+            # rpm name != rpm filename, take the name from rpm header
+            if (header := rpmheader.read_rpm_header(file)) is None:
+                return (False, _("Java not installed, unreadable rpm file"))
+            package_names.append(header.name)
             if not PCLOS.move_file(
-                from_path=file, to_path=cache_dir.joinpath(file.name)
+                from_path=file,
+                to_path=cache_dir.joinpath(file.name),
+                progress_reporter=progress_reporter,
             ):
                 return (False, _("Java not installed, error moving file"))
-            # rpm name != rpm filename
-            rpm_name = "-".join(file.name.split("-")[:2])
-            package_names.append(rpm_name)
 
         # 2) Use apt-get to install those 2 files
         is_installed, msg = PCLOS.install_using_apt_get(
@@ -1390,7 +2406,9 @@ class MainLogic(object):
         # 3) move rpm files back to storage
         for file in java_rpms:
             if not PCLOS.move_file(
-                from_path=cache_dir.joinpath(file.name), to_path=file
+                from_path=cache_dir.joinpath(file.name),
+                to_path=file,
+                progress_reporter=progress_reporter,
             ):
                 return (False, _("Java installed but there was error moving file"))
 
@@ -1400,9 +2418,15 @@ class MainLogic(object):
         self,
         packages_to_remove: list,
         progress_reporter: Callable,
+        extra_rpms_to_rm: list | None = None,
+        users_leftovers: list | None = None,
     ) -> tuple[bool, str]:
         # rpms_to_rm is always a minimal subset of rpms that once
         # marked for removal will cause all dependencies to be removed too.
+        # All of them (and extra_rpms_to_rm eg. Clipart) are removed
+        # by a single apt-get call, apt takes care of the ordering.
+        # Leftovers in users' home directories are added to users_leftovers
+        # (if given) to be removed later instead of being removed here.
 
         nice_list = " | ".join(
             [
@@ -1418,21 +2442,22 @@ class MainLogic(object):
         OpenOfficeS = [p for p in packages_to_remove if p.family == "OpenOffice"]
         dirs_to_rm = []
         files_to_remove = []
-        rpms_to_rm = []
+        home_leftovers = []
+        rpms_to_rm = list(extra_rpms_to_rm or [])
         for oo in OpenOfficeS:
             # OpenOffice removal procedures
             if oo.version.startswith("2."):  # any series 2.x
                 rpms_to_rm.extend(["openoffice.org", "openoffice.org-mimelnk"])
                 # Leftover files and directories to remove
                 for user in users:
-                    dirs_to_rm.append(user.home_dir.joinpath(".ooo-2.0"))
-                    dirs_to_rm.append(user.home_dir.joinpath(f".ooo-{oo.version}"))
+                    home_leftovers.append(user.home_dir.joinpath(".ooo-2.0"))
+                    home_leftovers.append(user.home_dir.joinpath(f".ooo-{oo.version}"))
             if oo.version == "3.0.0":  # ver. 3.0.0 only
                 rpms_to_rm.extend(["openoffice.org-core"])
                 # Leftover files and directories to remove
                 for user in users:
-                    dirs_to_rm.append(user.home_dir.joinpath(".ooo3"))
-                    dirs_to_rm.append(user.home_dir.joinpath(".config/ooo3"))
+                    home_leftovers.append(user.home_dir.joinpath(".ooo3"))
+                    home_leftovers.append(user.home_dir.joinpath(".config/ooo3"))
                 for leftover_dir in pathlib.Path("/opt").glob("openoffice*"):
                     dirs_to_rm.append(leftover_dir)
             if oo.version.startswith("3.") and oo.version != "3.0.0":  # any later
@@ -1440,12 +2465,12 @@ class MainLogic(object):
                 rpms_to_rm.append(f"openoffice.org{oo.version}-mandriva-menus")
                 # Leftover files and directories to remove
                 for user in users:
-                    dirs_to_rm.append(user.home_dir.joinpath(".ooo3"))
-                    dirs_to_rm.append(user.home_dir.joinpath(".config/ooo3"))
-                    files_to_remove.append(
+                    home_leftovers.append(user.home_dir.joinpath(".ooo3"))
+                    home_leftovers.append(user.home_dir.joinpath(".config/ooo3"))
+                    home_leftovers.append(
                         user.home_dir.joinpath("OpenOffice_Info.txt")
                     )
-                    files_to_remove.append(
+                    home_leftovers.append(
                         user.home_dir.joinpath("getopenoffice.desktop")
                     )
                 s_files = [
@@ -1456,27 +2481,12 @@ class MainLogic(object):
                 ]
                 files_to_remove.extend(s_files)
                 dirs_to_rm.extend(pathlib.Path("/opt").glob("openoffice*"))
-        if OpenOfficeS:
-            # Remove
-            log.debug(_("OO rpms_to_rm: {}").format(rpms_to_rm))
-            s, msg = PCLOS.uninstall_using_apt_get(rpms_to_rm, progress_reporter)
-            if not s:
-                return (False, msg)
-            # Do post-removal cleanup
-            log.debug(_("Dirs to remove: {}").format(dirs_to_rm))
-            map(PCLOS.force_rm_directory, dirs_to_rm)
-            log.debug(_("Files to remove: {}").format(files_to_remove))
-            map(PCLOS.remove_file, files_to_remove)
-            # update menus
-            PCLOS.update_menus()
 
         # Now let's deal with LibreOffice's language packs.
-        # User may want to remove just that (no core package uninstall)
-        # in which case we are going to be done.
-        # Alternatively core package is also marked for removal and will be
-        # uninstalled in the later step.
-        # Such ordering will not interfere with dependencies,
-        # as language packs are optional additions anyway.
+        # User may want to remove just that (no core package uninstall).
+        # Alternatively core package is also marked for removal and
+        # the language packs go away together with it
+        # (they are optional additions depending on the core).
 
         # Never remove en-US language pack on its own
         # (it is only installed/removed together with core package)
@@ -1485,9 +2495,6 @@ class MainLogic(object):
             for p in packages_to_remove
             if ((p.family == "LibreOffice") and p.is_langpack() and (p.kind != "en-US"))
         ]
-        dirs_to_rm = []
-        files_to_remove = []
-        rpms_to_rm = []
         for lang in LibreOfficeLANGS:
             # LibreOffice langs removal procedures.
             base_version = configuration.make_base_ver(lang.version)
@@ -1525,11 +2532,6 @@ class MainLogic(object):
                 else:
                     if reply:
                         rpms_to_rm.append(candidate[:-1])
-        if LibreOfficeLANGS:
-            log.debug(_("LO langs rpms_to_rm: {}").format(rpms_to_rm))
-            s, msg = PCLOS.uninstall_using_apt_get(rpms_to_rm, progress_reporter)
-            if not s:
-                return (False, msg)
 
         # Finally remove LibreOffice core if marked for removal
         LibreOfficeCORE = [
@@ -1537,9 +2539,6 @@ class MainLogic(object):
             for p in packages_to_remove
             if (p.family == "LibreOffice" and p.is_corepack())
         ]
-        dirs_to_rm = []
-        files_to_remove = []
-        rpms_to_rm = []
         for core in LibreOfficeCORE:
             # Removal procedures for LibreOffice core.
             if core.version.startswith("3.3"):  # 3.3 and its subvariants
@@ -1547,14 +2546,14 @@ class MainLogic(object):
                 rpms_to_rm.append(f"libreoffice{core.version}-mandriva-menus")
                 # Leftover files and directories to remove
                 for user in users:
-                    dirs_to_rm.append(user.home_dir.joinpath(".libreoffice"))
-                    dirs_to_rm.append(user.home_dir.joinpath(".config/libreoffice"))
-                    files_to_remove.append(
+                    home_leftovers.append(user.home_dir.joinpath(".libreoffice"))
+                    home_leftovers.append(user.home_dir.joinpath(".config/libreoffice"))
+                    home_leftovers.append(
                         user.home_dir.joinpath("Desktop/lomanager.desktop")
                     )
                     kdedir = user.home_dir.joinpath(".kde4/vdt/2/2a")
                     if kdedir.exists():
-                        files_to_remove.extend(kdedir.glob("LO*"))
+                        home_leftovers.extend(kdedir.glob("LO*"))
                 skel_fm_dir = pathlib.Path("/etc/skel_fm").joinpath(".kde4/vdt/2/2a")
                 if skel_fm_dir.exists():
                     files_to_remove.extend(skel_fm_dir.glob("LO*"))
@@ -1593,9 +2592,9 @@ class MainLogic(object):
                     rpms_to_rm.append(f"libobasis{base_version}-ooofonts")
                 # Leftover files and directories to remove (common for all vers.)
                 for user in users:
-                    dirs_to_rm.append(user.home_dir.joinpath(".libreoffice"))
-                    dirs_to_rm.append(user.home_dir.joinpath(".config/libreoffice"))
-                    files_to_remove.append(
+                    home_leftovers.append(user.home_dir.joinpath(".libreoffice"))
+                    home_leftovers.append(user.home_dir.joinpath(".config/libreoffice"))
+                    home_leftovers.append(
                         user.home_dir.joinpath("Desktop/lomanager.desktop")
                     )
                 for dir in pathlib.Path("/etc/skel/.config").glob("libreoffice*"):
@@ -1604,43 +2603,83 @@ class MainLogic(object):
                     dirs_to_rm.append(leftover_dir)
                 for icon in pathlib.Path("/usr/share/icons").glob("libreoffice*"):
                     files_to_remove.append(icon)
-        if LibreOfficeCORE:
+        if rpms_to_rm:
             # Remove
-            log.debug(_("LO core rpms_to_rm: {}").format(rpms_to_rm))
+            log.debug(_("rpms_to_rm: {}").format(rpms_to_rm))
             s, msg = PCLOS.uninstall_using_apt_get(rpms_to_rm, progress_reporter)
             if not s:
                 return (False, msg)
+        if OpenOfficeS or LibreOfficeCORE:
             # Do post-removal cleanup
+            # (leftovers in /opt etc. have to be gone before new Office
+            #  is installed, it may use the same locations)
             log.debug(_("Dirs to remove: {}").format(dirs_to_rm))
-            map(PCLOS.force_rm_directory, dirs_to_rm)
             log.debug(_("Files to remove: {}").format(files_to_remove))
-            map(PCLOS.remove_file, files_to_remove)
-            # update menus
-            PCLOS.update_menus()
+            progress_reporter.progress_msg(_("Removing leftover files..."))
+            cleanup.remove_paths(dirs_to_rm + files_to_remove)
+            if users_leftovers is None:
+                cleanup.remove_paths(home_leftovers)
+            else:
+                users_leftovers.extend(home_leftovers)
+            # update menus (when all changes are made)
+            self._post_hooks.request(hooks.MENUS)
+            self._post_hooks.request(hooks.DESKTOP_DATABASE)
 
         uninstall_msg = _("Packages successfully uninstalled")
         return (True, uninstall_msg)
 
+    def _set_up_installed_office(self, progress_reporter: Callable):
+        # Post install stuff
+        progress_reporter.progress_msg(_("Disabling LibreOffice's online updates..."))
+        progress_reporter.progress(50)
+        self._disable_LO_update_checks()
+        progress_reporter.progress(100)
+
+        progress_reporter.progress_msg(_("Modifying .desktop files..."))
+        progress_reporter.progress(50)
+        self._modify_dot_desktop_files()
+        progress_reporter.progress(100)
+
+        progress_reporter.progress_msg(_("Applying icon fixes..."))
+        progress_reporter.progress(50)
+        self._fix_LXDE_icons()
+        progress_reporter.progress(100)
+
     def _install_office_components(
         self,
         LO_core_tgzS: dict,
         LO_langs_tgzS: dict,
         progress_reporter: Callable,
+        prebuilt_rpms: list | None = None,
+        post_install: bool = True,
     ) -> tuple[bool, str]:
+        # prebuilt_rpms - rpm files to install along with the ones
+        # extracted from archives (eg. re-packaged for rollback),
+        # post_install - adjust installed Office (can be done separately
+        # with _set_up_installed_office)
         PCLOS.clean_dir(configuration.working_dir)
 
         rpms_c = []
         rpms_l = []
+        rpms_p = []
+        for rpm in prebuilt_rpms or []:
+            rpm_dest = configuration.working_dir.joinpath(rpm.name)
+            is_linked, msg = transfer.transfer_file(
+                rpm, rpm_dest, progress_reporter, keep_source=True
+            )
+            if not is_linked:
+                return (False, msg)
+            rpms_p.append(rpm_dest)
         if LO_core_tgzS:
             tgz = LO_core_tgzS[0]
             log.debug(_("Core tar.gz found"))
-            rpms_c = PCLOS.extract_tgz(tgz)
+            rpms_c = self._extract_tgz(tgz, progress_reporter)
         if LO_langs_tgzS:
             for tgz in LO_langs_tgzS:
                 log.debug(_("Lang/Help pack tar.gz found"))
-                rpms_l += PCLOS.extract_tgz(tgz)
+                rpms_l += self._extract_tgz(tgz, progress_reporter)
 
-        rpms = rpms_c + rpms_l
+        rpms = rpms_c + rpms_l + rpms_p
         if rpms:
             # Some rpm should be installed
 
@@ -1663,23 +2702,8 @@ class MainLogic(object):
             if is_installed is False:
                 return (False, msg)
 
-            # Post install stuff
-            progress_reporter.progress_msg(
-                _("Disabling LibreOffice's online updates...")
-            )
-            progress_reporter.progress(50)
-            self._disable_LO_update_checks()
-            progress_reporter.progress(100)
-
-            progress_reporter.progress_msg(_("Modifying .desktop files..."))
-            progress_reporter.progress(50)
-            self._modify_dot_desktop_files()
-            progress_reporter.progress(100)
-
-            progress_reporter.progress_msg(_("Applying icon fixes..."))
-            progress_reporter.progress(50)
-            self._fix_LXDE_icons()
-            progress_reporter.progress(100)
+            if post_install:
+                self._set_up_installed_office(progress_reporter)
 
             # Finally return success
             return (True, _("LibreOffice packages successfully installed"))
@@ -1689,89 +2713,66 @@ class MainLogic(object):
             log.error(msg)
             return (False, msg)
 
-    def _disable_LO_update_checks(self):
-        log.info(_("Preventing LibreOffice from checking for updates on its own"))
-
-        # -- helper functions --
-        def register_all_namespaces(f_name):
-            namespaces = dict(
-                [node for _, node in ET.iterparse(f_name, events=["start-ns"])]
-            )
-            for ns in namespaces:
-                ET.register_namespace(ns, namespaces[ns])
-
-        def add_disabled_autocheck(root):
-            uc_item = ET.SubElement(root, "item")
-            uc_item.set(
-                "oor:path",
-                r"/org.openoffice.Office.Jobs/Jobs/org.openoffice.Office.Jobs:Job['UpdateCheck']/Arguments",
-            )
-            uc_prop = ET.SubElement(uc_item, "prop")
-            uc_prop.set("oor:name", "AutoCheckEnabled")
-            uc_prop.set("oor:op", "fuse")
-            uc_prop.set("oor:type", "xs:boolean")
-            uc_val = ET.SubElement(uc_prop, "value")
-            uc_val.text = "false"
-
-        def create_xcu_file_w_disabled_autocheck(file: pathlib.Path):
-            ET.register_namespace("oor", "https://openoffice.org/2001/registry")
-            xml_root = ET.Element("{https://openoffice.org/2001/registry}items")
-            add_disabled_autocheck(root=xml_root)
-            xml_tree = ET.ElementTree(xml_root)
-            xml_tree.write(
-                file,
-                xml_declaration=True,
-                method="xml",
-                encoding="UTF-8",
+    def _extract_tgz(
+        self, tgz: pathlib.Path, progress_reporter: Callable
+    ) -> list[pathlib.Path]:
+        # Rpms extracted in advance (lomanager2 --prefetch) are linked
+        # to the working directory, otherwise the archive is extracted
+        if (prestaged_rpms := prestage.find_extracted(tgz)) is None:
+            return PCLOS.extract_tgz(tgz)
+        log.info(_("Using rpms extracted in advance from {}").format(tgz.name))
+        rpms = []
+        for rpm in prestaged_rpms:
+            rpm_dest = configuration.working_dir.joinpath(rpm.name)
+            is_linked, msg = transfer.transfer_file(
+                rpm, rpm_dest, progress_reporter, keep_source=True
             )
+            if not is_linked:
+                log.warning(msg)
+                return PCLOS.extract_tgz(tgz)
+            rpms.append(rpm_dest)
+        return rpms
 
-        def find_autocheck_prop(root):
-            value = ET.Element("value")
-            for property in root.iter("prop"):
-                if "AutoCheckEnabled" in property.attrib.values():
-                    return property.find("value")
-            return value
-
-        # -- end helper functions --
+    def _disable_LO_update_checks(self):
+        log.info(_("Preventing LibreOffice from checking for updates on its own"))
 
         # Disable checks for every existing user
-        for user in PCLOS.get_system_users():
-            log.debug(f"changing registrymodifications.xcu for user: {user.name}")
-            conf_dir_root = user.home_dir.joinpath(".config/libreoffice")
-            conf_dir = conf_dir_root.joinpath("4/user")
+        def disable_for_user(user: PCLOS.HumanUser) -> tuple[bool, str]:
+            if not user.home_dir.is_dir():
+                return (True, _("No home directory"))
+            conf_dir = user.home_dir.joinpath(".config/libreoffice/4/user")
             xcu_file = conf_dir.joinpath("registrymodifications.xcu")
-            if xcu_file.exists():
-                # modify existing file
-                register_all_namespaces(xcu_file)
-                xml_tree = ET.parse(xcu_file)
-                xml_root = xml_tree.getroot()
-                value = find_autocheck_prop(root=xml_root)
-                if value is None or value.text is None:
-                    # property does not exist, add it
-                    add_disabled_autocheck(root=xml_root)
+            conf_dir_fd = peruser.open_user_dir(user, conf_dir, create=True)
+            try:
+                try:
+                    os.stat(xcu_file.name, dir_fd=conf_dir_fd, follow_symlinks=False)
+                    is_present = True
+                except FileNotFoundError:
+                    is_present = False
+                if is_present:
+                    # modify existing file (only if the setting needs changing)
+                    is_ok, msg = xcuedit.disable_update_autocheck(
+                        xcu_file, dir_fd=conf_dir_fd
+                    )
+                    if not is_ok:
+                        return (False, msg)
                 else:
-                    # property exists.
-                    # set its value to false (even if it's false already)
-                    value.text = "false"
-
-                xml_tree.write(
-                    xcu_file,
-                    xml_declaration=True,
-                    method="xml",
-                    encoding="UTF-8",
-                )
-            else:
-                # LibreOffice was never started by this user
-                # Create new xcu_file with auto checks disabled
-                if not conf_dir.exists():
-                    PCLOS.make_dir_tree(target_dir=conf_dir)
-                create_xcu_file_w_disabled_autocheck(file=xcu_file)
-            # Set/reset files and folders ownership
-            log.debug(f"reseting ownership of: {conf_dir_root}")
-            os.chown(conf_dir_root, user.uid, user.gid)
-            for item in conf_dir.iterdir():
-                log.debug(f"reseting ownership of: {item}")
-                os.chown(item, user.uid, user.gid)
+                    # LibreOffice was never started by this user
+                    # Create new xcu_file with auto checks disabled
+                    xcuedit.create_with_update_autocheck_disabled(
+                        xcu_file, dir_fd=conf_dir_fd, owner=(user.uid, user.gid)
+                    )
+                    msg = _("Created")
+            finally:
+                os.close(conf_dir_fd)
+            return (True, msg)
+
+        results = peruser.run_for_users(disable_for_user, PCLOS.get_system_users())
+        is_done_for_all, report = peruser.report(results)
+        log.info(report)
+        if not is_done_for_all:
+            msg = _("Could not disable update checks for some users: ")
+            self.inform_user(msg, report, isOK=False)
 
         # Disable checking for new users (if ever created)
         skel_dir = pathlib.Path("/etc/skel/.config/libreoffice/4/user")
@@ -1780,7 +2781,7 @@ class MainLogic(object):
             log.debug(f"no xcu in skel creating new one")
             if not skel_dir.exists():
                 PCLOS.make_dir_tree(target_dir=skel_dir)
-            create_xcu_file_w_disabled_autocheck(file=skel_xcu_file)
+            xcuedit.create_with_update_autocheck_disabled(skel_xcu_file)
 
     def _modify_dot_desktop_files(self):
         # .desktop files shipped with LibreOffice contain the line:
@@ -1810,8 +2811,9 @@ class MainLogic(object):
                                 outfile.write("Categories=Office;\n")
                             else:
                                 outfile.write(line)
-        # Refresh menus
-        PCLOS.update_menus()
+        # Refresh menus (when all changes are made)
+        self._post_hooks.request(hooks.MENUS)
+        self._post_hooks.request(hooks.DESKTOP_DATABASE)
 
     def _fix_LXDE_icons(self):
         log.info(_("Applying fix for LXDE icons"))
@@ -1819,10 +2821,11 @@ class MainLogic(object):
             "libreoffice7*"
         )
         for icon in iconS:
-            PCLOS.run_shell_command(f"ln -fs {icon} /usr/share/icons/")
-        if pathlib.Path("/usr/bin/lxpanelctl").exists():
-            PCLOS.run_shell_command(f"/usr/bin/lxpanelctl restart")
-        PCLOS.update_menus()
+            self._post_hooks.request_symlink(
+                icon, pathlib.Path("/usr/share/icons/").joinpath(icon.name)
+            )
+        self._post_hooks.request(hooks.LXPANEL)
+        self._post_hooks.request(hooks.MENUS)
 
     def _uninstall_clipart(
         self,
@@ -1832,19 +2835,24 @@ class MainLogic(object):
         # For now it doesn't seem that openclipart rpm package name
         # includes version number so getting this information
         # from c_art_pkgs_to_rm is not necessary.
+        success, rpms_to_rm = self._installed_clipart_rpm_names()
+        if not success:
+            return (False, _("Failed to run shell command"))
+        s, msg = PCLOS.uninstall_using_apt_get(rpms_to_rm, progress_reporter)
+        if not s:
+            return (False, msg)
+        return (True, _("Openclipart successfully removed"))
+
+    def _installed_clipart_rpm_names(self) -> tuple[bool, list]:
         rpms_to_rm = []
         expected_rpm_names = ["libreoffice-openclipart", "clipart-openclipart"]
         for candidate in expected_rpm_names:
             success, reply = PCLOS.run_shell_command(f"rpm -qa | grep {candidate}")
             if not success:
-                return (False, _("Failed to run shell command"))
-            else:
-                if reply:
-                    rpms_to_rm.append(candidate)
-        s, msg = PCLOS.uninstall_using_apt_get(rpms_to_rm, progress_reporter)
-        if not s:
-            return (False, msg)
-        return (True, _("Openclipart successfully removed"))
+                return (False, [])
+            if reply:
+                rpms_to_rm.append(candidate)
+        return (True, rpms_to_rm)
 
     def _install_clipart(
         self,
@@ -1864,11 +2872,13 @@ class MainLogic(object):
     def _verify_local_copy(
         self,
         local_copy_directory: str,
+        version: str = "",
     ) -> tuple:
-        """Checks for presence of saved packages based on file name convention
+        """Checks for presence of saved packages
 
-        Based on expected files names this function checks
-        the directory passed for the presence of:
+        Based on expected files names (LibreOffice archives) and
+        package names read from rpm headers (Java and Clipart rpms)
+        this function checks the directory passed for the presence of:
             - 2 Java rpm packages (in Java_rpms subdir)
             - any LibreOffice core tar.gz archive
               (in LibreOffice-core_tgzs subdir)
@@ -1879,6 +2889,12 @@ class MainLogic(object):
         No specific LibreOffice version is enforced but version consistency
         among LibreOffice core and lang packages is checked.
 
+        If the directory contains a manifest (written when packages are
+        saved by lomanager2) it is used instead of scanning subdirectories.
+        If the directory is a repository of saved packages holding
+        several versions, the requested version (or the newest one)
+        is used.
+
         Returned is a tuple of dictionaries, each containing:
             - isPresent bool, signaling whether a component can be installed
             - rpm_abs_paths or tgz_abs_paths, list(s) of absolute paths to
@@ -1889,6 +2905,10 @@ class MainLogic(object):
         local_copy_directory : str
           Directory containing saved packages
 
+        version : str
+          LibreOffice version to use from saved packages repository
+          (empty string means the newest)
+
         Returns
         -------
         tuple[dict,dict,dict,dict]
@@ -1896,6 +2916,13 @@ class MainLogic(object):
           list - absolute paths to detected files.
         """
 
+        local_copy_directory = self._local_copy_view(local_copy_directory, version)
+
+        # Directories saved by lomanager2 come with a manifest which
+        # makes scanning unnecessary, older ones are scanned below
+        if (entries := offlinecopy.load_manifest(local_copy_directory)) is not None:
+            return self._local_copy_from_manifest(local_copy_directory, entries)
+
         detected_core_ver = ""
 
         Java_local_copy = {"isPresent": False, "rpm_abs_paths": []}
@@ -1907,20 +2934,17 @@ class MainLogic(object):
         Java_dir = pathlib.Path(local_copy_directory).joinpath("Java_rpms")
         log.info(f"Checking {Java_dir}")
         if Java_dir.is_dir():
-            # Search for: task-java-<something>.rpm, java-sun-<something>.rpm
-            tj_regX = re.compile(
-                r"^task-java-20[0-9][0-9]-[0-9]+pclos20[0-9][0-9]\.noarch\.rpm$"
-            )
-            js_regX = re.compile(
-                r"^java-sun-(?P<ver_js>[0-9]+)-[0-9]+pclos20[0-9][0-9]\.x86_64\.rpm$"
-            )
+            # Search for: task-java and java-sun rpm packages.
+            # Packages are recognized by the name stored in rpm header
+            # (not by the file name which may have been changed)
             task_java_files = []
             java_sun_files = []
-            for file in Java_dir.iterdir():
-                if match := tj_regX.search(file.name):
-                    task_java_files.append(match.string)
-                if match := js_regX.search(file.name):
-                    java_sun_files.append(match.string)
+            headers = rpmheader.read_rpm_headers(sorted(Java_dir.glob("*.rpm")))
+            for file, header in headers.items():
+                if header.name == "task-java":
+                    task_java_files.append(file.name)
+                if header.name == "java-sun":
+                    java_sun_files.append(file.name)
 
             # Only when both files are present we can use them
             if task_java_files and java_sun_files:
@@ -2046,22 +3070,16 @@ class MainLogic(object):
         Clipart_dir = Clipart_dir.joinpath("Clipart_rpms")
         log.info(_("Checking {}").format(Clipart_dir))
         if Clipart_dir.is_dir():
-            # Search for: libreoffice-openclipart-<something>.rpm ,
-            # clipart-openclipart-<something>.rpm
-            ca_regeX = re.compile(
-                r"^clipart-openclipart-(?P<ver_ca>[0-9]+\.[0-9]+)-[0-9]+pclos20[0-9][0-9]\.x86_64\.rpm$"
-            )
-            lca_regeX = re.compile(
-                r"^libreoffice-openclipart-(?P<ver_lca>[0-9]+\.[0-9]+)-[0-9]+pclos20[0-9][0-9]\.x86_64\.rpm$"
-            )
-
+            # Search for: libreoffice-openclipart and clipart-openclipart
+            # rpm packages (recognized by the name stored in rpm header)
             openclipart_files = []
             lo_clipart_files = []
-            for file in Clipart_dir.iterdir():
-                if match := ca_regeX.search(file.name):
-                    openclipart_files.append(match.string)
-                if match := lca_regeX.search(file.name):
-                    lo_clipart_files.append(match.string)
+            headers = rpmheader.read_rpm_headers(sorted(Clipart_dir.glob("*.rpm")))
+            for file, header in headers.items():
+                if header.name == "clipart-openclipart":
+                    openclipart_files.append(file.name)
+                if header.name == "libreoffice-openclipart":
+                    lo_clipart_files.append(file.name)
 
             # Only when both files are present we can use them
             if lo_clipart_files and openclipart_files:
@@ -2069,7 +3087,7 @@ class MainLogic(object):
                 msg = ""
                 for filename in lo_clipart_files + openclipart_files:
                     msg = msg + filename + " "
-                    abs_file_path = Java_dir.joinpath(filename)
+                    abs_file_path = Clipart_dir.joinpath(filename)
                     Clipart_local_copy["rpm_abs_paths"].append(abs_file_path)
                 log.info(_("Found Openclipart rpm packages: ") + msg)
             else:
@@ -2096,39 +3114,240 @@ class MainLogic(object):
             Clipart_local_copy,
         )
 
-    def _space_for_download(
-        self, packages_to_download: list[VirtualPackage]
-    ) -> tuple[bool, str, str]:
-        needed = 0
-        for p in packages_to_download:
-            for file in p.real_files:
-                needed += file["estimated_download_size"]
-        available = PCLOS.free_space_in_dir(configuration.working_dir)
-        is_enough = available > needed
-
-        def get_size_string(bytes_size):
-            if bytes_size / (1024**3) < 1:
-                if bytes_size / (1024**2) < 1:
-                    if bytes_size / 1024 < 1:
-                        return str(bytes_size) + " bytes"
-                    else:
-                        return str(round(bytes_size / (1024**1))) + " KiB"
-                else:
-                    return str(round(bytes_size / (1024**2))) + " MiB"
-            else:
-                return str(round(bytes_size / (1024**3))) + " GiB"
+    def _local_copy_view(self, local_copy_directory: str, version: str) -> pathlib.Path:
+        # Directory with packages of a single version: either the one
+        # passed or, for a repository of saved packages, its version subdir
+        local_copy_directory = pathlib.Path(local_copy_directory)
+        if offlinerepo.is_repository(local_copy_directory):
+            view_dir = offlinerepo.version_dir(local_copy_directory, version)
+            if view_dir is None:
+                # Nothing will be found there
+                return local_copy_directory.joinpath(offlinerepo.versions_dir_name)
+            return view_dir
+        return local_copy_directory
+
+    def _local_copy_from_manifest(
+        self,
+        local_copy_directory: str,
+        entries: list[dict],
+    ) -> tuple:
+        """Finds usable saved packages using the manifest of the directory
 
-        needed_str = get_size_string(needed)
-        available_str = get_size_string(available)
-        log.debug(_("Total size of packages to download: {}").format(needed_str))
-        log.debug(
-            _(
-                "Free space available in {}: {}".format(
-                    configuration.working_dir, available_str
+        Counterpart of _verify_local_copy for directories with a manifest.
+        A file is considered present if it exists and has the recorded
+        size, its content is verified later and only if it is going
+        to be used. Returned dictionaries additionally hold "checksums"
+        (absolute path -> SHA256) of the files listed.
+        """
+        copy_dir = pathlib.Path(local_copy_directory)
+        log.info(_("Reading manifest of {}").format(copy_dir))
+
+        def from_entries(component: str, key: str, version: str = "") -> dict:
+            local_copy = {"isPresent": False, key: [], "checksums": {}}
+            selected = [
+                e
+                for e in entries
+                if e["component"] == component
+                and (not version or e["version"] == version)
+            ]
+            if selected and all(
+                offlinecopy.is_entry_present(copy_dir, e) for e in selected
+            ):
+                local_copy["isPresent"] = True
+                for entry in selected:
+                    abs_file_path = copy_dir.joinpath(entry["path"])
+                    local_copy[key].append(abs_file_path)
+                    local_copy["checksums"][abs_file_path] = entry["sha256"]
+                log.info(
+                    _("Found {} files: ").format(component)
+                    + " ".join(p.name for p in local_copy[key])
                 )
+            elif selected:
+                log.warning(
+                    _("{} files listed in manifest are missing or damaged").format(
+                        component
+                    )
+                )
+            return local_copy
+
+        Java_local_copy = from_entries("Java", "rpm_abs_paths")
+        Clipart_local_copy = from_entries("Clipart", "rpm_abs_paths")
+        # Lang packs are only usable with the core package of the same version
+        # (newest one is used if manifest lists more then one)
+        core_versions = sorted(
+            {e["version"] for e in entries if e["component"] == "LibreOffice-core"},
+            key=functools.cmp_to_key(compare_versions),
+        )
+        core_version = core_versions[0] if core_versions else ""
+        LibreOffice_core_local_copy = from_entries(
+            "LibreOffice-core", "tgz_abs_paths", core_version
+        )
+        if LibreOffice_core_local_copy["isPresent"]:
+            LibreOffice_langs_local_copy = from_entries(
+                "LibreOffice-langs", "tgz_abs_paths", core_version
             )
+        else:
+            LibreOffice_langs_local_copy = {
+                "isPresent": False,
+                "tgz_abs_paths": [],
+                "checksums": {},
+            }
+        return (
+            Java_local_copy,
+            LibreOffice_core_local_copy,
+            LibreOffice_langs_local_copy,
+            Clipart_local_copy,
+        )
+
+    def _resolve_download_sizes(self, packages_to_download: list[VirtualPackage]):
+        """Fills in exact download sizes of files as reported by the server(s)"""
+        urls = [
+            file["base_url"] + file["name"]
+            for p in packages_to_download
+            for file in p.real_files
+        ]
+        sizes = net.resolve_file_sizes(urls)
+        for p in packages_to_download:
+            for file in p.real_files:
+                file["download_size"] = sizes.get(file["base_url"] + file["name"], 0)
+
+    def _expected_size(self, file: dict) -> int:
+        # Use exact size if it is known, fall back to the estimate otherwise
+        if file.get("download_size"):
+            return file["download_size"]
+        return file["estimated_download_size"]
+
+    def _select_staging_dir(self, needed_bytes: int):
+        """Moves temporary directory to the best location for the job
+
+        Staging on the filesystem holding apt's cache makes moving
+        Java rpms there and back a simple rename.
+        """
+        new_temporary_dir = staging.choose_staging_dir(
+            needed_bytes, target_dir=configuration.apt_cache_dir
         )
+        if new_temporary_dir != configuration.temporary_dir:
+            # Don't leave the previously used directory behind
+            PCLOS.force_rm_directory(configuration.temporary_dir)
+            configuration.set_temporary_dir(new_temporary_dir)
+
+    def _storage_label(self, package: VirtualPackage) -> str:
+        # Label under which package's files are stored and installed
+        if package.family == "LibreOffice":
+            if package.is_langpack():
+                return package.family + "-langs"
+            return package.family + "-core"
+        return package.family
+
+    def _plan_disk_space(
+        self,
+        packages_to_download: list[VirtualPackage],
+        rpms_and_tgzs_to_use: dict,
+        create_offline_copy: bool,
+    ) -> tuple[bool, str]:
+        """Checks if there is enough disk space for the whole procedure
+
+        Every operation that takes disk space (download, moving to
+        verified storage, Java rpms round trip through apt cache,
+        extraction of LibreOffice archives, installation and saving
+        packages for later use) is simulated in the order it happens to
+        find the peak usage of every filesystem involved.
+        Files already on disk are measured exactly (archive member sizes
+        and installed sizes from rpm headers), files yet to be downloaded
+        are estimated from their download size.
+        Space freed by removal of installed packages is not taken into
+        account.
+
+        Parameters
+        ----------
+        packages_to_download : list[VirtualPackage]
+
+        rpms_and_tgzs_to_use : dict
+          absolute paths to files already on disk that will be installed
 
-        return (is_enough, needed_str, available_str)
+        create_offline_copy : bool
+          downloaded files will be saved in offline copy directory
+
+        Returns
+        -------
+        tuple[bool, str]
+          T/F - enough space, description of shortages (empty if enough)
+        """
+        plan = spaceplanner.SpacePlan()
+        working_dir = configuration.working_dir
+        verified_dir = configuration.verified_dir
+        apt_cache_dir = configuration.apt_cache_dir
+        LO_install_dir = pathlib.Path("/opt")
+        system_install_dir = pathlib.Path("/usr")
+        ratio = spaceplanner.installed_size_ratio
+
+        # Every item is: label, file size, absolute path (None if not on disk)
+        items = []
+        for package in packages_to_download:
+            for file in package.real_files:
+                label = self._storage_label(package)
+                items.append((label, self._expected_size(file), None))
+        for label, paths in rpms_and_tgzs_to_use["files_to_install"].items():
+            for path in paths:
+                items.append((label, path.stat().st_size, path))
+
+        def location(path):
+            return verified_dir if path is None else path.parent
+
+        def rpm_installed_size(size, path):
+            if path is not None:
+                if (header := rpmheader.read_rpm_header(path)) is not None:
+                    return header.installed_size
+            return size * ratio
+
+        def archive_sizes(size, path):
+            if path is not None:
+                try:
+                    return spaceplanner.archive_rpm_sizes(path)
+                except (OSError, EOFError, tarfile.TarError) as error:
+                    log.warning(_("Could not inspect {}: {}").format(path, error))
+            return (size, size * ratio)
+
+        # 1) Downloads land in working directory and are moved to verified one
+        for label, size, path in items:
+            if path is None:
+                plan.allocate(working_dir, size, label)
+                plan.move(working_dir, verified_dir, size)
+
+        # 2) Java rpms make a round trip through apt's cache
+        #    (Java may have only been downloaded but to stay on the safe
+        #     side it is always assumed to be installed as well)
+        for label, size, path in items:
+            if label == "Java":
+                plan.move(location(path), apt_cache_dir, size)
+                plan.allocate(system_install_dir, rpm_installed_size(size, path))
+                plan.move(apt_cache_dir, location(path), size)
+
+        # 3) All LibreOffice archives are extracted to working directory,
+        #    rpms get installed and then working directory is cleaned
+        unpacked_total = 0
+        installed_total = 0
+        for label, size, path in items:
+            if label.startswith("LibreOffice"):
+                unpacked, installed = archive_sizes(size, path)
+                plan.allocate(working_dir, unpacked, label + " (extracted)")
+                unpacked_total += unpacked
+                installed_total += installed
+        plan.allocate(LO_install_dir, installed_total, "LibreOffice (installed)")
+        plan.release(working_dir, unpacked_total)
+
+        # 4) Clipart rpms are installed from where they are
+        for label, size, path in items:
+            if label == "Clipart":
+                plan.allocate(system_install_dir, rpm_installed_size(size, path))
+
+        # 5) Downloaded files may be saved for later use
+        if create_offline_copy:
+            for label, size, path in items:
+                if path is None:
+                    plan.move(verified_dir, configuration.offline_copy_dir, size)
+
+        is_enough, shortages = plan.check()
+        return (is_enough, "\n".join(shortages))
 
     # -- end Private methods of MainLogic
@@ -0,0 +1,269 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import http.server
+import json
+import logging
+import os
+import pathlib
+import re
+import stat
+import threading
+import urllib.parse
+
+import configuration
+
+from i18n import _
+
+from . import delta, integrity, net
+
+log = logging.getLogger("lomanager2_logger")
+
+# Files are requested by name only: GET /<file name>
+# (with optional "Range: bytes=<first>-<last>" header)
+# Block map of any served file (for delta transfers) is generated
+# on request: GET /<file name>.blockmap.json
+# Peers are not trusted: only files with a checksum published upstream
+# are fetched from them (see resolver) and every one is verified.
+range_regex = re.compile(r"^bytes=(?P<first>[0-9]*)-(?P<last>[0-9]*)$")
+# Number of generated block maps kept in memory
+block_maps_max_entries = 32
+
+
+def served_directories() -> list[pathlib.Path]:
+    # Directories whose files (at any depth) are offered to peers
+    # (download cache holds only files verified after download).
+    # Only regular files in directories only root can modify are served,
+    # anything else could have been planted by a local user.
+    return [configuration.offline_copy_dir, configuration.download_cache_dir]
+
+
+class PeerCacheServer(http.server.ThreadingHTTPServer):
+    """HTTP server offering verified packages to other machines
+
+    Files are looked up by name in served directories. The index
+    of available files is rebuilt whenever a requested name is missing
+    from it, so files saved while the server runs are found too.
+    Directories that users other than root can modify are skipped
+    and symbolic links are never followed.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], directories: list[pathlib.Path]):
+        super().__init__(address, _PeerCacheHandler)
+        self.directories = directories
+        self._index = {}
+        self._index_lock = threading.Lock()
+        self._block_maps = {}  # (path, mtime) -> JSON encoded block map
+        self._block_maps_lock = threading.Lock()
+
+    def _rebuild_index(self):
+        index = {}
+        for directory in self.directories:
+            for dir_path, dir_names, file_names in os.walk(directory):
+                if not integrity.is_root_only(pathlib.Path(dir_path), directory):
+                    dir_names.clear()
+                    continue
+                for file_name in file_names:
+                    # (unfinished downloads are not offered)
+                    if file_name.endswith(".part"):
+                        continue
+                    path = pathlib.Path(dir_path, file_name)
+                    try:
+                        if not stat.S_ISREG(os.lstat(path).st_mode):
+                            continue
+                    except OSError:
+                        continue
+                    index.setdefault(file_name, path)
+        self._index = index
+        log.debug(_("Peer cache serves {} files").format(len(index)))
+
+    def find_file(self, file_name: str) -> pathlib.Path | None:
+        with self._index_lock:
+            path = self._index.get(file_name)
+            if path is None or not path.is_file():
+                self._rebuild_index()
+                path = self._index.get(file_name)
+        return path
+
+    def open_file(self, file_name: str):
+        """Opens served file for reading, None if there is no such file"""
+        file_path = self.find_file(file_name)
+        if file_path is None:
+            return None
+        try:
+            f = os.fdopen(os.open(file_path, os.O_RDONLY | os.O_NOFOLLOW), "rb")
+        except OSError:
+            return None
+        if not stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+            f.close()
+            return None
+        return f
+
+    def block_map(self, file_path: pathlib.Path) -> bytes:
+        key = (file_path, os.lstat(file_path).st_mtime_ns)
+        with self._block_maps_lock:
+            content = self._block_maps.get(key)
+        if content is None:
+            block_map = delta.generate_block_map(file_path)
+            content = json.dumps(block_map).encode("utf-8")
+            with self._block_maps_lock:
+                self._block_maps[key] = content
+                # Drop the oldest entries
+                while len(self._block_maps) > block_maps_max_entries:
+                    del self._block_maps[next(iter(self._block_maps))]
+        return content
+
+
+class _PeerCacheHandler(http.server.BaseHTTPRequestHandler):
+    server_version = "lomanager2-peercache"
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def log_message(self, format, *args):
+        log.debug(_("Peer cache: {} {}").format(self.address_string(), format % args))
+
+    def _serve(self, send_body: bool):
+        file_name = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        file_name = file_name.lstrip("/")
+        # Only plain file names, nothing that could point outside
+        if not file_name or "/" in file_name or file_name.startswith("."):
+            self.send_error(404)
+            return
+        if file_name.endswith(delta.block_map_suffix):
+            self._serve_block_map(file_name, send_body)
+            return
+        f = self.server.open_file(file_name)
+        if f is None:
+            self.send_error(404)
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            first, last = 0, size - 1
+            status = 200
+            if range_header := self.headers.get("Range"):
+                match = range_regex.match(range_header.strip())
+                if match is None or (not match["first"] and not match["last"]):
+                    self.send_error(416)
+                    return
+                if not match["first"]:
+                    # suffix range: last N bytes
+                    first = max(size - int(match["last"]), 0)
+                else:
+                    first = int(match["first"])
+                    if match["last"]:
+                        last = min(int(match["last"]), size - 1)
+                if first > last:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.end_headers()
+                    return
+                status = 206
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(last - first + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+            self.end_headers()
+            if send_body:
+                self.wfile.flush()
+                # sendfile: file content goes to the socket without
+                # being copied through user space
+                self.connection.sendfile(f, offset=first, count=last - first + 1)
+
+    def _serve_block_map(self, file_name: str, send_body: bool):
+        file_path = self.server.find_file(file_name.removesuffix(delta.block_map_suffix))
+        if file_path is None:
+            self.send_error(404)
+            return
+        try:
+            content = self.server.block_map(file_path)
+        except OSError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(content)
+
+
+def serve(port: int | None = None, directories: list | None = None):
+    """Runs peer cache server until interrupted"""
+    if port is None:
+        port = configuration.peer_cache_port
+    if directories is None:
+        directories = served_directories()
+    for directory in directories:
+        if directory.exists() and not integrity.is_root_only(directory, directory):
+            log.warning(
+                _("Not serving {} (users other than root can modify it)").format(
+                    directory
+                )
+            )
+    with PeerCacheServer(("", port), directories) as server:
+        log.info(
+            _("Serving packages from {} on port {}").format(
+                ", ".join(str(d) for d in directories), port
+            )
+        )
+        server.serve_forever()
+
+
+def fetch_from_peers(
+    file_name: str,
+    dest_path: pathlib.Path,
+    progress_reporter,
+    batch_progress: net.DownloadBatchProgress | None = None,
+) -> tuple[bool, str]:
+    """Tries to download a file from machines listed in configuration.cache_peers
+
+    Downloaded file is NOT verified here, it has to be checked against
+    a checksum published upstream.
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F - file was downloaded, URL it was downloaded from
+    """
+    for peer in configuration.cache_peers:
+        url = peer.rstrip("/") + "/" + urllib.parse.quote(file_name)
+        is_available, _size = net.get_remote_file_size(url)
+        if not is_available:
+            continue
+        is_downloaded, msg = net.download_file(
+            url,
+            dest_path,
+            progress_reporter,
+            max_retries=1,
+            retry_delay_sec=0,
+            batch_progress=batch_progress,
+        )
+        if is_downloaded:
+            log.info(_("Got {} from {}").format(file_name, peer))
+            return (True, url)
+        log.warning(_("Failed to get {} from {}: {}").format(file_name, peer, msg))
+    return (False, "")
+
@@ -0,0 +1,171 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import pathlib
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import configuration
+
+from i18n import _
+
+from .PCLOS import HumanUser
+
+log = logging.getLogger("lomanager2_logger")
+
+# Running the same task (eg. editing a settings file) for many users.
+# Users are processed in batches (sorted by home directory, so one
+# worker touches nearby parts of the filesystem) by a pool of workers.
+# Files in home directories are accessed relative to descriptors of
+# directories opened without following symbolic links.
+_dir_flags = os.O_RDONLY | os.O_DIRECTORY
+
+
+def _check_owner(fd: int, user: HumanUser, path: pathlib.Path):
+    st = os.fstat(fd)
+    if st.st_uid != user.uid or not stat.S_ISDIR(st.st_mode):
+        raise OSError(_("{} is not a directory owned by {}").format(path, user.name))
+
+
+def open_user_dir(
+    user: HumanUser, directory: pathlib.Path, create: bool = False
+) -> int:
+    """Opens directory in user's home without following symbolic links
+
+    The directory is reached from the home directory one component
+    at a time (relative to the descriptor of the previous one), so a link
+    planted by the user can't make root act on anything outside of it.
+    Every component has to be a directory owned by the user.
+
+    Parameters
+    ----------
+    user : HumanUser
+
+    directory : pathlib.Path
+      directory inside user's home directory
+
+    create : bool
+      create missing directories (owned by the user)
+
+    Returns
+    -------
+    int
+      file descriptor of the directory (to be closed by the caller)
+
+    Raises
+    ------
+    OSError
+      if the directory can't be opened or any component is a link
+      or is not owned by the user
+    """
+    relative_parts = directory.relative_to(user.home_dir).parts
+    fd = os.open(user.home_dir, _dir_flags)
+    try:
+        _check_owner(fd, user, user.home_dir)
+        path = user.home_dir
+        for name in relative_parts:
+            path = path.joinpath(name)
+            if create:
+                try:
+                    os.mkdir(name, dir_fd=fd)
+                except FileExistsError:
+                    pass
+                else:
+                    os.chown(name, user.uid, user.gid, dir_fd=fd, follow_symlinks=False)
+            parent_fd = fd
+            fd = os.open(name, _dir_flags | os.O_NOFOLLOW, dir_fd=parent_fd)
+            os.close(parent_fd)
+            _check_owner(fd, user, path)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def run_for_users(
+    task: Callable,
+    users: list[HumanUser],
+    max_workers: int | None = None,
+    batch_size: int | None = None,
+) -> list[tuple[HumanUser, bool, str]]:
+    """Runs task for every user at the same time
+
+    Parameters
+    ----------
+    task : Callable
+      function taking HumanUser and returning tuple[bool, str]
+      (T/F success, description); exceptions count as failures
+
+    users : list[HumanUser]
+
+    max_workers : int | None
+      (configuration.per_user_workers if None)
+
+    batch_size : int | None
+      number of users a worker processes at once
+      (configuration.per_user_batch_size if None)
+
+    Returns
+    -------
+    list[tuple[HumanUser, bool, str]]
+      user, T/F success, description - in the order of users
+    """
+    if max_workers is None:
+        max_workers = configuration.per_user_workers
+    if batch_size is None:
+        batch_size = configuration.per_user_batch_size
+
+    def run_batch(batch: list[HumanUser]) -> list[tuple[HumanUser, bool, str]]:
+        results = []
+        for user in batch:
+            try:
+                is_ok, msg = task(user)
+            except Exception as error:
+                log.debug(f"{user.name}: {error}")
+                is_ok, msg = (False, str(error))
+            results.append((user, is_ok, msg))
+        return results
+
+    ordered = sorted(users, key=lambda user: str(user.home_dir))
+    batches = [
+        ordered[i : i + batch_size] for i in range(0, len(ordered), batch_size)
+    ]
+    by_user = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for results in executor.map(run_batch, batches):
+            for user, is_ok, msg in results:
+                by_user[id(user)] = (user, is_ok, msg)
+    return [by_user[id(user)] for user in users]
+
+
+def report(results: list[tuple[HumanUser, bool, str]]) -> tuple[bool, str]:
+    """Summary of run_for_users results
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F task succeeded for all users, report listing failures
+    """
+    failed = [(user, msg) for user, is_ok, msg in results if not is_ok]
+    summary = _("Done for {} of {} users").format(
+        len(results) - len(failed), len(results)
+    )
+    lines = [summary] + [f"{user.name}: {msg}" for user, msg in failed]
+    return (not failed, "\n".join(lines))
@@ -0,0 +1,234 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import logging
+import os
+import pathlib
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import configuration
+
+from i18n import _
+
+from . import net, resolver, rpmheader
+
+log = logging.getLogger("lomanager2_logger")
+
+
+def verify_cached_file(file: dict, file_path: pathlib.Path) -> bool:
+    """Verifies a file downloaded in advance (without progress reporting)"""
+    f_url = file["base_url"] + file["name"]
+    if file["checksum"]:
+        try:
+            csf_url = f_url + "." + file["checksum"]
+            with urllib.request.urlopen(csf_url, timeout=net.connections_timeout) as r:
+                expected = r.read().decode("utf-8").split()[0]
+        except (urllib.error.URLError, OSError, UnicodeDecodeError, IndexError) as error:
+            log.warning(_("Could not get checksum of {}: {}").format(f_url, error))
+            return False
+        file_hash = hashlib.new(file["checksum"])
+        with open(file_path, "rb") as f:
+            while chunk := f.read(4 * 1024**2):
+                file_hash.update(chunk)
+        return file_hash.hexdigest() == expected
+    if file["name"].endswith(".rpm"):
+        is_known, size = net.get_remote_file_size(f_url)
+        return is_known and rpmheader.verify_payload(file_path, size)
+    return False
+
+
+def evict_cache(keep: set | frozenset = frozenset()):
+    """Keeps configuration.download_cache_dir within its limits
+
+    Unfinished downloads not continued for download_cache_part_max_age
+    are removed, then the oldest files until the cache fits in
+    download_cache_max_size.
+
+    Parameters
+    ----------
+    keep : set
+      names of files that must not be removed (eg. wanted right now)
+    """
+    now = time.time()
+    files = []
+    try:
+        with os.scandir(configuration.download_cache_dir) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                if entry.name.endswith(".part"):
+                    age = now - st.st_mtime
+                    if (
+                        entry.name.removesuffix(".part") not in keep
+                        and age > configuration.download_cache_part_max_age
+                    ):
+                        log.debug(_("Removing stale download {}").format(entry.path))
+                        os.remove(entry.path)
+                else:
+                    files.append((st.st_mtime, st.st_size, entry.path, entry.name))
+        total_size = sum(size for _mtime, size, _path, _name in files)
+        if configuration.download_cache_max_size:
+            for _mtime, size, path, name in sorted(files):
+                if name in keep:
+                    continue
+                if total_size <= configuration.download_cache_max_size:
+                    break
+                log.debug(_("Removing from download cache: {}").format(path))
+                os.remove(path)
+                total_size -= size
+    except FileNotFoundError:
+        pass
+    except OSError as error:
+        log.warning(_("Could not clean download cache: {}").format(error))
+
+
+def fetch_to_cache(file: dict, cancel_event=None, rate_limit: int = 0) -> tuple[bool, str]:
+    """Downloads and verifies a file into configuration.download_cache_dir
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F - file is in the cache, error description
+    """
+    cache_dir = configuration.download_cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    dest_path = cache_dir.joinpath(file["name"])
+    if dest_path.exists():
+        return (True, "")
+    f_url = file["base_url"] + file["name"]
+    is_downloaded, msg = net.download_resumable(
+        f_url, dest_path, cancel_event=cancel_event, rate_limit=rate_limit
+    )
+    if not is_downloaded:
+        return (False, msg)
+    if not verify_cached_file(file, dest_path):
+        os.remove(dest_path)
+        msg = _("Verification of the {} failed").format(file["name"])
+        log.warning(msg)
+        return (False, msg)
+    log.info(_("Fetched in advance: {}").format(file["name"]))
+    return (True, "")
+
+
+class PrefetchManager:
+    """Downloads files of packages marked for install in the background
+
+    The set of wanted files is replaced with every update() call.
+    Files are fetched one at a time by a low priority thread into the
+    download cache where the file resolver finds them later.
+    A download of a file that is no longer wanted is cancelled, its
+    partial data is kept so that it continues if the file is wanted again.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._wanted = {}  # url -> real_files entry, in order of marking
+        self._failed = set()  # urls that could not be fetched
+        self._current_url = ""
+        self._cancel_current = threading.Event()
+        self._wake_up = threading.Event()
+        self._is_stopping = False
+        self._thread = None
+
+    def update(self, files: list[dict]):
+        """Sets files to be fetched (files already on this machine are skipped)
+
+        Returns immediately, looking for files already on this machine
+        is done by the fetching thread.
+        """
+        if not configuration.prefetch_enabled:
+            return
+        wanted = {file["base_url"] + file["name"]: file for file in files}
+        with self._lock:
+            self._wanted = wanted
+            self._is_stopping = False
+            if self._current_url and self._current_url not in wanted:
+                log.debug(_("Prefetch cancelled: {}").format(self._current_url))
+                self._cancel_current.set()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="prefetch", daemon=True
+                )
+                self._thread.start()
+        self._wake_up.set()
+
+    def stop(self, timeout: float = 10):
+        """Stops fetching (eg. when changes are going to be applied)"""
+        with self._lock:
+            self._is_stopping = True
+            self._wanted = {}
+            self._cancel_current.set()
+            thread = self._thread
+        self._wake_up.set()
+        if thread is not None:
+            thread.join(timeout)
+
+    def _next_file(self) -> dict | None:
+        with self._lock:
+            if self._is_stopping:
+                return None
+            for url, file in self._wanted.items():
+                if url not in self._failed:
+                    self._current_url = url
+                    self._cancel_current.clear()
+                    return file
+            self._current_url = ""
+            return None
+
+    def _keep(self) -> set:
+        with self._lock:
+            return {file["name"] for file in self._wanted.values()}
+
+    def _run(self):
+        # Don't compete for CPU with the user's work
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except OSError:
+            pass
+        evict_cache(keep=self._keep())
+        while True:
+            file = self._next_file()
+            if file is None:
+                with self._lock:
+                    if self._is_stopping:
+                        return
+                self._wake_up.wait()
+                self._wake_up.clear()
+                continue
+            url = file["base_url"] + file["name"]
+            if resolver.is_available_locally(file):
+                is_fetched, msg = (True, "")
+            else:
+                is_fetched, msg = fetch_to_cache(
+                    file,
+                    cancel_event=self._cancel_current,
+                    rate_limit=configuration.prefetch_rate_limit,
+                )
+                if is_fetched:
+                    evict_cache(keep=self._keep())
+            with self._lock:
+                if is_fetched:
+                    self._wanted.pop(url, None)
+                elif not self._cancel_current.is_set():
+                    log.debug(_("Prefetch of {} failed: {}").format(url, msg))
+                    self._failed.add(url)
+                self._current_url = ""
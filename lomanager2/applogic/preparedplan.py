@@ -0,0 +1,143 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+import time
+
+import configuration
+
+from i18n import _
+
+log = logging.getLogger("lomanager2_logger")
+
+# Two-phase changes: "prepare" collects, verifies and test-installs
+# packages and stores them in configuration.prepared_dir together with
+# the plan file. "commit" makes the changes later, provided the plan
+# is intact and installed packages did not change in the meantime.
+plan_file_name = "plan.json"
+plan_format = 1
+
+
+def _seal(plan: dict) -> str:
+    # Digest of everything in the plan except the seal itself
+    content = {key: value for key, value in plan.items() if key != "seal"}
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def new_plan(
+    rpmdb_generation: str,
+    marks: list[dict],
+    files_to_install: dict,
+    file_hashes: dict,
+    manifest: list[dict],
+    keep_packages: bool,
+) -> dict:
+    """Creates a plan
+
+    Parameters
+    ----------
+    rpmdb_generation : str
+      PCLOS.get_rpmdb_generation() at the time of preparation
+
+    marks : list[dict]
+      family, kind, version and install/removal/download marks of packages
+
+    files_to_install : dict
+      component -> list of file paths relative to configuration.prepared_dir
+
+    file_hashes : dict
+      relative file path -> SHA256
+
+    manifest : list[dict]
+      offlinecopy manifest entries of the files
+
+    keep_packages : bool
+      save packages for later use when changes are made
+    """
+    plan = {
+        "format": plan_format,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "rpmdb_generation": rpmdb_generation,
+        "marks": marks,
+        "files_to_install": files_to_install,
+        "file_hashes": file_hashes,
+        "manifest": manifest,
+        "keep_packages": keep_packages,
+    }
+    plan["seal"] = _seal(plan)
+    return plan
+
+
+def save_plan(plan: dict) -> tuple[bool, str]:
+    """Writes plan file to configuration.prepared_dir (atomically)"""
+    plan_file = configuration.prepared_dir.joinpath(plan_file_name)
+    temp_file = plan_file.with_name(plan_file.name + ".tmp")
+    try:
+        with open(temp_file, "w") as f:
+            json.dump(plan, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, plan_file)
+    except OSError as error:
+        msg = _("Could not save the plan: {}").format(error)
+        log.error(msg)
+        return (False, msg)
+    return (True, "")
+
+
+def load_plan() -> tuple[dict | None, str]:
+    """Reads and checks the prepared plan
+
+    Returns
+    -------
+    tuple[dict | None, str]
+      plan (None if there is none or it can't be used), reason
+    """
+    plan_file = configuration.prepared_dir.joinpath(plan_file_name)
+    try:
+        with open(plan_file, "r") as f:
+            plan = json.load(f)
+    except FileNotFoundError:
+        return (None, _("No changes were prepared"))
+    except (OSError, ValueError) as error:
+        return (None, _("Could not read the plan: {}").format(error))
+    if plan.get("format") != plan_format:
+        return (None, _("Unsupported plan format"))
+    if plan.get("seal") != _seal(plan):
+        return (None, _("The plan has been modified"))
+    return (plan, "")
+
+
+def is_prepared() -> bool:
+    return configuration.prepared_dir.joinpath(plan_file_name).exists()
+
+
+def discard():
+    """Removes the plan and prepared files"""
+    log.debug(_("Discarding prepared changes"))
+    shutil.rmtree(configuration.prepared_dir, ignore_errors=True)
+
+
+def absolute_path(rel_path: str) -> pathlib.Path:
+    return configuration.prepared_dir.joinpath(rel_path)
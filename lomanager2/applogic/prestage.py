@@ -0,0 +1,234 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import logging
+import os
+import pathlib
+import shutil
+import tarfile
+import time
+
+import configuration
+
+from i18n import _
+
+from . import integrity, prefetch, resolver
+
+log = logging.getLogger("lomanager2_logger")
+
+# Pre-staging: files of the recommended LibreOffice version are
+# downloaded into the download cache ahead of time (eg. by a timer,
+# lomanager2 --prefetch) and rpms are extracted from the archives to
+# configuration.prestaged_dir/<archive name>/ next to a marker holding
+# the SHA256 of the archive they came from. Install uses extracted rpms
+# only if the marker matches the archive being installed.
+extracted_marker_name = ".source.json"
+# Values of "state" in the status file
+state_in_progress = "in progress"
+state_ready = "ready"
+state_failed = "failed"
+
+
+def read_status() -> dict | None:
+    """Reads the status file written by the last pre-staging run"""
+    try:
+        with open(configuration.prestage_status_file, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as error:
+        log.warning(_("Could not read pre-staging status: {}").format(error))
+        return None
+
+
+def _write_status(status: dict):
+    status["updated"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    status_file = configuration.prestage_status_file
+    temp_file = status_file.with_name(status_file.name + ".tmp")
+    try:
+        os.makedirs(status_file.parent, exist_ok=True)
+        with open(temp_file, "w") as f:
+            json.dump(status, f, indent=2)
+        os.replace(temp_file, status_file)
+    except OSError as error:
+        log.warning(_("Could not write pre-staging status: {}").format(error))
+
+
+def is_ready_for(version: str) -> bool:
+    """Checks if files of the given LibreOffice version are pre-staged"""
+    status = read_status()
+    if status is None or status.get("state") != state_ready:
+        return False
+    if status.get("version") != version:
+        return False
+    return all(
+        resolver.is_available_locally({"name": name})
+        for name in status.get("files", [])
+    )
+
+
+def pre_extract(archive_path: pathlib.Path) -> tuple[bool, str]:
+    """Extracts rpms from LibreOffice archive to configuration.prestaged_dir"""
+    target_dir = configuration.prestaged_dir.joinpath(archive_path.name)
+    partial_dir = target_dir.with_name(target_dir.name + ".part")
+    try:
+        digest = integrity.hash_files([archive_path])[archive_path]
+        if partial_dir.exists():
+            shutil.rmtree(partial_dir)
+        os.makedirs(partial_dir)
+        n_rpms = 0
+        with tarfile.open(archive_path, mode="r|gz") as targz:
+            for member in targz:
+                path = pathlib.PurePosixPath(member.name)
+                if not member.isfile() or path.parent.name != "RPMS":
+                    continue
+                if path.suffix != ".rpm":
+                    continue
+                source = targz.extractfile(member)
+                with open(partial_dir.joinpath(path.name), "wb") as f:
+                    shutil.copyfileobj(source, f, 1024**2)
+                n_rpms += 1
+        # Extracted rpms are checked against their checksums every time
+        # they are used
+        rpms = sorted(partial_dir.glob("*.rpm"))
+        rpm_digests = integrity.hash_files(rpms)
+        with open(partial_dir.joinpath(extracted_marker_name), "w") as f:
+            json.dump(
+                {
+                    "archive": archive_path.name,
+                    "sha256": digest,
+                    "rpms": {rpm.name: rpm_digests[rpm] for rpm in rpms},
+                },
+                f,
+            )
+        if target_dir.exists():
+            shutil.rmtree(target_dir)
+        os.replace(partial_dir, target_dir)
+    except (OSError, EOFError, tarfile.TarError) as error:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        msg = _("Could not extract {}: {}").format(archive_path.name, error)
+        log.error(msg)
+        return (False, msg)
+    log.info(_("Extracted {} rpms from {}").format(n_rpms, archive_path.name))
+    return (True, "")
+
+
+def find_extracted(archive_path: pathlib.Path) -> list[pathlib.Path] | None:
+    """Returns rpms extracted in advance from this very archive (if any)
+
+    Rpms are returned only if they are intact (the same as when
+    they were extracted).
+    """
+    target_dir = configuration.prestaged_dir.joinpath(archive_path.name)
+    try:
+        with open(target_dir.joinpath(extracted_marker_name), "r") as f:
+            marker = json.load(f)
+        digest = integrity.hash_files([archive_path])[archive_path]
+        rpms = sorted(target_dir.glob("*.rpm"))
+        if marker.get("sha256") != digest or sorted(marker.get("rpms", {})) != [
+            rpm.name for rpm in rpms
+        ]:
+            log.debug(_("Pre-extracted rpms do not match {}").format(archive_path.name))
+            return None
+        is_intact, msg = integrity.verify_files(
+            {rpm: marker["rpms"][rpm.name] for rpm in rpms}
+        )
+    except (OSError, ValueError, TypeError, KeyError):
+        return None
+    if not is_intact:
+        log.warning(_("Pre-extracted rpms are damaged: {}").format(msg))
+        return None
+    return rpms
+
+
+def _remove_stale_extracted(keep_names: set):
+    if not configuration.prestaged_dir.is_dir():
+        return
+    for item in configuration.prestaged_dir.iterdir():
+        if item.name not in keep_names:
+            log.debug(_("Removing stale pre-extracted rpms {}").format(item))
+            shutil.rmtree(item, ignore_errors=True)
+
+
+def prestage(
+    version: str,
+    languages: list,
+    files: list[dict],
+    progress_reporter,
+    rate_limit: int = 0,
+) -> tuple[bool, str]:
+    """Downloads, verifies and extracts files of a LibreOffice version
+
+    Progress is written to the status file (configuration.prestage_status_file)
+    so that the program can tell the user no download will be needed.
+
+    Parameters
+    ----------
+    version : str
+      LibreOffice version the files belong to
+
+    languages : list
+      language codes of the language packs among files
+
+    files : list[dict]
+      elements of VirtualPackage.real_files
+
+    progress_reporter : Callable
+
+    rate_limit : int
+      download speed limit in bytes/s, 0 - unlimited
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F - all files are ready, error description
+    """
+    status = {
+        "version": version,
+        "languages": sorted(languages),
+        "files": [file["name"] for file in files],
+        "state": state_in_progress,
+        "message": "",
+    }
+    _write_status(status)
+
+    for n, file in enumerate(files, start=1):
+        progress_reporter.progress_msg(
+            _("Pre-staging ({}/{}): {}").format(n, len(files), file["name"])
+        )
+        if not resolver.is_available_locally(file):
+            is_fetched, msg = prefetch.fetch_to_cache(file, rate_limit=rate_limit)
+            if not is_fetched:
+                status.update(state=state_failed, message=msg)
+                _write_status(status)
+                return (False, msg)
+        archive_path = resolver.local_path(file)
+        if archive_path.name.endswith(".tar.gz") and find_extracted(archive_path) is None:
+            is_extracted, msg = pre_extract(archive_path)
+            if not is_extracted:
+                status.update(state=state_failed, message=msg)
+                _write_status(status)
+                return (False, msg)
+        progress_reporter.progress(int(100 * n / len(files)))
+
+    # Rpms of older versions would only take space
+    _remove_stale_extracted({file["name"] for file in files})
+    prefetch.evict_cache(keep={file["name"] for file in files})
+    status["state"] = state_ready
+    _write_status(status)
+    return (True, _("LibreOffice {} is ready to be installed").format(version))
@@ -0,0 +1,276 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import pathlib
+from typing import Callable
+
+import configuration
+
+from i18n import _
+
+from . import delta, integrity, net, offlinecopy, offlinerepo, peercache, transfer
+
+log = logging.getLogger("lomanager2_logger")
+
+# Every source is a function placing the requested file at the
+# destination path and returning:
+#   (T/F - file was placed, T/F - it comes from a directory only root
+#    can modify)
+# The file is then verified against the checksum published upstream.
+# Files without such checksum are accepted only from root-only
+# directories (a checksum found next to the file, eg. in a manifest
+# of saved packages, proves nothing - whoever could plant the file
+# could plant the checksum too). Sources are tried in the order listed
+# below which is the order of increasing cost of getting the file.
+
+
+def _link_candidate(candidate: pathlib.Path, dest_path: pathlib.Path) -> bool:
+    # Local files are hardlinked (or reflinked/copied) - never moved,
+    # their source has to stay intact
+    is_linked, _msg = transfer.transfer_file(candidate, dest_path, keep_source=True)
+    return is_linked
+
+
+def _from_local_dir(
+    candidate: pathlib.Path, top_dir: pathlib.Path, dest_path: pathlib.Path
+) -> tuple[bool, bool]:
+    is_root_only = integrity.is_root_only(candidate, top_dir)
+    if candidate.is_file() and _link_candidate(candidate, dest_path):
+        return (True, is_root_only)
+    return (False, False)
+
+
+def _from_apt_cache(file: dict, dest_path: pathlib.Path, *args) -> tuple[bool, bool]:
+    candidate = configuration.apt_cache_dir.joinpath(file["name"])
+    return _from_local_dir(candidate, configuration.apt_cache_dir, dest_path)
+
+
+def _saved_packages_manifests() -> list[tuple[pathlib.Path, list[dict]]]:
+    # (directory, manifest entries) of every saved packages directory
+    repo_dir = configuration.offline_copy_dir
+    if offlinerepo.is_repository(repo_dir):
+        directories = [
+            repo_dir.joinpath(offlinerepo.versions_dir_name, v)
+            for v in offlinerepo.list_versions(repo_dir)
+        ]
+    else:
+        directories = [repo_dir]
+    manifests = []
+    for directory in directories:
+        if (entries := offlinecopy.load_manifest(directory)) is not None:
+            manifests.append((directory, entries))
+    return manifests
+
+
+def _from_saved_packages(
+    file: dict, dest_path: pathlib.Path, *args
+) -> tuple[bool, bool]:
+    # (manifests are only used to find the file, not to verify it)
+    url = file["base_url"] + file["name"]
+    for directory, entries in _saved_packages_manifests():
+        for entry in entries:
+            if entry.get("url") == url or pathlib.PurePath(entry["path"]).name == (
+                file["name"]
+            ):
+                if offlinecopy.is_entry_present(directory, entry):
+                    is_placed, is_root_only = _from_local_dir(
+                        directory.joinpath(entry["path"]),
+                        configuration.offline_copy_dir,
+                        dest_path,
+                    )
+                    if is_placed:
+                        return (True, is_root_only)
+    # Saved packages directory without manifest
+    for candidate in configuration.offline_copy_dir.glob("*/" + file["name"]):
+        is_placed, is_root_only = _from_local_dir(
+            candidate, configuration.offline_copy_dir, dest_path
+        )
+        if is_placed:
+            return (True, is_root_only)
+    return (False, False)
+
+
+def _from_download_cache(
+    file: dict, dest_path: pathlib.Path, *args
+) -> tuple[bool, bool]:
+    candidate = configuration.download_cache_dir.joinpath(file["name"])
+    return _from_local_dir(candidate, configuration.download_cache_dir, dest_path)
+
+
+def _from_peers(
+    file: dict, dest_path: pathlib.Path, progress_reporter, batch_progress
+) -> tuple[bool, bool]:
+    # Anybody on the network can serve anything, files without a checksum
+    # published upstream could not be verified
+    if not configuration.cache_peers or not file["checksum"]:
+        return (False, False)
+    is_fetched, _peer_url = peercache.fetch_from_peers(
+        file["name"], dest_path, progress_reporter, batch_progress
+    )
+    return (is_fetched, False)
+
+
+def _from_delta(
+    file: dict, dest_path: pathlib.Path, progress_reporter, batch_progress
+) -> tuple[bool, bool]:
+    # Older version of the file is reused and only changed parts downloaded
+    # (block maps come from peers, the result is verified only against
+    #  the checksum published upstream)
+    if not configuration.delta_transfer_enabled or not file["checksum"]:
+        return (False, False)
+    is_assembled, _msg = delta.delta_download(
+        file["base_url"] + file["name"], dest_path, progress_reporter
+    )
+    if is_assembled:
+        batch_progress.file_done(os.path.getsize(dest_path))
+    return (is_assembled, False)
+
+
+# (source name, function, is the source on this machine)
+sources = [
+    (_("apt cache"), _from_apt_cache, True),
+    (_("saved packages"), _from_saved_packages, True),
+    (_("download cache"), _from_download_cache, True),
+    (_("local network peers"), _from_peers, False),
+    (_("delta transfer"), _from_delta, False),
+]
+
+
+def _local_candidates(file: dict):
+    # (path, top directory of the source) of copies that may exist
+    for top_dir in (configuration.download_cache_dir, configuration.apt_cache_dir):
+        yield (top_dir.joinpath(file["name"]), top_dir)
+    for directory, entries in _saved_packages_manifests():
+        for entry in entries:
+            if pathlib.PurePath(entry["path"]).name == file["name"]:
+                candidate = directory.joinpath(entry["path"])
+                yield (candidate, configuration.offline_copy_dir)
+    for candidate in configuration.offline_copy_dir.glob("*/" + file["name"]):
+        yield (candidate, configuration.offline_copy_dir)
+
+
+def local_path(file: dict) -> pathlib.Path | None:
+    """Finds (without verifying) a copy of a file already on this machine"""
+    for candidate, _top_dir in _local_candidates(file):
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def root_only_local_path(file: dict) -> pathlib.Path | None:
+    """Finds a copy of a file in a directory only root can modify
+
+    Files are put in such directories only after they are verified
+    (eg. download cache), nobody else could have changed them since.
+    """
+    for candidate, top_dir in _local_candidates(file):
+        if candidate.is_file() and integrity.is_root_only(candidate, top_dir):
+            return candidate
+    return None
+
+
+def is_available_locally(file: dict) -> bool:
+    """Quick check (no verification) if a file is on this machine already"""
+    return local_path(file) is not None
+
+
+def resolve_file(
+    file: dict,
+    dest_path: pathlib.Path,
+    progress_reporter: Callable,
+    batch_progress: net.DownloadBatchProgress,
+    verify: Callable,
+    skip_verify: bool = False,
+) -> tuple[bool, str]:
+    """Gets a verified copy of a file from the cheapest source that has it
+
+    Sources (see sources list) are probed in order, a file found in any
+    of them is always verified against the checksum published upstream
+    (files without one are accepted only from root-only directories)
+    and if verification fails the next source is tried. The file is
+    downloaded from its upstream URL (and verified unless skip_verify
+    is set) only if no other source could provide it.
+
+    Parameters
+    ----------
+    file : dict
+      an element of VirtualPackage.real_files
+
+    dest_path : pathlib.Path
+      where the file should be placed
+
+    progress_reporter : Callable
+
+    batch_progress : net.DownloadBatchProgress
+      progress of downloading all files
+
+    verify : Callable
+      verify(file, dest_path, progress_reporter, from_upstream) -> (bool, str)
+      checks a file against its upstream checksum
+
+    skip_verify : bool
+      do not verify file downloaded from upstream
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F - success/failure, error description (empty on success)
+    """
+    for source_name, get_file, is_local in sources:
+        is_placed, is_root_only = get_file(
+            file, dest_path, progress_reporter, batch_progress
+        )
+        if not is_placed:
+            continue
+        if file["checksum"] or is_root_only:
+            is_correct, msg = verify(
+                file, dest_path, progress_reporter, from_upstream=False
+            )
+        else:
+            is_correct = False
+            msg = _(
+                "no checksum is published upstream and the directory "
+                "is not root-only"
+            )
+        size = os.path.getsize(dest_path)
+        if is_correct:
+            log.info(_("Using {} from {}").format(file["name"], source_name))
+            if is_local:
+                batch_progress.file_done(size)
+            return (True, "")
+        log.warning(
+            _("Rejected {} from {}: {}").format(file["name"], source_name, msg)
+        )
+        if not is_local:
+            batch_progress.file_discarded(size)
+        os.remove(dest_path)
+
+    f_url = file["base_url"] + file["name"]
+    is_downloaded, error_msg = net.download_file(
+        f_url,
+        dest_path,
+        progress_reporter,
+        batch_progress=batch_progress,
+    )
+    if not is_downloaded:
+        msg = _("Error while trying to download {}: ").format(f_url)
+        return (False, msg + error_msg)
+    if skip_verify:
+        return (True, "")
+    return verify(file, dest_path, progress_reporter, from_upstream=True)
@@ -0,0 +1,207 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import logging
+import os
+import pathlib
+import shutil
+import time
+
+import configuration
+
+from i18n import _
+
+from . import PCLOS, integrity, resolver, transfer
+
+log = logging.getLogger("lomanager2_logger")
+
+# Before LibreOffice is removed its packages are kept in
+# configuration.rollback_dir/<version>/ so that it can be reinstalled
+# without network if the new version fails to install.
+# Original archives are kept if they are still on this machine in
+# a directory only root can modify (hardlinked - no copying), otherwise
+# installed packages are re-packaged from the rpm database (needs
+# rpmrebuild). Checksums of kept files are recorded and checked
+# before the files are installed.
+rollback_info_name = "rollback.json"
+
+
+def archive_names(version: str, languages: list) -> tuple[list, list]:
+    """Names of upstream archives of LibreOffice version (core, langs)"""
+    minor_ver = configuration.make_minor_ver(version)
+    core = [f"LibreOffice_{minor_ver}_Linux_x86-64_rpm.tar.gz"]
+    langs = []
+    for lang_code in languages:
+        if lang_code == "en-US":
+            continue
+        langs.append(
+            f"LibreOffice_{minor_ver}_Linux_x86-64_rpm_langpack_{lang_code}.tar.gz"
+        )
+        if lang_code in configuration.existing_helppacks:
+            langs.append(
+                f"LibreOffice_{minor_ver}_Linux_x86-64_rpm_helppack_{lang_code}.tar.gz"
+            )
+    return (core, langs)
+
+
+def _installed_rpm_names(version: str) -> list[str]:
+    base_version = configuration.make_base_ver(version)
+    status, output = PCLOS.run_shell_command(
+        "rpm -qa --qf '%{NAME}\\n'", timeout=60, fail_on_error=True
+    )
+    if not status:
+        return []
+    prefixes = (f"libreoffice{base_version}", f"libobasis{base_version}")
+    return [name for name in output.splitlines() if name.startswith(prefixes)]
+
+
+def _repackage_installed(version: str, target_dir: pathlib.Path) -> tuple[bool, str]:
+    if shutil.which("rpmrebuild") is None:
+        return (False, _("rpmrebuild is not available"))
+    rpm_names = _installed_rpm_names(version)
+    if not rpm_names:
+        return (False, _("No installed packages of LibreOffice {}").format(version))
+    for rpm_name in rpm_names:
+        status, output = PCLOS.run_shell_command(
+            f"rpmrebuild --batch --directory={target_dir} {rpm_name}",
+            timeout=600,
+            fail_on_error=True,
+        )
+        if not status:
+            return (False, output)
+    # rpmrebuild puts packages in <arch> subdirectories
+    for rpm in list(target_dir.glob("*/*.rpm")):
+        rpm.replace(target_dir.joinpath(rpm.name))
+    return (True, "")
+
+
+def save(version: str, languages: list, progress_reporter=None) -> tuple[bool, str]:
+    """Keeps packages of installed LibreOffice version for rollback"""
+    target_dir = configuration.rollback_dir.joinpath(version)
+    partial_dir = target_dir.with_name(target_dir.name + ".part")
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    os.makedirs(partial_dir)
+
+    core_names, lang_names = archive_names(version, languages)
+    archives = {
+        name: resolver.root_only_local_path({"name": name})
+        for name in core_names + lang_names
+    }
+    info = {
+        "version": version,
+        "languages": sorted(languages),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "core_archives": [],
+        "lang_archives": [],
+        "rpms": [],
+        "sha256": {},
+    }
+    if all(path is not None for path in archives.values()):
+        for name, path in archives.items():
+            is_linked, msg = transfer.transfer_file(
+                path, partial_dir.joinpath(name), progress_reporter, keep_source=True
+            )
+            if not is_linked:
+                shutil.rmtree(partial_dir, ignore_errors=True)
+                return (False, msg)
+        info["core_archives"] = core_names
+        info["lang_archives"] = lang_names
+    else:
+        log.debug(
+            _("Archives of LibreOffice {} not found, re-packaging").format(version)
+        )
+        is_repackaged, msg = _repackage_installed(version, partial_dir)
+        if not is_repackaged:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            return (False, msg)
+        info["rpms"] = sorted(rpm.name for rpm in partial_dir.glob("*.rpm"))
+
+    try:
+        kept_files = [
+            partial_dir.joinpath(name)
+            for name in info["core_archives"] + info["lang_archives"] + info["rpms"]
+        ]
+        info["sha256"] = {
+            path.name: digest
+            for path, digest in integrity.hash_files(kept_files).items()
+        }
+        with open(partial_dir.joinpath(rollback_info_name), "w") as f:
+            json.dump(info, f, indent=2)
+        shutil.rmtree(target_dir, ignore_errors=True)
+        os.replace(partial_dir, target_dir)
+    except OSError as error:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        return (False, str(error))
+    log.info(_("LibreOffice {} kept for rollback in {}").format(version, target_dir))
+    prune(configuration.rollback_max_versions)
+    return (True, "")
+
+
+def _saved() -> list[dict]:
+    # Infos of saved versions, newest first
+    infos = []
+    if not configuration.rollback_dir.is_dir():
+        return infos
+    for item in configuration.rollback_dir.iterdir():
+        try:
+            with open(item.joinpath(rollback_info_name), "r") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            continue
+        info["dir"] = str(item)
+        infos.append(info)
+    return sorted(infos, key=lambda info: info["created"], reverse=True)
+
+
+def latest() -> dict | None:
+    """Info of the most recently saved version (None if there is none)"""
+    infos = _saved()
+    return infos[0] if infos else None
+
+
+def files(info: dict) -> tuple[list, list, list]:
+    """Absolute paths of (core archives, language archives, rpms)"""
+    saved_dir = pathlib.Path(info["dir"])
+    return tuple(
+        [saved_dir.joinpath(name) for name in info[key]]
+        for key in ["core_archives", "lang_archives", "rpms"]
+    )
+
+
+def verify(info: dict, progress_reporter=None) -> tuple[bool, str]:
+    """Checks that kept files are the same as when they were saved"""
+    saved_dir = pathlib.Path(info["dir"])
+    checksums = info.get("sha256", {})
+    names = info["core_archives"] + info["lang_archives"] + info["rpms"]
+    if not names or any(name not in checksums for name in names):
+        return (False, _("Checksums of kept files are missing"))
+    return integrity.verify_files(
+        {saved_dir.joinpath(name): checksums[name] for name in names},
+        progress_reporter,
+    )
+
+
+def prune(max_versions: int):
+    """Removes all but max_versions most recently saved versions"""
+    for info in _saved()[max_versions:]:
+        log.debug(_("Removing rollback copy of LibreOffice {}").format(info["version"]))
+        shutil.rmtree(info["dir"], ignore_errors=True)
+    # Leftovers of interrupted saves
+    if configuration.rollback_dir.is_dir():
+        for item in configuration.rollback_dir.glob("*.part"):
+            shutil.rmtree(item, ignore_errors=True)
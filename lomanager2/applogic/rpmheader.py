@@ -0,0 +1,321 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import pathlib
+import struct
+
+from i18n import _
+
+log = logging.getLogger("lomanager2_logger")
+
+# An .rpm file is laid out as follows:
+#   lead (96 bytes, obsolete but still present)
+#   signature header (padded to a multiple of 8 bytes)
+#   main header
+#   payload (compressed cpio archive)
+# Both headers share the same structure:
+#   magic (3 bytes) + version (1 byte) + reserved (4 bytes)
+#   number of index entries (4 bytes, big-endian)
+#   size of the data store (4 bytes, big-endian)
+#   index entries, 16 bytes each: tag, type, offset, count
+#   data store
+LEAD_MAGIC = b"\xed\xab\xee\xdb"
+LEAD_SIZE = 96
+HEADER_MAGIC = b"\x8e\xad\xe8"
+HEADER_INTRO_SIZE = 16
+INDEX_ENTRY_SIZE = 16
+
+# Data types of the header entries
+RPM_NULL_TYPE = 0
+RPM_CHAR_TYPE = 1
+RPM_INT8_TYPE = 2
+RPM_INT16_TYPE = 3
+RPM_INT32_TYPE = 4
+RPM_INT64_TYPE = 5
+RPM_STRING_TYPE = 6
+RPM_BIN_TYPE = 7
+RPM_STRING_ARRAY_TYPE = 8
+RPM_I18NSTRING_TYPE = 9
+
+# Main header tags
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPMTAG_SIZE = 1009
+RPMTAG_ARCH = 1022
+RPMTAG_PROVIDENAME = 1047
+RPMTAG_REQUIRENAME = 1049
+RPMTAG_LONGSIZE = 5009
+RPMTAG_PAYLOADDIGEST = 5092
+RPMTAG_PAYLOADDIGESTALGO = 5093
+
+# Signature header tags
+RPMSIGTAG_SIZE = 1000
+RPMSIGTAG_MD5 = 1004
+RPMSIGTAG_SHA256 = 273
+
+# Hash algorithm identifiers used by PAYLOADDIGESTALGO (OpenPGP numbering)
+digest_algorithms = {
+    1: "md5",
+    2: "sha1",
+    8: "sha256",
+    9: "sha384",
+    10: "sha512",
+}
+
+
+class RpmHeader:
+    """Package metadata read straight from an .rpm file
+
+    Attributes
+    ----------
+    path : pathlib.Path
+    name : str
+    version : str
+    release : str
+    epoch : int | None
+    arch : str
+    installed_size : int
+        Size in bytes of the files the package installs
+    payload_digest : str
+        Hex digest of the compressed payload ("" if not recorded)
+    payload_digest_algo : str
+        Name of hashlib algorithm used to compute payload_digest
+    requires : list[str]
+    provides : list[str]
+    header_digest : str
+        Hex SHA256 digest of the main header taken from the signature
+    payload_offset : int
+        Offset in the file at which the compressed payload starts
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.name = ""
+        self.version = ""
+        self.release = ""
+        self.epoch = None
+        self.arch = ""
+        self.installed_size = 0
+        self.payload_digest = ""
+        self.payload_digest_algo = ""
+        self.requires = []
+        self.provides = []
+        self.header_digest = ""
+        self.payload_offset = 0
+
+    @property
+    def full_name(self) -> str:
+        # The same string that 'rpm -q' would print eg.
+        # java-sun-16-2pclos2021.x86_64
+        return f"{self.name}-{self.version}-{self.release}.{self.arch}"
+
+    def __str__(self) -> str:
+        return self.full_name
+
+
+def _read_entry(store: bytes, data_type: int, offset: int, count: int):
+    if data_type in (RPM_STRING_TYPE, RPM_I18NSTRING_TYPE, RPM_STRING_ARRAY_TYPE):
+        # count tells how many NUL terminated strings follow
+        # (for STRING type count is always 1)
+        strings = []
+        for _i in range(count if data_type != RPM_STRING_TYPE else 1):
+            end = store.index(b"\x00", offset)
+            strings.append(store[offset:end].decode("utf-8", "replace"))
+            offset = end + 1
+        return strings if data_type == RPM_STRING_ARRAY_TYPE else strings[0]
+    if data_type == RPM_INT16_TYPE:
+        return list(struct.unpack_from(f">{count}H", store, offset))
+    if data_type == RPM_INT32_TYPE:
+        return list(struct.unpack_from(f">{count}I", store, offset))
+    if data_type == RPM_INT64_TYPE:
+        return list(struct.unpack_from(f">{count}Q", store, offset))
+    if data_type in (RPM_CHAR_TYPE, RPM_INT8_TYPE, RPM_BIN_TYPE):
+        return bytes(store[offset : offset + count])
+    return None
+
+
+def _read_header_structure(buf, start: int, wanted_tags: set) -> tuple[dict, int]:
+    """Reads index of a header starting at start offset
+
+    Only values of the tags listed in wanted_tags are decoded.
+
+    Returns
+    -------
+    tuple[dict, int]
+      tag -> value mapping, offset of the first byte after the header
+    """
+    intro = buf[start : start + HEADER_INTRO_SIZE]
+    if len(intro) != HEADER_INTRO_SIZE or intro[:3] != HEADER_MAGIC:
+        raise ValueError(_("bad header magic at offset {}").format(start))
+    n_entries, store_size = struct.unpack(">II", intro[8:16])
+    index_start = start + HEADER_INTRO_SIZE
+    store_start = index_start + n_entries * INDEX_ENTRY_SIZE
+    end = store_start + store_size
+    if end > len(buf):
+        raise ValueError(_("header exceeds file size"))
+
+    store = buf[store_start:end]
+    values = {}
+    for n in range(n_entries):
+        tag, data_type, offset, count = struct.unpack_from(
+            ">iIiI", buf, index_start + n * INDEX_ENTRY_SIZE
+        )
+        if tag in wanted_tags:
+            values[tag] = _read_entry(store, data_type, offset, count)
+    return (values, end)
+
+
+def _parse_rpm_header(buf, rpm_path: pathlib.Path) -> RpmHeader:
+    if buf[:4] != LEAD_MAGIC:
+        raise ValueError(_("not an rpm file (bad lead magic)"))
+
+    signature, sig_end = _read_header_structure(buf, LEAD_SIZE, {RPMSIGTAG_SHA256})
+    # signature header is padded to 8 byte boundary
+    main_start = sig_end + (8 - sig_end % 8) % 8
+    tags, main_end = _read_header_structure(
+        buf,
+        main_start,
+        {
+            RPMTAG_NAME,
+            RPMTAG_VERSION,
+            RPMTAG_RELEASE,
+            RPMTAG_EPOCH,
+            RPMTAG_SIZE,
+            RPMTAG_LONGSIZE,
+            RPMTAG_ARCH,
+            RPMTAG_PROVIDENAME,
+            RPMTAG_REQUIRENAME,
+            RPMTAG_PAYLOADDIGEST,
+            RPMTAG_PAYLOADDIGESTALGO,
+        },
+    )
+
+    header = RpmHeader(pathlib.Path(rpm_path))
+    header.name = tags.get(RPMTAG_NAME, "")
+    header.version = tags.get(RPMTAG_VERSION, "")
+    header.release = tags.get(RPMTAG_RELEASE, "")
+    header.epoch = tags[RPMTAG_EPOCH][0] if RPMTAG_EPOCH in tags else None
+    header.arch = tags.get(RPMTAG_ARCH, "")
+    # Packages with more then 4 GiB of content carry LONGSIZE instead of SIZE
+    if RPMTAG_LONGSIZE in tags:
+        header.installed_size = tags[RPMTAG_LONGSIZE][0]
+    elif RPMTAG_SIZE in tags:
+        header.installed_size = tags[RPMTAG_SIZE][0]
+    header.requires = tags.get(RPMTAG_REQUIRENAME, [])
+    header.provides = tags.get(RPMTAG_PROVIDENAME, [])
+    if RPMTAG_PAYLOADDIGEST in tags:
+        header.payload_digest = tags[RPMTAG_PAYLOADDIGEST][0]
+        # SHA256 is the default when algorithm is not stated explicitly
+        algo_id = tags.get(RPMTAG_PAYLOADDIGESTALGO, [8])[0]
+        header.payload_digest_algo = digest_algorithms.get(algo_id, "")
+    header.header_digest = signature.get(RPMSIGTAG_SHA256, "")
+    header.payload_offset = main_end
+
+    if not header.name:
+        raise ValueError(_("no package name in rpm header"))
+    return header
+
+
+def read_rpm_header(rpm_path: pathlib.Path) -> RpmHeader | None:
+    """Reads package metadata from the lead and headers of an .rpm file
+
+    The file is memory mapped so only the pages holding headers are
+    actually read from disk, the payload is never touched.
+
+    Parameters
+    ----------
+    rpm_path : pathlib.Path
+
+    Returns
+    -------
+    RpmHeader | None
+      Metadata of the package or None if the file is not a valid rpm
+    """
+
+    try:
+        with open(rpm_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                header = _parse_rpm_header(buf, rpm_path)
+    except (OSError, ValueError, IndexError, struct.error) as error:
+        log.error(_("Could not read rpm header of {}: {}").format(rpm_path, error))
+        return None
+    log.debug(_("Read rpm header: {} ({})").format(header, rpm_path))
+    return header
+
+
+def read_rpm_header_from_bytes(
+    data: bytes, rpm_path: pathlib.Path
+) -> RpmHeader | None:
+    """Reads package metadata from the beginning of an rpm file held in memory
+
+    Meant for rpm files that are not on disk (eg. members of an archive).
+    data must contain at least the lead and both headers,
+    None is returned if it is too short.
+    """
+    try:
+        return _parse_rpm_header(data, rpm_path)
+    except (ValueError, IndexError, struct.error) as error:
+        log.debug(_("Could not read rpm header of {}: {}").format(rpm_path, error))
+        return None
+
+
+def read_rpm_headers(rpm_paths: list) -> dict:
+    """Reads headers of many rpm files skipping those that can't be read
+
+    Returns
+    -------
+    dict
+      rpm path -> RpmHeader mapping
+    """
+    headers = {}
+    for rpm_path in rpm_paths:
+        if (header := read_rpm_header(rpm_path)) is not None:
+            headers[rpm_path] = header
+    return headers
+
+
+def verify_payload(rpm_path: pathlib.Path, expected_size: int) -> bool:
+    """Checks an rpm downloaded from upstream for which no checksum is published
+
+    File size has to match the size reported by the upstream server
+    and the payload has to match the digest recorded in the rpm header.
+    This only detects damaged or truncated files - anyone can build
+    an rpm with a matching digest, so files from other sources
+    (eg. peers) can't be trusted because of it.
+    """
+    if expected_size == 0 or os.path.getsize(rpm_path) != expected_size:
+        log.warning(_("Size of {} does not match upstream").format(rpm_path.name))
+        return False
+    header = read_rpm_header(rpm_path)
+    if header is None or not header.payload_digest or not header.payload_digest_algo:
+        log.warning(_("No payload digest in {}").format(rpm_path.name))
+        return False
+    payload_hash = hashlib.new(header.payload_digest_algo)
+    with open(rpm_path, "rb") as f:
+        f.seek(header.payload_offset)
+        while chunk := f.read(4 * 1024**2):
+            payload_hash.update(chunk)
+    if payload_hash.hexdigest() != header.payload_digest:
+        log.warning(_("Payload digest mismatch in {}").format(rpm_path.name))
+        return False
+    return True
@@ -0,0 +1,173 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable
+
+import configuration
+
+from i18n import _
+
+log = logging.getLogger("lomanager2_logger")
+
+# Resources operations can't share (each is held by one operation at a time)
+RPMDB = "rpmdb"  # package transactions
+NETWORK = "network"
+DISK = "disk"  # moving or copying large amounts of data
+HOME = "home"  # files in users' home directories
+
+
+class Operation:
+    """A node of the graph of operations run by run_operations
+
+    Parameters
+    ----------
+    name : str
+      unique name (also used as journal step name)
+
+    description : str
+      shown to the user when the operation starts
+
+    run : Callable | None
+      function without arguments returning tuple[bool, str]
+      (T/F success, failure description), None - nothing to do
+
+    after : list[str]
+      names of operations that have to be finished first
+
+    resources : list[str]
+      resources held while the operation runs
+
+    skip_msg : str
+      shown if the operation has nothing to do
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        run: Callable | None = None,
+        after: list[str] | None = None,
+        resources: list[str] | None = None,
+        skip_msg: str = "",
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.run = run
+        self.after = after or []
+        self.resources = resources or []
+        self.skip_msg = skip_msg
+
+
+def run_operations(
+    operations: list[Operation],
+    progress_reporter,
+    on_done: Callable | None = None,
+    max_workers: int | None = None,
+) -> tuple[bool, str, str]:
+    """Runs operations respecting their order and resources
+
+    Operations whose predecessors are finished and whose resources are
+    free run at the same time. Every operation is reported as a step of
+    progress_reporter, all step reporting happens in the calling thread.
+    After a failure no more operations are started, the ones running
+    are let finish.
+
+    Parameters
+    ----------
+    operations : list[Operation]
+      operations in the preferred order of starting them
+
+    progress_reporter : Callable
+
+    on_done : Callable | None
+      called (in the calling thread) with the name of every operation
+      that ran successfully
+
+    max_workers : int | None
+      number of operations run at the same time
+      (configuration.operation_workers if None)
+
+    Returns
+    -------
+    tuple[bool, str, str]
+      T/F all operations succeeded, name of the failed operation,
+      failure description
+    """
+    if max_workers is None:
+        max_workers = configuration.operation_workers
+    names = {op.name for op in operations}
+    for op in operations:
+        if unknown := [name for name in op.after if name not in names]:
+            raise ValueError(f"{op.name} runs after unknown operations {unknown}")
+
+    pending = list(operations)
+    finished = set()
+    busy_resources = set()
+    running = {}  # future -> operation
+    failure = None
+
+    def is_ready(op: Operation) -> bool:
+        return all(name in finished for name in op.after)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if failure is None:
+                started = True
+                while started:
+                    started = False
+                    for op in [op for op in pending if is_ready(op)]:
+                        if op.run is None:
+                            progress_reporter.step_skip(op.skip_msg)
+                            pending.remove(op)
+                            finished.add(op.name)
+                            started = True
+                        elif not busy_resources & set(op.resources):
+                            if len(running) >= max_workers:
+                                break
+                            progress_reporter.step_start(op.description)
+                            busy_resources.update(op.resources)
+                            running[executor.submit(op.run)] = op
+                            pending.remove(op)
+                            started = True
+            if not running:
+                if pending and failure is None:
+                    stuck = [op.name for op in pending]
+                    raise ValueError(f"Operations can't be ordered: {stuck}")
+                break
+            done, _not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                op = running.pop(future)
+                busy_resources.difference_update(op.resources)
+                try:
+                    is_successful, msg = future.result()
+                except Exception as error:
+                    log.exception(_("Operation {} raised an exception").format(op.name))
+                    is_successful, msg = (False, str(error))
+                if is_successful:
+                    finished.add(op.name)
+                    progress_reporter.step_end(
+                        _("... done ") + op.description[:1].lower() + op.description[1:]
+                    )
+                    if on_done is not None:
+                        on_done(op.name)
+                elif failure is None:
+                    failure = (op.name, msg)
+    if failure is not None:
+        return (False, *failure)
+    return (True, "", "")
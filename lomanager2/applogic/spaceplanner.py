@@ -0,0 +1,165 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import pathlib
+import shutil
+import struct
+import tarfile
+
+from i18n import _
+
+from . import rpmheader
+
+log = logging.getLogger("lomanager2_logger")
+
+# When nothing better is known the size of installed files is assumed
+# to be this many times the size of the (compressed) rpm packages.
+installed_size_ratio = 3
+# How many bytes from the beginning of an rpm are enough to hold headers
+# (LibreOffice rpms listing thousands of files have the largest headers)
+rpm_header_read_limit = 4 * 1024**2
+
+
+def get_size_string(bytes_size: int) -> str:
+    if bytes_size / (1024**3) < 1:
+        if bytes_size / (1024**2) < 1:
+            if bytes_size / 1024 < 1:
+                return str(bytes_size) + " bytes"
+            else:
+                return str(round(bytes_size / (1024**1))) + " KiB"
+        else:
+            return str(round(bytes_size / (1024**2))) + " MiB"
+    else:
+        return str(round(bytes_size / (1024**3))) + " GiB"
+
+
+def existing_ancestor(path: pathlib.Path) -> pathlib.Path:
+    """Returns path or its closest parent that exists"""
+    path = pathlib.Path(path)
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def filesystem_id(path: pathlib.Path) -> int:
+    """Identifies the filesystem that holds (or will hold) path"""
+    return os.stat(existing_ancestor(path)).st_dev
+
+
+def gzip_unpacked_size(archive_path: pathlib.Path) -> int:
+    """Reads size of uncompressed data from gzip trailer (ISIZE field)
+
+    The trailer stores the size modulo 2^32 which is exact
+    for LibreOffice archives (all well below 4 GiB).
+    """
+    with open(archive_path, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack("<I", f.read(4))[0]
+
+
+def archive_rpm_sizes(archive_path: pathlib.Path) -> tuple[int, int]:
+    """Checks how much space unpacking and installing archived rpms takes
+
+    The archive is read sequentially (once) and only the beginning
+    of every rpm member is looked at to get its installed size from
+    the rpm header.
+
+    Returns
+    -------
+    tuple[int, int]
+      total size of the unpacked members, total installed size of the rpms
+    """
+    unpacked_size = 0
+    installed_size = 0
+    with tarfile.open(archive_path, mode="r|gz") as targz:
+        for member in targz:
+            if not member.isfile():
+                continue
+            unpacked_size += member.size
+            if member.name.endswith(".rpm"):
+                data = targz.extractfile(member).read(rpm_header_read_limit)
+                header = rpmheader.read_rpm_header_from_bytes(data, member.name)
+                if header is not None:
+                    installed_size += header.installed_size
+                else:
+                    installed_size += member.size * installed_size_ratio
+    return (unpacked_size, installed_size)
+
+
+class SpacePlan:
+    """Simulates disk usage of a procedure to find its peak per filesystem
+
+    Operations the procedure is going to perform are replayed in order
+    with allocate/release/move calls. For every filesystem touched the
+    highest amount of additional space occupied at any point is recorded
+    and can be compared with free space before anything is done.
+    """
+
+    def __init__(self) -> None:
+        self._usage = {}  # filesystem -> bytes currently occupied by the plan
+        self._peak = {}  # filesystem -> max. bytes occupied by the plan
+        self._example_dir = {}  # filesystem -> a directory on it (for reports)
+
+    def allocate(self, directory: pathlib.Path, nbytes: int, label: str = ""):
+        fs = filesystem_id(directory)
+        self._example_dir.setdefault(fs, existing_ancestor(directory))
+        self._usage[fs] = self._usage.get(fs, 0) + nbytes
+        self._peak[fs] = max(self._peak.get(fs, 0), self._usage[fs])
+        if label:
+            log.debug(
+                _("Space plan: {} needs {} in {}").format(
+                    label, get_size_string(nbytes), directory
+                )
+            )
+
+    def release(self, directory: pathlib.Path, nbytes: int):
+        fs = filesystem_id(directory)
+        self._usage[fs] = self._usage.get(fs, 0) - nbytes
+
+    def move(self, from_dir: pathlib.Path, to_dir: pathlib.Path, nbytes: int):
+        # Within the same filesystem moving is just renaming,
+        # otherwise data is copied first and only then source is removed
+        if filesystem_id(from_dir) != filesystem_id(to_dir):
+            self.allocate(to_dir, nbytes)
+            self.release(from_dir, nbytes)
+
+    def check(self) -> tuple[bool, list[str]]:
+        """Compares peak usage with free space on every filesystem
+
+        Returns
+        -------
+        tuple[bool, list[str]]
+          T/F - enough space everywhere, description of every shortage
+        """
+        shortages = []
+        for fs, peak in self._peak.items():
+            directory = self._example_dir[fs]
+            available = int(shutil.disk_usage(directory).free)
+            log.debug(
+                _("Space plan: {} needed in {}, available {}").format(
+                    get_size_string(peak), directory, get_size_string(available)
+                )
+            )
+            if peak >= available:
+                shortages.append(
+                    _("{}: needed {}, available {}").format(
+                        directory, get_size_string(peak), get_size_string(available)
+                    )
+                )
+        return (not shortages, shortages)
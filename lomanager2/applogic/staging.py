@@ -0,0 +1,154 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import pathlib
+import shutil
+
+import configuration
+
+from i18n import _
+
+from . import PCLOS
+from .spaceplanner import existing_ancestor, get_size_string
+
+log = logging.getLogger("lomanager2_logger")
+
+# Filesystems keeping their content in memory
+ram_backed_fs_types = ["tmpfs", "ramfs"]
+# Filesystems that in live session write changes to memory
+union_fs_types = ["overlay", "aufs", "unionfs"]
+
+
+def read_mounts() -> list[tuple[str, str]]:
+    """Returns (mount point, filesystem type) of every mounted filesystem"""
+    mounts = []
+    try:
+        with open("/proc/self/mounts", "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3:
+                    # spaces in mount points are escaped as \040
+                    mounts.append((fields[1].replace("\\040", " "), fields[2]))
+    except OSError as error:
+        log.error(_("Could not read mounted filesystems: {}").format(error))
+    return mounts
+
+
+def filesystem_type(path: pathlib.Path, mounts: list[tuple[str, str]]) -> str:
+    """Finds the type of filesystem holding path (longest mount point match)"""
+    path = existing_ancestor(path).resolve()
+    best_mount_point, best_type = "", ""
+    for mount_point, fs_type in mounts:
+        if path.is_relative_to(mount_point) and len(mount_point) >= len(
+            best_mount_point
+        ):
+            best_mount_point, best_type = mount_point, fs_type
+    return best_type
+
+
+def available_ram() -> int:
+    """Returns memory available for new allocations in bytes (MemAvailable)"""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError) as error:
+        log.error(_("Could not read available memory: {}").format(error))
+    return 0
+
+
+def choose_staging_dir(needed_bytes: int, target_dir: pathlib.Path) -> pathlib.Path:
+    """Picks the directory for downloaded and extracted files
+
+    Every directory listed in configuration.staging_parent_dirs is
+    considered and the best one is chosen in the following order:
+      1) disk based filesystem that also holds target_dir
+         (moving files to target_dir is then just renaming),
+      2) any other disk based filesystem,
+      3) RAM backed filesystem (tmpfs or live session's union filesystem)
+         but only if after staging enough memory is left,
+    always provided there is enough free space for needed_bytes.
+    Directories of the same rank are taken in the configured order.
+    If no directory qualifies the default configuration.temporary_dir
+    is returned.
+
+    Parameters
+    ----------
+    needed_bytes : int
+      Expected size of all files that will be staged
+
+    target_dir : pathlib.Path
+      Directory to which staged files are moved in the end
+
+    Returns
+    -------
+    pathlib.Path
+      temporary directory to use
+    """
+    mounts = read_mounts()
+    is_live = PCLOS.is_live_session_active()
+    target_fs = os.stat(existing_ancestor(target_dir)).st_dev
+    ram_left_after = available_ram() - needed_bytes
+
+    candidates = []
+    for preference, parent_dir in enumerate(configuration.staging_parent_dirs):
+        if not parent_dir.is_dir() or not os.access(parent_dir, os.W_OK):
+            continue
+        fs_type = filesystem_type(parent_dir, mounts)
+        free_space = int(shutil.disk_usage(parent_dir).free)
+        is_in_ram = fs_type in ram_backed_fs_types or (
+            is_live and fs_type in union_fs_types
+        )
+        log.debug(
+            _("Staging candidate {} ({}): free {}, in RAM: {}").format(
+                parent_dir, fs_type, get_size_string(free_space), is_in_ram
+            )
+        )
+        if free_space <= needed_bytes:
+            continue
+        if is_in_ram:
+            if ram_left_after < configuration.staging_ram_reserve:
+                continue
+            rank = 3
+        elif os.stat(parent_dir).st_dev == target_fs:
+            rank = 1
+        else:
+            rank = 2
+        candidates.append((rank, preference, parent_dir, fs_type))
+
+    if not candidates:
+        log.warning(
+            _("No suitable staging location found, using default {}").format(
+                configuration.temporary_dir
+            )
+        )
+        return configuration.temporary_dir
+
+    rank, _preference, parent_dir, fs_type = sorted(candidates)[0]
+    staging_dir = parent_dir.joinpath(configuration.temporary_dir.name)
+    reasons = {
+        1: _("same filesystem as {}").format(target_dir),
+        2: _("disk based filesystem"),
+        3: _("RAM backed filesystem with enough memory left"),
+    }
+    log.info(
+        _("Staging files in {} ({}, {})").format(staging_dir, fs_type, reasons[rank])
+    )
+    return staging_dir
@@ -0,0 +1,210 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import errno
+import fcntl
+import logging
+import os
+import pathlib
+import shutil
+from typing import Callable
+
+from i18n import _
+
+log = logging.getLogger("lomanager2_logger")
+
+# ioctl request cloning whole file (reflink) on btrfs, xfs, etc.
+FICLONE = 0x40049409
+# Copy in chunks this big so that progress can be reported in between
+chunk_size = 64 * 1024**2
+
+# errno values meaning "this way of copying is not possible here, try another"
+_unsupported = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF}
+
+
+def _try_reflink(src_fd: int, dst_fd: int) -> bool:
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError:
+        return False
+
+
+def _copy_in_kernel(
+    src_fd: int, dst_fd: int, size: int, report: Callable, use_sendfile: bool
+):
+    # Data never leaves kernel space with either of the system calls
+    copied = 0
+    while copied < size:
+        count = min(chunk_size, size - copied)
+        if use_sendfile:
+            n = os.sendfile(dst_fd, src_fd, copied, count)
+        else:
+            n = os.copy_file_range(src_fd, dst_fd, count, copied, copied)
+        if n == 0:
+            break
+        copied += n
+        report(copied)
+    if copied != size:
+        raise OSError(errno.EIO, _("copied {} of {} bytes").format(copied, size))
+
+
+def _copy_data(src: pathlib.Path, dst: pathlib.Path, progress_reporter) -> str:
+    """Copies file content picking the cheapest method available
+
+    Returns
+    -------
+    str
+      name of the method used
+    """
+    size = src.stat().st_size
+
+    def report(copied):
+        if progress_reporter is not None and size:
+            progress_reporter.progress(int(100 * copied / size))
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        if _try_reflink(src_fd, dst_fd):
+            report(size)
+            return "reflink"
+        for method, use_sendfile in (("copy_file_range", False), ("sendfile", True)):
+            try:
+                _copy_in_kernel(src_fd, dst_fd, size, report, use_sendfile)
+                return method
+            except OSError as error:
+                if error.errno not in _unsupported:
+                    raise
+                # Start over with the next method
+                # (sendfile moves the destination file offset)
+                os.ftruncate(dst_fd, 0)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                fsrc.seek(0)
+        shutil.copyfileobj(fsrc, fdst, chunk_size)
+        report(size)
+        return "read/write"
+
+
+def transfer_file(
+    from_path: pathlib.Path,
+    to_path: pathlib.Path,
+    progress_reporter=None,
+    keep_source: bool = False,
+) -> tuple[bool, str]:
+    """Moves (or copies) a file using the cheapest way possible
+
+    Within one filesystem the file is renamed (moved) or hardlinked
+    (keep_source=True) so no data is copied at all. Between filesystems
+    the content is reflinked if the filesystem supports it, otherwise
+    copied in kernel with copy_file_range or sendfile, and as the last
+    resort with ordinary reads and writes. Copying reports progress
+    through progress_reporter. Copy is written under a temporary name
+    and renamed when complete so a partial file never appears at to_path.
+
+    Parameters
+    ----------
+    from_path : pathlib.Path
+
+    to_path : pathlib.Path
+      destination file path or existing directory to put the file into
+
+    progress_reporter : Callable | None
+      used to report copying progress (if not None)
+
+    keep_source : bool
+      leave the source file in place (copy instead of move)
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F - success/failure, error description (empty on success)
+    """
+    from_path = pathlib.Path(from_path)
+    to_path = pathlib.Path(to_path)
+    if to_path.is_dir():
+        to_path = to_path.joinpath(from_path.name)
+
+    try:
+        if keep_source:
+            if to_path.exists():
+                os.remove(to_path)
+            os.link(from_path, to_path)
+            log.debug(_("Hardlinked {} to {}").format(from_path, to_path))
+        else:
+            os.rename(from_path, to_path)
+            log.debug(_("Renamed {} to {}").format(from_path, to_path))
+        return (True, "")
+    except OSError as error:
+        if error.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            msg = _("Error when moving {} to {}: ").format(from_path, to_path)
+            log.error(msg + str(error))
+            return (False, msg + str(error))
+
+    # Different filesystems - data has to be copied
+    partial_path = to_path.with_name(to_path.name + ".part")
+    try:
+        if progress_reporter is not None:
+            progress_reporter.progress_msg(_("Copying: {}").format(from_path.name))
+        method = _copy_data(from_path, partial_path, progress_reporter)
+        shutil.copystat(from_path, partial_path)
+        os.replace(partial_path, to_path)
+        if not keep_source:
+            os.remove(from_path)
+    except OSError as error:
+        msg = _("Error when copying {} to {}: ").format(from_path, to_path)
+        log.error(msg + str(error))
+        if partial_path.exists():
+            os.remove(partial_path)
+        return (False, msg + str(error))
+    log.debug(_("Copied {} to {} ({})").format(from_path, to_path, method))
+    return (True, "")
+
+
+def transfer_dir(
+    from_path: pathlib.Path,
+    to_path: pathlib.Path,
+    progress_reporter=None,
+) -> tuple[bool, str]:
+    """Moves a directory tree renaming it if possible, file by file otherwise
+
+    to_path must not exist.
+    """
+    try:
+        os.rename(from_path, to_path)
+        log.debug(_("Renamed {} to {}").format(from_path, to_path))
+        return (True, "")
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            msg = _("Error when moving {} to {}: ").format(from_path, to_path)
+            log.error(msg + str(error))
+            return (False, msg + str(error))
+
+    for dir_path, _dir_names, file_names in os.walk(from_path):
+        target_dir = pathlib.Path(to_path).joinpath(
+            pathlib.Path(dir_path).relative_to(from_path)
+        )
+        os.makedirs(target_dir, exist_ok=True)
+        for file_name in file_names:
+            is_moved, msg = transfer_file(
+                pathlib.Path(dir_path).joinpath(file_name),
+                target_dir.joinpath(file_name),
+                progress_reporter,
+            )
+            if not is_moved:
+                return (False, msg)
+    shutil.rmtree(from_path, ignore_errors=True)
+    return (True, "")
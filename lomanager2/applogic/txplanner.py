@@ -0,0 +1,77 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+
+from i18n import _
+
+log = logging.getLogger("lomanager2_logger")
+
+# Steps of making changes in the order they are shown to the user
+# with the kind of package transaction each of them runs.
+# Steps of the same kind can be done by a single invocation
+# of the tool (eg. one 'rpm -Uvh' for Office and Clipart).
+step_kinds = {
+    "java_install": ("apt-get", "install"),
+    "office_removal": ("apt-get", "remove"),
+    "office_install": ("rpm", "install"),
+    "clipart_removal": ("apt-get", "remove"),
+    "clipart_install": ("rpm", "install"),
+}
+# (a, b) - step a has to be finished before step b starts
+ordering = [
+    ("java_install", "office_install"),
+    ("office_removal", "office_install"),
+    ("office_removal", "clipart_install"),
+    ("clipart_removal", "clipart_install"),
+]
+
+
+def plan(steps: list[str]) -> list[list[str]]:
+    """Groups steps into as few package transactions as ordering allows
+
+    Parameters
+    ----------
+    steps : list[str]
+      names of steps to be done (keys of step_kinds), in the default order
+
+    Returns
+    -------
+    list[list[str]]
+      transactions in the order they should run, each a list of steps
+      (the first one is the step under which the transaction runs)
+    """
+    done = set()
+    transactions = []
+    remaining = [step for step in step_kinds if step in steps]
+    while remaining:
+        transaction = [remaining.pop(0)]
+        for step in list(remaining):
+            if step_kinds[step] != step_kinds[transaction[0]]:
+                continue
+            # A step may only be done earlier than usual if everything
+            # that has to precede it is done by then
+            required = {a for a, b in ordering if b == step and a in steps}
+            if required <= done:
+                transaction.append(step)
+                remaining.remove(step)
+        done.update(transaction)
+        transactions.append(transaction)
+    for transaction in transactions:
+        if len(transaction) > 1:
+            log.debug(_("Steps done in one transaction: {}").format(transaction))
+    return transactions
@@ -0,0 +1,361 @@
+"""
+Copyright (C) 2023 programB
+
+This file is part of lomanager2.
+
+lomanager2 is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License version 3
+as published by the Free Software Foundation.
+
+lomanager2 is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import pathlib
+import secrets
+import xml.parsers.expat
+
+from i18n import _
+
+log = logging.getLogger("lomanager2_logger")
+
+# Editing of LibreOffice's registrymodifications.xcu without building
+# the document tree: the file is scanned once with expat to find byte
+# offsets of the AutoCheckEnabled property (or of the end of the root
+# element if it's missing) and, only if the value has to change,
+# copied to a temporary file with just that part replaced.
+# Files are in users' home directories: they are accessed relative to
+# a descriptor of their directory (see peruser.open_user_dir), symbolic
+# links are not followed and the temporary file is created exclusively.
+update_check_path = (
+    "/org.openoffice.Office.Jobs/Jobs/"
+    "org.openoffice.Office.Jobs:Job['UpdateCheck']/Arguments"
+)
+registry_ns = "http://openoffice.org/2001/registry"
+read_size = 1024**2
+
+
+def _disabled_prop(prefix: str) -> str:
+    return (
+        f'<prop {prefix}:name="AutoCheckEnabled" {prefix}:op="fuse" '
+        f'{prefix}:type="xs:boolean"><value>false</value></prop>'
+    )
+
+
+def _disabled_item(prefix: str) -> str:
+    return (
+        f'<item {prefix}:path="{update_check_path}">'
+        + _disabled_prop(prefix)
+        + "</item>"
+    )
+
+
+def _open_nofollow(file_name: str, dir_fd: int):
+    return os.fdopen(
+        os.open(file_name, os.O_RDONLY | os.O_NOFOLLOW, dir_fd=dir_fd), "rb"
+    )
+
+
+def _create_temp(dir_fd: int) -> tuple[int, str]:
+    # New file with a random name in dir_fd (never an existing one)
+    while True:
+        temp_name = ".xcu-" + secrets.token_hex(8)
+        try:
+            fd = os.open(
+                temp_name,
+                os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW,
+                0o600,
+                dir_fd=dir_fd,
+            )
+            return (fd, temp_name)
+        except FileExistsError:
+            continue
+
+
+def _remove_temp(temp_name: str, dir_fd: int):
+    try:
+        os.remove(temp_name, dir_fd=dir_fd)
+    except FileNotFoundError:
+        pass
+
+
+def _tag_end(data: bytes) -> int:
+    # Offset just past the end of the tag data starts with
+    # (">" in quoted attribute values doesn't end it), 0 if not found
+    quote = None
+    for i, byte in enumerate(data):
+        if quote is not None:
+            if byte == quote:
+                quote = None
+        elif byte in b"\"'":
+            quote = byte
+        elif byte == ord(">"):
+            return i + 1
+    return 0
+
+
+def _read_start_tag(file_name: str, dir_fd: int, offset: int) -> bytes:
+    # Start tag of the element at offset (ends with "/>" if it's empty)
+    with _open_nofollow(file_name, dir_fd) as f:
+        f.seek(offset)
+        head = f.read(read_size)
+    tag_end = _tag_end(head)
+    if tag_end == 0:
+        raise ValueError(f"unterminated tag at {offset}")
+    return head[:tag_end]
+
+
+def _local(name: str) -> str:
+    # Name without namespace prefix
+    return name.rpartition(":")[2]
+
+
+def _scan(file_name: str, dir_fd: int) -> dict:
+    """Finds where AutoCheckEnabled property is in the file
+
+    Returns
+    -------
+    dict
+      prefix - namespace prefix used for registry attributes,
+      value - text of the property value (None if not found),
+      prop_start, prop_end_tag - byte offsets of the property element
+      root_name - name of the root element,
+      root_start - byte offset of the start tag of the root element,
+      root_end_tag - byte offset of the end tag of the root element
+      (end tags are only meaningful if the element is not empty: <e/>)
+    """
+    found = {"prefix": "oor", "value": None}
+    state = {"depth": 0, "item_path": "", "in_prop": False, "in_value": False}
+    parser = xml.parsers.expat.ParserCreate()
+
+    def start(name, attrs):
+        state["depth"] += 1
+        local_attrs = {_local(key): value for key, value in attrs.items()}
+        if state["depth"] == 1:
+            found["root_name"] = name
+            found["root_start"] = parser.CurrentByteIndex
+            for key, value in attrs.items():
+                if key.startswith("xmlns:") and value.rstrip("/").endswith(
+                    "openoffice.org/2001/registry"
+                ):
+                    found["prefix"] = key.partition(":")[2]
+        elif _local(name) == "item":
+            state["item_path"] = local_attrs.get("path", "")
+        elif (
+            _local(name) == "prop"
+            and state["item_path"] == update_check_path
+            and local_attrs.get("name") == "AutoCheckEnabled"
+        ):
+            state["in_prop"] = True
+            found["value"] = ""
+            found["prop_start"] = parser.CurrentByteIndex
+        elif _local(name) == "value" and state["in_prop"]:
+            state["in_value"] = True
+
+    def end(name):
+        if state["depth"] == 1:
+            found["root_end_tag"] = parser.CurrentByteIndex
+        elif _local(name) == "item":
+            state["item_path"] = ""
+        elif _local(name) == "prop" and state["in_prop"]:
+            state["in_prop"] = False
+            found["prop_end_tag"] = parser.CurrentByteIndex
+        elif _local(name) == "value":
+            state["in_value"] = False
+        state["depth"] -= 1
+
+    def text(data):
+        if state["in_value"]:
+            found["value"] += data
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = text
+    with _open_nofollow(file_name, dir_fd) as f:
+        while chunk := f.read(read_size):
+            parser.Parse(chunk, False)
+    parser.Parse(b"", True)
+    return found
+
+
+def _splice(
+    file_name: str, dir_fd: int, start: int, end_tag: int | None, replacement: str
+) -> None:
+    # Writes file with bytes from start to the end of the tag at end_tag
+    # replaced (inserted at start if end_tag is None) atomically,
+    # keeping owner and permissions of the file.
+    # The result has to be well-formed with update checks disabled,
+    # the file is left untouched otherwise.
+    fd, temp_name = _create_temp(dir_fd)
+    try:
+        with _open_nofollow(file_name, dir_fd) as src, os.fdopen(fd, "wb") as dest:
+            st = os.fstat(src.fileno())
+            to_copy = start
+            while to_copy > 0:
+                chunk = src.read(min(read_size, to_copy))
+                if not chunk:
+                    break
+                dest.write(chunk)
+                to_copy -= len(chunk)
+            dest.write(replacement.encode("utf-8"))
+            if end_tag is not None:
+                src.seek(end_tag)
+                tail = src.read(read_size)
+                tag_end = _tag_end(tail)
+                if tag_end == 0:
+                    raise ValueError(f"unterminated tag at {end_tag}")
+                dest.write(tail[tag_end:])
+            else:
+                src.seek(start)
+            while chunk := src.read(read_size):
+                dest.write(chunk)
+            dest.flush()
+            os.fchown(dest.fileno(), st.st_uid, st.st_gid)
+            os.fchmod(dest.fileno(), st.st_mode & 0o7777)
+            os.fsync(dest.fileno())
+        result = _scan(temp_name, dir_fd)
+        if result["value"] is None or result["value"].strip() != "false":
+            raise ValueError("update checks are not disabled in the modified file")
+        os.replace(temp_name, file_name, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+    except BaseException:
+        _remove_temp(temp_name, dir_fd)
+        raise
+
+
+def _disable_at(file_name: str, dir_fd: int) -> str:
+    found = _scan(file_name, dir_fd)
+    if found["value"] is not None and found["value"].strip() == "false":
+        return _("Already disabled")
+    if found["value"] is not None:
+        # property exists, set its value to false
+        prop_tag = _read_start_tag(file_name, dir_fd, found["prop_start"])
+        # (an empty <prop .../> ends with its start tag)
+        end_tag = (
+            found["prop_start"] if prop_tag.endswith(b"/>") else found["prop_end_tag"]
+        )
+        _splice(
+            file_name,
+            dir_fd,
+            found["prop_start"],
+            end_tag,
+            _disabled_prop(found["prefix"]),
+        )
+        return _("Disabled")
+    root_tag = _read_start_tag(file_name, dir_fd, found["root_start"])
+    if root_tag.endswith(b"/>"):
+        # empty root element (<root/>), replace it with one
+        # holding the property
+        _splice(
+            file_name,
+            dir_fd,
+            found["root_start"],
+            found["root_start"],
+            root_tag[:-2].rstrip().decode("utf-8")
+            + ">\n"
+            + _disabled_item(found["prefix"])
+            + f"\n</{found['root_name']}>",
+        )
+    else:
+        # property does not exist, add it
+        # (before the end tag of the root element, which is kept)
+        _splice(
+            file_name,
+            dir_fd,
+            found["root_end_tag"],
+            None,
+            _disabled_item(found["prefix"]) + "\n",
+        )
+    return _("Disabled")
+
+
+def disable_update_autocheck(
+    xcu_file: pathlib.Path, dir_fd: int | None = None
+) -> tuple[bool, str]:
+    """Makes sure LibreOffice's automatic update checks are disabled
+
+    The file is only rewritten if the setting is missing or enabled.
+
+    Parameters
+    ----------
+    xcu_file : pathlib.Path
+
+    dir_fd : int | None
+      descriptor of the directory xcu_file is in (the directory
+      is opened by path if None - only for directories that just root
+      can modify)
+
+    Returns
+    -------
+    tuple[bool, str]
+      T/F success, description
+    """
+    try:
+        if dir_fd is None:
+            parent_fd = os.open(xcu_file.parent, os.O_RDONLY | os.O_DIRECTORY)
+        else:
+            parent_fd = dir_fd
+        try:
+            msg = _disable_at(xcu_file.name, parent_fd)
+        finally:
+            if dir_fd is None:
+                os.close(parent_fd)
+    except (OSError, ValueError, KeyError, xml.parsers.expat.ExpatError) as error:
+        msg = _("Could not modify {}: {}").format(xcu_file, error)
+        log.warning(msg)
+        return (False, msg)
+    return (True, msg)
+
+
+def create_with_update_autocheck_disabled(
+    xcu_file: pathlib.Path,
+    dir_fd: int | None = None,
+    owner: tuple[int, int] | None = None,
+) -> None:
+    """Writes new registrymodifications.xcu containing just the setting
+
+    Parameters
+    ----------
+    xcu_file : pathlib.Path
+
+    dir_fd : int | None
+      descriptor of the directory xcu_file is in (see disable_update_autocheck)
+
+    owner : tuple[int, int] | None
+      uid, gid the file is given to (before it appears under its name)
+    """
+    content = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<oor:items xmlns:oor="{registry_ns}" '
+        'xmlns:xs="http://www.w3.org/2001/XMLSchema" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n'
+        + _disabled_item("oor")
+        + "\n</oor:items>\n"
+    )
+    if dir_fd is None:
+        parent_fd = os.open(xcu_file.parent, os.O_RDONLY | os.O_DIRECTORY)
+    else:
+        parent_fd = dir_fd
+    try:
+        fd, temp_name = _create_temp(parent_fd)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(content)
+                f.flush()
+                if owner is not None:
+                    os.fchown(f.fileno(), *owner)
+                os.fchmod(f.fileno(), 0o644)
+            os.replace(
+                temp_name, xcu_file.name, src_dir_fd=parent_fd, dst_dir_fd=parent_fd
+            )
+        except BaseException:
+            _remove_temp(temp_name, parent_fd)
+            raise
+    finally:
+        if dir_fd is None:
+            os.close(parent_fd)
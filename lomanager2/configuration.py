@@ -50,10 +50,93 @@ latest_available_clipart_version = (
 
 
 # Global read-only definitions
+# (temporary_dir and directories inside it are only changed by
+#  set_temporary_dir when a better staging location is chosen)
 temporary_dir = pathlib.Path("/tmp/lomanager2-tmp")
 working_dir = temporary_dir.joinpath("working_directory")
 verified_dir = temporary_dir.joinpath("verified_storage")
+# Locations considered for temporary_dir, the best one is picked at runtime
+# (only system directories - root owned staging of packages is not put
+#  on user-facing mounts such as /home even if they have more space)
+staging_parent_dirs = [
+    pathlib.Path("/var/tmp"),
+    pathlib.Path("/tmp"),
+    pathlib.Path("/var/cache"),
+]
+# Memory that has to remain available when staging in a RAM backed directory
+staging_ram_reserve = 1024**3
 offline_copy_dir = pathlib.Path("/tmp/lomanager2-saved_packages")
+# Number of LibreOffice versions kept in offline_copy_dir
+offline_repo_max_versions = 3
+# Names used for apt repository exported from saved packages
+# (sources.list line: rpm <repository URL> <dist> <component>)
+apt_repo_dist = "lomanager2"
+apt_repo_component = "lomanager2"
+# Local network cache: this machine serves saved packages on
+# peer_cache_port (lomanager2 --serve-cache) and, before downloading
+# from the internet, tries other machines listed in cache_peers
+# eg. ["http://192.168.1.10:8470/"]
+peer_cache_port = 8470
+cache_peers = []
+# Build new versions of big files from older local ones and ranges
+# downloaded upstream, using block maps served by cache_peers
+# (the scan of the older file is CPU heavy, hence off by default)
+delta_transfer_enabled = False
+# Persistent data that should survive reboots
+cache_dir = pathlib.Path("/var/cache/lomanager2")
+download_sizes_cache_file = cache_dir.joinpath("download_sizes.json")
+# Downloaded packages kept for later use (eg. fetched in advance)
+download_cache_dir = cache_dir.joinpath("downloads")
+# Download files of packages into download_cache_dir in the background
+# as soon as they are marked for install
+prefetch_enabled = True
+# Bandwidth limit of background downloads in bytes/s (0 - no limit)
+prefetch_rate_limit = 0
+# Size limit of download_cache_dir in bytes, the oldest files are
+# removed first (0 - no limit)
+download_cache_max_size = 4 * 1024**3
+# Unfinished downloads not continued for this long (seconds) are removed
+download_cache_part_max_age = 7 * 24 * 3600
+# Result of the last lomanager2 --prefetch run (read by the program
+# to tell the user that install will not need downloading)
+prestage_status_file = cache_dir.joinpath("prestage_status.json")
+# Rpms extracted in advance from pre-staged LibreOffice archives
+prestaged_dir = cache_dir.joinpath("prestaged")
+# Packages and plan of changes prepared to be made later
+prepared_dir = cache_dir.joinpath("prepared")
+# Journal of changes being made (to resume them if interrupted)
+journal_file = cache_dir.joinpath("journal.jsonl")
+# LibreOffice packages kept before removal (to restore it without network)
+rollback_dir = cache_dir.joinpath("rollback")
+# Number of LibreOffice versions kept in rollback_dir
+rollback_max_versions = 1
+# Where apt-get keeps downloaded rpm packages
+apt_cache_dir = pathlib.Path("/var/cache/apt/archives")
+# Checksums of verified files (only files that just root can modify)
+file_hashes_cache_file = cache_dir.joinpath("file_hashes.json")
+# Number of files verified at the same time
+verification_workers = 4
+# Number of operations of making changes run at the same time
+operation_workers = 3
+# Number of leftover files and directories removed at the same time
+cleanup_workers = 8
+# Where users whose Office settings are modified come from:
+# "home" - owners of directories in /home (fast with LDAP/SSSD etc.)
+# "passwd" - local accounts in /etc/passwd only
+# "nss" - all accounts known to the system (can be slow)
+users_source = "home"
+# Number of users whose settings are modified at the same time
+per_user_workers = 8
+# Number of users processed by a worker at once
+per_user_batch_size = 16
+
+
+def set_temporary_dir(new_temporary_dir: pathlib.Path):
+    global temporary_dir, working_dir, verified_dir
+    temporary_dir = new_temporary_dir
+    working_dir = temporary_dir.joinpath("working_directory")
+    verified_dir = temporary_dir.joinpath("verified_storage")
+
 
 # URLs
 PCLOS_repo_base_url = "https://ftp.nluug.nl/"
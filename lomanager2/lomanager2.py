@@ -18,8 +18,10 @@ along with lomanager2.  If not, see <http://www.gnu.org/licenses/>.
 import argparse
 import logging
 import os
+import sys
 from datetime import datetime
 
+import configuration
 from i18n import _
 
 parser = argparse.ArgumentParser(description=_("Run lomanager2"))
@@ -36,6 +38,64 @@ parser.add_argument(
         "system! Use at your own risk."
     ),
 )
+parser.add_argument(
+    "--export-repo",
+    metavar="DIR",
+    help=_(
+        "export saved packages as apt repository in DIR "
+        "(to be used by other machines) and exit"
+    ),
+)
+parser.add_argument(
+    "--saved-packages",
+    metavar="DIR",
+    help=_("directory with saved packages to export (default: {})").format(
+        configuration.offline_copy_dir
+    ),
+)
+parser.add_argument(
+    "--saved-version",
+    metavar="VERSION",
+    default="",
+    help=_(
+        "version of saved packages to export, '{}' for packages saved "
+        "without LibreOffice (default: newest)"
+    ).format("other"),
+)
+parser.add_argument(
+    "--install-from-repo",
+    metavar="DIR",
+    help=_(
+        "install all packages from apt repository exported by lomanager2 "
+        "(local directory only root can modify) and exit"
+    ),
+)
+parser.add_argument(
+    "--serve-cache",
+    action="store_true",
+    help=_("serve saved packages to other machines on local network"),
+)
+parser.add_argument(
+    "--port",
+    type=int,
+    help=_("port used with --serve-cache (default: {})").format(
+        configuration.peer_cache_port
+    ),
+)
+parser.add_argument(
+    "--prefetch",
+    action="store_true",
+    help=_(
+        "download, verify and extract recommended LibreOffice version "
+        "(with installed languages) for later install and exit"
+    ),
+)
+parser.add_argument(
+    "--rate-limit",
+    type=int,
+    metavar="BYTES_PER_SEC",
+    help=_("download speed limit used with --prefetch (default: no limit)"),
+)
 args = parser.parse_args()
 
 
@@ -72,7 +132,32 @@ if os.geteuid() == 0:
 
     # Run the app with chosen interface
     logger.info(_("Log started"))
-    if args.cli is True:
+    if args.export_repo:
+        from adapters import headless_adapter
+
+        sys.exit(
+            headless_adapter.export_repository(
+                args.export_repo, args.saved_packages, args.saved_version
+            )
+        )
+    elif args.install_from_repo:
+        from adapters import headless_adapter
+
+        sys.exit(
+            headless_adapter.install_from_repository(
+                args.install_from_repo,
+                skip_update_check=args.debug and args.skip_update_check,
+            )
+        )
+    elif args.serve_cache:
+        from adapters import headless_adapter
+
+        sys.exit(headless_adapter.serve_cache(args.port))
+    elif args.prefetch:
+        from adapters import headless_adapter
+
+        sys.exit(headless_adapter.prefetch_recommended(args.rate_limit))
+    elif args.cli is True:
         from adapters import cli_adapter
 
         cli_adapter.main(skip_update_check=args.debug and args.skip_update_check)
@@ -58,6 +58,14 @@ class AppMainWindow(QMainWindow):
             _("Install from local copy"), "", parent=self
         )
         self.actions_list.append(self.actionInstallFromLocalCopy)
+        self.actionInstallPrepared = ActionsFactory(
+            _("Install prepared changes"), "", parent=self
+        )
+        self.actions_list.append(self.actionInstallPrepared)
+        self.actionRestorePrevious = ActionsFactory(
+            _("Restore previous LibreOffice"), "", parent=self
+        )
+        self.actions_list.append(self.actionRestorePrevious)
         self.actionHelp = ActionsFactory(
             _("Help"), "system-help", parent=self, shortcut="F1"
         )
@@ -82,6 +90,8 @@ class AppMainWindow(QMainWindow):
         menuTools.addAction(self.actionAddLanguages)
         menuTools.addAction(self.actionApplyChanges)
         menuTools.addAction(self.actionInstallFromLocalCopy)
+        menuTools.addAction(self.actionInstallPrepared)
+        menuTools.addAction(self.actionRestorePrevious)
 
         menuHelp = menubar.addMenu(_("&Help"))
         menuHelp.addAction(self.actionHelp)
@@ -358,6 +368,9 @@ class ConfirmApplyDialog(QDialog):
         self.checkbox_force_java_download = QCheckBox(_("Download Java"))
         # Initially disabled !
         self.checkbox_force_java_download.setEnabled(False)
+        self.checkbox_prepare_only = QCheckBox(
+            _("Only download and check packages, install later")
+        )
 
         self.buttonBox = QDialogButtonBox()
         self.apply_button = self.buttonBox.addButton(
@@ -370,6 +383,7 @@ class ConfirmApplyDialog(QDialog):
         main_layout.addWidget(self.info_box)
         main_layout.addWidget(self.checkbox_keep_packages)
         main_layout.addWidget(self.checkbox_force_java_download)
+        main_layout.addWidget(self.checkbox_prepare_only)
         main_layout.addWidget(self.buttonBox)
 
         self.setLayout(main_layout)